@@ -4,13 +4,20 @@ MedConnect Edge - Web UI (Vision-Aware Triage Version)
 """
 
 import streamlit as st
-import subprocess
 import json
 import os
+import sys
 import time
+import uuid
 import psutil
 from PIL import Image
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "inference"))
+import inference_client
+import metrics
+import pipeline_orchestrator
+import upload_store
+
 # Page config
 st.set_page_config(
     page_title="MedConnect Edge",
@@ -34,6 +41,10 @@ st.markdown("""
 # Initialize session state
 if 'results' not in st.session_state: st.session_state.results = None
 if 'exec_time' not in st.session_state: st.session_state.exec_time = 0.0
+# ID session untuk antrian server: klik Analyze lagi membatalkan job lama session ini
+if 'session_id' not in st.session_state: st.session_state.session_id = uuid.uuid4().hex
+# file_id uploader -> hash upload_store, supaya rerun tidak meng-hash / menulis ulang file
+if 'upload_hashes' not in st.session_state: st.session_state.upload_hashes = {}
 
 # Header
 st.markdown('<div class="main-header">🏥 MedConnect Edge</div>', unsafe_allow_html=True)
@@ -51,6 +62,10 @@ with st.sidebar:
     - 🧠 **Medical Advice** (LLM)
     """)
     st.divider()
+    # Hasil kasus yang sama diambil dari result cache; centang untuk memaksa model jalan ulang
+    bypass_cache = st.checkbox("Bypass result cache", value=False)
+    # Mode logits: satu forward pass + confidence, alasan dibuat hanya jika diminta
+    fast_triage = st.checkbox("Fast triage (confidence score)", value=False)
     st.warning("⚠️ AI Tool. NOT a Doctor.")
 
 # Main tabs
@@ -72,18 +87,21 @@ with tab1:
         st.write("📸 Clinical Image (Optional)")
         uploaded_file = st.file_uploader("Upload foto (Luka/Kulit)", type=['png', 'jpg', 'jpeg'])
         
-        image_path = None
+        image_hash = None
         if uploaded_file is not None:
             st.image(uploaded_file, caption="Preview", use_container_width=True)
-            temp_dir = "temp_images"
-            os.makedirs(temp_dir, exist_ok=True)
-            image_path = os.path.join(temp_dir, uploaded_file.name)
-            with open(image_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            # Disimpan sekali per isi file (SHA-256) + turunan 336px untuk vision, lihat upload_store.py
+            file_id = getattr(uploaded_file, "file_id", None)
+            image_hash = st.session_state.upload_hashes.get(file_id)
+            # File bisa sudah dihapus GC upload_store (umur / ukuran): simpan ulang dari upload
+            if image_hash is None or upload_store.path_for(image_hash) is None:
+                image_hash = upload_store.put_bytes(uploaded_file.getvalue(), uploaded_file.name)
+                if file_id is not None:
+                    st.session_state.upload_hashes[file_id] = image_hash
 
     # Analyze button
     if st.button("🔍 Analyze Case (Multimodal)", type="primary"):
-        if symptoms_input.strip() or image_path:
+        if symptoms_input.strip() or image_hash:
             
             st.session_state.results = None
             start_time = time.time()
@@ -92,102 +110,125 @@ with tab1:
             vision_data = None
             ai_data = None
             
-            # --- LOGIKA BARU: VISION FIRST ---
-            # Kita jalankan Vision dulu agar hasilnya bisa dipakai untuk Triase
-
-            # 1. ANALISIS GAMBAR (VISUAL)
-            vision_context_text = ""
-            if image_path:
-                with st.spinner("1/3 Analyzing Clinical Image (Vision AI)..."):
-                    try:
-                        res_vision = subprocess.run(
-                            ["./run.sh", "python", "src/inference/medvision_analyze.py", 
-                             "--image", image_path, "--json"],
-                            capture_output=True, text=True
-                        )
-                        output_lines = res_vision.stdout.strip().split('\n')
-                        for line in output_lines:
-                            clean_line = line.strip()
-                            if clean_line.startswith('{') and clean_line.endswith('}') and '"status":' in clean_line:
-                                try:
-                                    vision_data = json.loads(clean_line)
-                                    # Ambil teks hasil vision untuk context triase
-                                    if vision_data.get('status') == 'success':
-                                        vision_context_text = vision_data.get('analysis', '')
-                                    break
-                                except: continue
-                    except Exception as e:
-                        st.warning(f"Vision AI Error: {e}")
-
-            # 2. ANALISIS TEKS (TRIASE)
-            # Sekarang Triase lebih pintar karena tahu konteks gambar
-            with st.spinner("2/3 Performing Triage Assessment..."):
-                try:
-                    # Gabungkan input user + hasil vision
-                    combined_input = symptoms_input
-                    if vision_context_text:
-                        combined_input += f" [Visual Context from Image: {vision_context_text}]"
-                    
-                    # Jika input user kosong tapi ada gambar, pakai deskripsi gambar sebagai input triase
-                    if not symptoms_input.strip() and vision_context_text:
-                        combined_input = f"Patient condition based on image: {vision_context_text}"
-
-                    if combined_input.strip():
-                        res_triage = subprocess.run(
-                            ["./run.sh", "python", "src/inference/triage_cli.py", "--symptoms", combined_input],
-                            capture_output=True, text=True
+            # Model sudah dimuat di inference server, jadi tidak perlu spawn proses per request
+            if not inference_client.ensure_server():
+                st.error("Inference server gagal start. Cek logs/inference_server.log")
+                st.stop()
+
+            # Antrian admission server: satu kasus memakai model pada satu waktu (RAM 4 GB),
+            # kasus dengan red flag EMERGENCY didahulukan (lihat job_queue.py)
+            stage_timings = {}
+            queue_box = st.empty()
+
+            def on_wait(ticket):
+                queue_box.info(
+                    f"⏳ Menunggu giliran: antrian #{ticket['position']} dari {ticket['queue_depth']} "
+                    f"(prioritas {ticket['priority']}), estimasi ~{ticket['eta_s']:.0f} detik"
+                )
+
+            with inference_client.admitted(st.session_state.session_id, symptoms_input, on_wait) as ticket:
+                queue_box.empty()
+                job_id = ticket["job_id"] if ticket and ticket.get("state") == "active" else None
+                if ticket is not None and job_id is None:
+                    if ticket.get("state") == "rejected":
+                        st.warning(f"⚠️ Antrian penuh ({ticket.get('queue_depth')} kasus). "
+                                   f"Coba lagi dalam ~{ticket.get('retry_after_s', 0):.0f} detik.")
+                    else:
+                        st.warning("⚠️ Kasus dibatalkan dari antrian. Silakan klik Analyze lagi.")
+                else:
+                    if ticket is not None:
+                        stage_timings["queue"] = {"start_ms": 0.0, "wall_ms": round(ticket.get("wait_s", 0) * 1000, 1),
+                                                  "status": ticket["priority"]}
+
+                    # 1-2. RAG + triase sementara (teks) + vision jalan paralel, triase ulang hanya jika
+                    # konteks visual bisa mengubah keputusan (lihat pipeline_orchestrator.py)
+                    stage_labels = {
+                        "rag": "Retrieving Kemenkes references",
+                        "triage_text": "Provisional triage (text)",
+                        "vision": "Analyzing Clinical Image (Vision AI)",
+                        "triage_final": "Final triage assessment",
+                    }
+                    with st.status("1/2 Running RAG, Triage & Vision in parallel...", expanded=False) as status:
+                        def on_stage_done(name, result):
+                            if result is not None:
+                                st.write(f"✅ {stage_labels.get(name, name)}")
+
+                        pipeline = pipeline_orchestrator.build_case_pipeline(
+                            symptoms_input, None, bypass_cache, "logits" if fast_triage else "generate",
+                            job_id=job_id, image_hash=image_hash
                         )
-                        if res_triage.returncode == 0:
-                            lines = res_triage.stdout.strip().split('\n')
-                            for line in lines:
-                                if line.strip().startswith('{') and line.strip().endswith('}'):
-                                    try:
-                                        triage_data = json.loads(line)
-                                        break
-                                    except: continue
-                except Exception as e:
-                    st.error(f"Triage Error: {e}")
-
-            # 3. EXPLAINER (GABUNGAN)
-            if triage_data:
-                with st.spinner("3/3 Generating Final Medical Advice..."):
-                    
-                    vision_arg = []
-                    if vision_context_text:
-                        vision_arg = ["--vision-text", vision_context_text]
-                    
-                    # Gunakan input asli user untuk prompt penjelasan agar lebih natural
-                    final_symptoms = symptoms_input if symptoms_input.strip() else "Analisis visual saja."
-
-                    cmd = ["./run.sh", "python", "src/inference/medgemma_explain.py",
-                           "--symptoms", final_symptoms,
-                           "--triage-level", triage_data['triage_level'],
-                           "--triage-note", triage_data['note'],
-                           "--json"] + vision_arg 
-
-                    res_explain = subprocess.run(
-                        cmd,
-                        capture_output=True, text=True
-                    )
-                    
-                    if res_explain.returncode == 0:
-                        lines = res_explain.stdout.strip().split('\n')
-                        for line in lines:
-                            if line.strip().startswith('{') and line.strip().endswith('}'):
-                                try:
-                                    ai_data = json.loads(line)
-                                    break
-                                except: continue
+                        stage_results, pipeline_timings = pipeline.run(on_stage_done)
+                        stage_timings.update(pipeline_timings)
+                        status.update(label="1/2 Triage & Vision done", state="complete")
+
+                    vision_context_text = ""
+                    vision_data = stage_results.get("vision")
+                    if vision_data and vision_data.get('status') == 'success':
+                        vision_context_text = vision_data.get('analysis', '')
+                    elif vision_data:
+                        st.warning(f"Vision AI Error: {vision_data.get('analysis') or vision_data.get('error')}")
+
+                    res_triage = stage_results.get("triage_final")
+                    if res_triage and 'triage_level' in res_triage:
+                        triage_data = res_triage
+                    elif res_triage:
+                        st.error(f"Triage Error: {res_triage.get('error') or res_triage.get('note')}")
+
+                    rag_result = stage_results.get("rag")
+                    rag_context = rag_result.get("rag_context") if rag_result and rag_result.get("status") == "ok" else None
+
+                    # 3. EXPLAINER (GABUNGAN)
+                    # Token ditampilkan begitu keluar, jadi user hanya menunggu time-to-first-token
+                    if triage_data:
+                        # Gunakan input asli user untuk prompt penjelasan agar lebih natural
+                        final_symptoms = symptoms_input if symptoms_input.strip() else "Analisis visual saja."
+
+                        events = inference_client.stream("/explain/stream", {
+                            "symptoms": final_symptoms,
+                            "triage_level": triage_data['triage_level'],
+                            "triage_note": triage_data['note'],
+                            "vision_text": vision_context_text or None,
+                            "no_cache": bypass_cache,
+                            "rag_context": rag_context,
+                            "job_id": job_id
+                        })
+                        if events is not None:
+                            final_event = {}
+                            explain_start = time.time()
+
+                            def explain_tokens():
+                                for event in events:
+                                    if event.get('type') == 'token':
+                                        yield event['text']
+                                    else:
+                                        final_event.update(event)
+
+                            live_box = st.empty()
+                            with live_box.container():
+                                st.caption("2/2 Generating Final Medical Advice...")
+                                st.write_stream(explain_tokens())
+                            # Hasil lengkap dirender ulang di bagian DISPLAY RESULTS
+                            live_box.empty()
+
+                            if final_event.get('status') == 'success':
+                                ai_data = final_event
+                            stage_timings["explain"] = {
+                                "start_ms": round((explain_start - start_time) * 1000, 1),
+                                "wall_ms": round((time.time() - explain_start) * 1000, 1),
+                                "status": "ok" if ai_data else "error",
+                            }
 
             # Stop Stopwatch
             end_time = time.time()
             st.session_state.exec_time = end_time - start_time
             
             # Simpan Hasil
+            stage_timings["total_ms"] = round(st.session_state.exec_time * 1000, 1)
             st.session_state.results = {
                 'triage': triage_data,
                 'vision': vision_data,
-                'ai': ai_data
+                'ai': ai_data,
+                'timings': stage_timings
             }
             
         else:
@@ -208,9 +249,25 @@ with tab1:
             
             st.markdown(f'<div class="{cls}">', unsafe_allow_html=True)
             st.markdown(f"## {icn} Triage Level: {lvl}")
-            st.markdown(f"**Assessment:** {triage['note']}")
+            if triage.get('note'):
+                st.markdown(f"**Assessment:** {triage['note']}")
+            if triage.get('probabilities'):
+                probs = " · ".join(f"{k}: {v * 100:.0f}%" for k, v in triage['probabilities'].items())
+                st.markdown(f"**Confidence:** {triage['confidence'] * 100:.0f}% ({probs})")
+            if triage.get('source') == 'rules':
+                st.caption("⚡ Red flag terdeteksi rule engine (tanpa LLM)")
             st.markdown('</div>', unsafe_allow_html=True)
 
+            # Mode logits: alasan triase baru dibuat saat diminta
+            if triage.get('reason_pending') and st.button("💬 Show triage reason"):
+                res_reason = inference_client.request("/triage/reason", {
+                    "symptoms": triage['input'], "level": triage['triage_level']
+                })
+                if res_reason and res_reason.get('status') == 'success':
+                    triage['note'] = res_reason['reason']
+                    triage['reason_pending'] = False
+                    st.rerun()
+
         # Vision AI Result
         if st.session_state.results.get('vision'):
             vis = st.session_state.results['vision']
@@ -233,6 +290,17 @@ with tab1:
             st.header("💡 Medical Explanation")
             st.markdown(ai.get('ai_explanation'))
             st.caption(f"Reasoning Model: {ai.get('model')}")
+
+        # Wall time per stage (stage paralel bisa tumpang tindih)
+        timings = st.session_state.results.get('timings')
+        if timings:
+            with st.expander("⏱️ Stage Timings"):
+                rows = [
+                    {"stage": name, "start (ms)": t.get("start_ms"), "wall (ms)": t.get("wall_ms"), "status": t.get("status")}
+                    for name, t in timings.items() if isinstance(t, dict)
+                ]
+                st.dataframe(rows, use_container_width=True)
+                st.caption(f"End-to-end: {timings['total_ms'] / 1000:.2f}s")
             
         st.divider()
         st.error("**⚠️ CRITICAL DISCLAIMER:** AI output only. Consult a doctor.")
@@ -273,6 +341,71 @@ with tab2:
     with col3:
         st.metric("RAM Usage", f"{used_ram_gb:.1f}/{total_ram_gb:.1f} GB ({ram_percent}%)")
 
+    # Memori per model dari inference server (model registry)
+    if inference_client.is_alive():
+        res_models = inference_client.request("/models", timeout=5)
+        if res_models and res_models.get('models'):
+            st.subheader("Loaded Models")
+            st.dataframe(res_models['models'], use_container_width=True)
+
+        res_sched = inference_client.request("/scheduler", timeout=5)
+        if res_sched and res_sched.get('scheduler'):
+            sched = res_sched['scheduler']
+            hit_rate = f"{sched['hit_rate'] * 100:.0f}%" if sched.get('hit_rate') is not None else "-"
+            budget = f"{sched['budget_mb'] / 1024:.1f} GB" if sched.get('budget_mb') else "Unlimited"
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Model RAM Budget", budget, f"{sched['resident_mb'] / 1024:.1f} GB resident", delta_color="off")
+            c2.metric("Model Loads", sched['loads'])
+            c3.metric("Evictions (LRU)", sched['evictions'])
+            c4.metric("Model Hit Rate", hit_rate)
+
+        res_cache = inference_client.request("/result-cache", timeout=5)
+        if res_cache and res_cache.get('result_cache'):
+            rc = res_cache['result_cache']
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Result Cache Hits", rc['hits'])
+            c2.metric("Result Cache Misses", rc['misses'])
+            c3.metric("Result Hit Rate", f"{rc['hit_rate'] * 100:.0f}%")
+            c4.metric("Cached Results", rc.get('entries', 0), f"{rc.get('size_mb', 0):.1f} MB", delta_color="off")
+
+        res_queue = inference_client.request("/queue", timeout=5)
+        if res_queue and res_queue.get('queue'):
+            q = res_queue['queue']
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Queue Depth", q['queue_depth'], f"{q['queued_by_priority']['EMERGENCY']} emergency", delta_color="off")
+            c2.metric("Active Cases", f"{q['active']}/{q['max_active']}")
+            c3.metric("Avg Case Time", f"{q['avg_service_s']:.0f}s")
+            c4.metric("Cancelled", q['cancelled'], f"{q['rejected']} rejected", delta_color="off")
+
+        res_rules = inference_client.request("/triage-rules", timeout=5)
+        if res_rules and res_rules.get('triage_rules'):
+            tr = res_rules['triage_rules']
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Triage by Rules", tr['rule_decisions'])
+            c2.metric("Triage by LLM", tr['llm_calls'])
+            c3.metric("LLM Calls Avoided", f"{tr['llm_avoided_fraction'] * 100:.0f}%")
+    else:
+        st.caption("Inference server belum berjalan — model belum dimuat.")
+
+    # p50/p95 per span (load model, prompt eval, generate, RAG, encode gambar)
+    st.subheader("Per-Stage Latency")
+    span_rows = None
+    if inference_client.is_alive():
+        res_metrics = inference_client.request("/metrics/summary", timeout=5)
+        span_rows = res_metrics.get('metrics') if res_metrics else None
+    if span_rows is None:
+        # Server mati: hitung dari log JSONL run sebelumnya
+        span_rows = metrics.summary_from_log()
+    if span_rows:
+        st.dataframe(
+            [{"Span": r['span'], "n": r['n'], "p50 (ms)": r['p50_ms'], "p95 (ms)": r['p95_ms'],
+              "Mean (ms)": r['mean_ms'], "Tokens": r.get('tokens')} for r in span_rows],
+            use_container_width=True
+        )
+        st.caption(f"Jendela {metrics.WINDOW} sampel terakhir per span · log: {metrics.LOG_PATH} · Prometheus: GET /metrics")
+    else:
+        st.caption("Belum ada data metrics.")
+
     if st.button("🔄 Refresh Stats"):
         st.rerun()
 
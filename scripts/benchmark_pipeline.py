@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end: RAG, triase, vision, explain, dan pipeline lengkap (Analyze Case).
+Mencatat latency cold (model dimuat ulang) vs warm, TTFT, token/s, peak RSS, dan kesesuaian
+label triase. Report JSON (key terurut) bisa di-diff antar commit.
+
+    ./run.sh python scripts/benchmark_pipeline.py --output benchmarks/report.json
+    python scripts/benchmark_pipeline.py --mock --output report.json    # tanpa file GGUF (CI)
+    python scripts/benchmark_pipeline.py --compare benchmarks/report.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src" / "inference"))
+
+STAGES = ["rag", "triage", "vision", "explain", "pipeline"]
+
+# Label yang diharapkan dari dokter; "image" dipakai di stage pipeline
+DEFAULT_CASES = [
+    {"id": "dbd", "symptoms": "demam tinggi 4 hari, bintik merah, nyeri sendi", "expected": "URGENT"},
+    {"id": "jantung", "symptoms": "nyeri dada menjalar ke lengan, keringat dingin", "expected": "EMERGENCY"},
+    {"id": "sesak", "symptoms": "anak sesak napas dan bibir kebiruan", "expected": "EMERGENCY"},
+    {"id": "flu", "symptoms": "batuk pilek sejak kemarin", "expected": "NON-URGENT"},
+    {"id": "umum", "symptoms": "ini bahaya gak?", "expected": "NON-URGENT"},
+    {"id": "diare", "symptoms": "diare 2 kali hari ini, masih bisa minum", "expected": "NON-URGENT"},
+    {"id": "muntah", "symptoms": "muntah terus dan lemas sejak pagi", "expected": "URGENT"},
+    {"id": "luka", "symptoms": "kaki tertusuk paku, luka dalam dan berdarah", "expected": "URGENT",
+     "image": "temp_images/luka.jpeg"},
+]
+
+# Korpus referensi kecil untuk --mock (index NumPy + BM25 dibuat di workspace sementara)
+MOCK_DOCS = [
+    "Demam berdarah dengue ditandai demam tinggi mendadak, bintik merah, dan nyeri sendi. Segera ke puskesmas.",
+    "Nyeri dada yang menjalar ke lengan disertai keringat dingin adalah tanda serangan jantung. Hubungi 119.",
+    "Sesak napas pada anak dengan bibir kebiruan merupakan kegawatdaruratan.",
+    "Batuk pilek biasa cukup istirahat, minum air putih, dan konsumsi makanan bergizi.",
+    "Diare: berikan oralit dan zinc, perhatikan tanda dehidrasi.",
+    "Muntah terus-menerus berisiko dehidrasi, periksakan ke fasilitas kesehatan.",
+    "Luka tusuk dalam perlu dibersihkan dan dievaluasi untuk vaksin tetanus.",
+    "Luka bakar ringan didinginkan dengan air mengalir selama 20 menit.",
+]
+
+
+# ==========================================
+# MOCK LLM (CI tanpa file GGUF)
+# ==========================================
+class MockLlama:
+    """
+    Pengganti llama_cpp.Llama untuk --mock: jawaban deterministik, latency sintetis
+    sebanding jumlah token (load, prompt eval, decode). Angka absolutnya tidak bermakna;
+    gunanya memastikan seluruh jalur kode + report tetap jalan di CI.
+    """
+
+    LOAD_S = 0.05
+    EVAL_S_PER_TOKEN = 0.0001
+    DECODE_S_PER_TOKEN = 0.002
+    IMAGE_TOKENS = 576
+
+    def __init__(self, model_path, n_ctx, clip_model_path=None):
+        time.sleep(self.LOAD_S)
+        self.model_path = model_path
+        self._n_ctx = n_ctx
+        self.chat_handler = None
+        self.n_tokens = 0
+        self.input_ids = []
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text, add_bos=True, special=False):
+        ids = [zlib.crc32(word) % 32000 for word in text.split()]
+        return ([1] if add_bos else []) + ids
+
+    def reset(self):
+        self.n_tokens = 0
+        self.input_ids = []
+
+    def eval(self, tokens):
+        time.sleep(len(tokens) * self.EVAL_S_PER_TOKEN)
+        self.input_ids = list(self.input_ids) + list(tokens)
+        self.n_tokens = len(self.input_ids)
+
+    def _pieces(self, prompt, max_tokens):
+        if "Input Pasien:" in prompt:
+            import triage_rules
+            rule = triage_rules.classify(prompt.rsplit("Input Pasien:", 1)[1])
+            text = json.dumps({"level": rule["level"] if rule else "NON-URGENT", "reason": "mock"})
+            pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        else:
+            pieces = [w + " " for w in ("Berdasarkan panduan, istirahat cukup, minum air putih, "
+                                        "dan segera ke puskesmas bila keluhan memburuk.").split()] * 8
+        return pieces[:max_tokens]
+
+    def _decode(self, pieces):
+        for piece in pieces:
+            time.sleep(self.DECODE_S_PER_TOKEN)
+            yield {"choices": [{"text": piece}]}
+
+    def __call__(self, prompt, max_tokens=16, stream=False, **kwargs):
+        self.reset()
+        self.eval(self.tokenize(prompt.encode("utf-8")))
+        pieces = self._pieces(prompt, max_tokens)
+        if stream:
+            return self._decode(pieces)
+        for _ in self._decode(pieces):
+            pass
+        return {"choices": [{"text": "".join(pieces)}], "usage": {"completion_tokens": len(pieces)}}
+
+    def create_chat_completion(self, messages, max_tokens=300, **kwargs):
+        self.reset()
+        self.eval([0] * self.IMAGE_TOKENS)
+        pieces = [w + " " for w in "Tampak luka terbuka kemerahan dengan tepi tidak rata.".split()][:max_tokens]
+        for _ in self._decode(pieces):
+            pass
+        return {"choices": [{"message": {"content": "".join(pieces).strip()}}],
+                "usage": {"completion_tokens": len(pieces)}}
+
+
+class MockEmbedder:
+    """Hashing bag-of-words 64 dimensi (pengganti sentence-transformers untuk --mock)"""
+
+    DIM = 64
+
+    def __init__(self, model_name=None):
+        import bm25_index
+        self._tokenize = bm25_index.tokenize
+
+    def embed_query(self, text):
+        vec = np.zeros(self.DIM, dtype=np.float32)
+        for token in self._tokenize(text):
+            vec[zlib.crc32(token.encode("utf-8")) % self.DIM] += 1.0
+        return vec
+
+    def embed_documents(self, texts, batch_size=64):
+        return np.stack([self.embed_query(t) for t in texts])
+
+
+def setup_mock(modules):
+    """Placeholder file model + Llama palsu + index RAG kecil di workspace (cwd) sementara"""
+    import bm25_index
+    import model_registry
+    import vector_index
+
+    triage_cli, medvision_analyze = modules["triage_cli"], modules["medvision_analyze"]
+    for path in (triage_cli.MODEL_PATH, medvision_analyze.MODEL_PATH, medvision_analyze.CLIP_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Path(path).write_bytes(b"GGUF-mock")
+    model_registry._build_llama = MockLlama
+
+    vector_index.SentenceEmbedder = MockEmbedder
+    chunks = [{"text": text} for text in MOCK_DOCS]
+    vector_index.save_index(vector_index.INDEX_PATH, MockEmbedder().embed_documents(MOCK_DOCS), chunks, "mock-hash-64")
+    writer = bm25_index.Bm25Writer(bm25_index.BM25_PATH)
+    writer.append(chunks)
+    writer.close()
+
+
+# ==========================================
+# PENGUKURAN
+# ==========================================
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2, 1)
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def tokens_per_s(tokens, total_ms, ttft_ms):
+    decode_s = ((total_ms or 0) - (ttft_ms or 0)) / 1000
+    if not tokens or tokens < 2 or decode_s <= 0:
+        return None
+    return round((tokens - 1) / decode_s, 2)
+
+
+def summarize(samples):
+    """p50/p95 latency + rata-rata TTFT dan token/s (hanya sampel yang punya angkanya)"""
+    latency = [s["ms"] for s in samples]
+    out = {
+        "n": len(samples),
+        "p50_ms": round(float(np.percentile(latency, 50)), 1),
+        "p95_ms": round(float(np.percentile(latency, 95)), 1),
+        "mean_ms": round(float(np.mean(latency)), 1),
+    }
+    for key in ("ttft_ms", "tokens", "tokens_per_s"):
+        values = [s[key] for s in samples if s.get(key) is not None]
+        if values:
+            out[f"mean_{key}"] = round(float(np.mean(values)), 2)
+    errors = sum(1 for s in samples if s.get("error"))
+    if errors:
+        out["errors"] = errors
+    return out
+
+
+def unload_models(modules):
+    import model_registry
+    for path in {modules["triage_cli"].MODEL_PATH, modules["medvision_analyze"].MODEL_PATH}:
+        model_registry.unload(path)
+
+
+class Bench:
+    def __init__(self, modules, cases, images):
+        self.m = modules
+        self.cases = cases
+        self.images = images
+        self.rag_contexts = {}
+        self.labels = {}
+
+    def rag(self, case):
+        timings = {}
+        t0 = time.time()
+        context = self.m["medgemma_explain"].get_rag_context(case["symptoms"], timings)
+        self.rag_contexts[case["id"]] = context
+        rag = timings.get("rag", {})
+        return {"ms": (time.time() - t0) * 1000, "refs": context.count("\n") + 1 if context else 0,
+                "embed_ms": rag.get("embed_ms"), "search_ms": rag.get("search_ms"), "bm25_ms": rag.get("bm25_ms"),
+                "result_cached": rag.get("result_cached")}
+
+    def triage(self, case):
+        timings = {}
+        t0 = time.time()
+        level, note = self.m["triage_cli"].get_ai_triage(case["symptoms"], timings)
+        self.labels[case["id"]] = level
+        tokens = timings.get("completion_tokens")
+        return {"ms": (time.time() - t0) * 1000, "label": level, "ttft_ms": timings.get("ttft_ms"),
+                "tokens": tokens, "tokens_per_s": tokens_per_s(tokens, timings.get("total_ms"), timings.get("ttft_ms")),
+                "prefix": (timings.get("prefix") or {}).get("source"),
+                "error": note if "total_ms" not in timings else None}
+
+    def vision(self, image):
+        mv = self.m["medvision_analyze"]
+        t0 = time.time()
+        result = mv.analyze_medical_image(image, mv.DEFAULT_QUERY, use_cache=False)
+        timings = result.get("timings", {})
+        return {"ms": (time.time() - t0) * 1000, "image": os.path.basename(image),
+                "preprocess_ms": timings.get("preprocess_ms"), "clip_cached": timings.get("clip_cached"),
+                "tokens": timings.get("completion_tokens"),
+                "error": result["analysis"] if result.get("status") != "success" else None}
+
+    def explain(self, case):
+        me = self.m["medgemma_explain"]
+        timings = {}
+        t0 = time.time()
+        tokens = 0
+        try:
+            for _ in me.stream_medical_explanation(case["symptoms"], self.labels.get(case["id"], "NON-URGENT"), "",
+                                                   None, timings, rag_context=self.rag_contexts.get(case["id"])):
+                tokens += 1
+            error = None
+        except Exception as e:
+            error = str(e)
+        return {"ms": (time.time() - t0) * 1000, "ttft_ms": timings.get("ttft_ms"), "tokens": tokens,
+                "tokens_per_s": tokens_per_s(tokens, timings.get("total_ms"), timings.get("ttft_ms")), "error": error}
+
+    def pipeline(self, case):
+        """Sama seperti Analyze Case di app.py, tapi handler server dipanggil langsung di proses ini"""
+        server = self.m["inference_server"]
+        orchestrator = self.m["pipeline_orchestrator"]
+        t0 = time.time()
+        image = case.get("image")
+        results, stage_timings = orchestrator.build_case_pipeline(
+            case["symptoms"], image, no_cache=True, call=lambda endpoint, payload: server.POST_ROUTES[endpoint](payload)
+        ).run()
+        final = results.get("triage_final") or {}
+        vis = results.get("vision") or {}
+        rag = results.get("rag") or {}
+        explanation = self.m["medgemma_explain"].generate_medical_explanation(
+            case["symptoms"], final.get("triage_level", "NON-URGENT"), final.get("note", ""),
+            vis.get("analysis") if vis.get("status") == "success" else None,
+            use_cache=False, rag_context=rag.get("rag_context")
+        )
+        return {"ms": (time.time() - t0) * 1000, "label": final.get("triage_level"), "source": final.get("source"),
+                "retriaged": final.get("retriaged"), "with_image": bool(image),
+                "stage_wall_ms": {k: v["wall_ms"] for k, v in stage_timings.items() if isinstance(v, dict)},
+                "explain_ms": (explanation.get("timings") or {}).get("total_ms"),
+                "error": explanation["ai_explanation"] if explanation.get("status") != "success" else None}
+
+    def run_stage(self, name, repeat):
+        fn = getattr(self, name)
+        items = self.images if name == "vision" else self.cases
+        if not items:
+            return {"skipped": "tidak ada input"}
+
+        unload_models(self.m)
+        rss_before = rss_mb()
+        cold = fn(items[0])
+        warm = [fn(item) for _ in range(repeat) for item in items]
+        for sample in [cold] + warm:
+            sample["ms"] = round(sample["ms"], 1)
+
+        out = {"cold": cold, "warm": summarize(warm), "rss_before_mb": rss_before, "rss_after_mb": rss_mb(),
+               "peak_rss_mb": peak_rss_mb()}
+        if name in ("triage", "pipeline"):
+            labelled = [(case, sample) for case, sample in zip(self.cases, warm[:len(self.cases)]) if case.get("expected")]
+            if labelled:
+                out["label_agreement"] = round(sum(s["label"] == c["expected"] for c, s in labelled) / len(labelled), 3)
+                out["per_case"] = [{"id": c["id"], "expected": c["expected"], "label": s["label"]} for c, s in labelled]
+        return out
+
+
+# ==========================================
+# REPORT
+# ==========================================
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Cetak perubahan p50 warm, latency cold, dan label agreement per stage"""
+    print("\n📈 Dibanding report lama" + (f" ({old['meta'].get('git_commit')})" if old.get("meta") else "") + ":")
+    for stage, cur in new["stages"].items():
+        prev = old.get("stages", {}).get(stage)
+        if not prev or "warm" not in prev or "warm" not in cur:
+            continue
+        for label, a, b in (("warm p50", prev["warm"]["p50_ms"], cur["warm"]["p50_ms"]),
+                            ("cold", prev["cold"]["ms"], cur["cold"]["ms"])):
+            delta = (b - a) / a * 100 if a else 0.0
+            print(f"   {stage:9s} {label:9s} {a:9.1f} -> {b:9.1f} ms ({delta:+.1f}%)")
+        if "label_agreement" in cur and "label_agreement" in prev:
+            print(f"   {stage:9s} agreement {prev['label_agreement']:.3f} -> {cur['label_agreement']:.3f}")
+
+
+def load_cases(path):
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f, 1):
+            if line.strip():
+                case = json.loads(line)
+                case.setdefault("id", f"case-{i}")
+                cases.append(case)
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mock", action="store_true", help="Llama + embedding palsu, tanpa file GGUF (CI)")
+    parser.add_argument("--cases", help="JSONL {\"id\", \"symptoms\", \"expected\", \"image\"} (default: kasus bawaan)")
+    parser.add_argument("--images", nargs="*", help="Gambar untuk stage vision (default: gambar di kasus)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Subset stage, dipisah koma: {','.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=2, help="Putaran warm per kasus")
+    parser.add_argument("--keep-caches", action="store_true",
+                        help="Pakai cache prefix KV / CLIP yang ada (default: direktori sementara supaya cold benar-benar cold)")
+    parser.add_argument("--output", help="Simpan report JSON ke file ini")
+    parser.add_argument("--compare", help="Report JSON lama untuk dibandingkan")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Stage tidak dikenal: {', '.join(sorted(unknown))}")
+
+    cases = load_cases(args.cases) if args.cases else [dict(c) for c in DEFAULT_CASES]
+    base = Path(args.cases).resolve().parent if args.cases else ROOT
+    for case in cases:
+        if case.get("image"):
+            case["image"] = str((base / case["image"]).resolve())
+    images = [str(Path(p).resolve()) for p in args.images] if args.images else \
+        sorted({c["image"] for c in cases if c.get("image")})
+    missing = [p for p in images if not os.path.exists(p)]
+    if missing:
+        print(f"❌ Gambar tidak ditemukan: {', '.join(missing)}")
+        return 1
+    # Path relatif terhadap cwd pemanggil: --mock pindah ke direktori kerja sementara
+    output = os.path.abspath(args.output) if args.output else None
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    workdir = tempfile.mkdtemp(prefix="medconnect_bench_")
+    try:
+        return run(args, stages, cases, images, output, workdir)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run(args, stages, cases, images, output, workdir):
+    # Env dibaca modul saat import, jadi atur sebelum import
+    os.environ["MEDCONNECT_PRELOAD_NEXT"] = "0"  # load model masuk ke angka cold stage yang memakainya
+    os.environ["MEDCONNECT_RESULT_CACHE"] = "0"
+    os.environ["MEDCONNECT_METRICS_LOG"] = os.path.join(workdir, "metrics.jsonl")  # log produksi tidak tercampur
+    if not args.keep_caches:
+        os.environ["MEDCONNECT_PREFIX_CACHE_DIR"] = os.path.join(workdir, "prefix_kv")
+        os.environ["MEDCONNECT_CLIP_CACHE_DIR"] = os.path.join(workdir, "clip_embed")
+    if args.mock:
+        os.environ["MEDCONNECT_RAG_BACKEND"] = "numpy"
+        os.environ["MEDCONNECT_PREFIX_CACHE"] = "0"
+        os.chdir(workdir)
+
+    import inference_server
+    import medgemma_explain
+    import metrics
+    import medvision_analyze
+    import pipeline_orchestrator
+    import triage_cli
+
+    modules = {
+        "inference_server": inference_server,
+        "medgemma_explain": medgemma_explain,
+        "medvision_analyze": medvision_analyze,
+        "pipeline_orchestrator": pipeline_orchestrator,
+        "triage_cli": triage_cli,
+    }
+    if args.mock:
+        setup_mock(modules)
+    elif not os.path.exists(triage_cli.MODEL_PATH):
+        print(f"❌ Model tidak ditemukan: {triage_cli.MODEL_PATH} (pakai --mock untuk CI)")
+        return 1
+
+    bench = Bench(modules, cases, images)
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_commit": git_commit(),
+            "mock": args.mock,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "cases": len(cases),
+            "images": [os.path.basename(p) for p in images],
+        },
+        "stages": {},
+    }
+    for stage in stages:
+        print(f"⏳ {stage}...")
+        report["stages"][stage] = bench.run_stage(stage, args.repeat)
+        result = report["stages"][stage]
+        if "warm" in result:
+            print(f"   cold {result['cold']['ms']} ms | warm p50 {result['warm']['p50_ms']} ms"
+                  f" p95 {result['warm']['p95_ms']} ms")
+    report["peak_rss_mb"] = peak_rss_mb()
+    # Breakdown per fase (load, prompt eval, generate, embed, search, encode) dari instrumentasi
+    report["spans"] = metrics.summary()
+
+    print("\n📊 Pipeline Benchmark:")
+    print("-" * 60)
+    print(json.dumps(report, indent=2, ensure_ascii=False, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    if output:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, sort_keys=True)
+        print(f"\n✅ Report disimpan ke: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
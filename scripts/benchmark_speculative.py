@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Benchmark penjelasan RAG: decoding biasa vs prompt-lookup speculative (token/s + output identik di temperature 0)"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src" / "inference"))
+
+import medgemma_explain
+import model_registry
+
+# (keluhan, level triase): kasus yang referensi Kemenkes-nya banyak dikutip
+DEFAULT_CASES = [
+    ("demam tinggi 4 hari, bintik merah, nyeri sendi", "URGENT"),
+    ("diare cair lebih dari 3 kali sehari", "NON-URGENT"),
+    ("luka bakar pada tangan kena air panas", "URGENT"),
+    ("batuk lebih dari 2 minggu dan berat badan turun", "URGENT"),
+    ("gatal dan ruam kemerahan di kulit", "NON-URGENT"),
+]
+
+
+def run_mode(cases, contexts, speculative, num_pred_tokens=None):
+    model_registry.set_speculative(speculative, num_pred_tokens)
+    # Warm-up: load model + prefix KV cache supaya tidak masuk ke angka pertama
+    symptoms, level = cases[0]
+    for _ in medgemma_explain.stream_medical_explanation(symptoms, level, "-", None, rag_context=contexts[0],
+                                                         temperature=0.0):
+        pass
+
+    rows = []
+    for (symptoms, level), context in zip(cases, contexts):
+        timings = {}
+        pieces = list(medgemma_explain.stream_medical_explanation(
+            symptoms, level, "-", None, timings, rag_context=context, temperature=0.0
+        ))
+        decode_s = (timings["total_ms"] - timings["ttft_ms"]) / 1000
+        rows.append({
+            "symptoms": symptoms,
+            "text": "".join(pieces),
+            "tokens": len(pieces),
+            "total_ms": timings["total_ms"],
+            "tokens_per_s": round((len(pieces) - 1) / decode_s, 2) if decode_s > 0 and len(pieces) > 1 else 0.0,
+            "speculative": timings.get("speculative", False),
+        })
+    return rows
+
+
+def first_diff(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return None if len(a) == len(b) else min(len(a), len(b))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", help="JSONL {\"symptoms\", \"level\"} (default: kasus bawaan)")
+    parser.add_argument("--num-pred-tokens", type=int, default=model_registry.SPEC_NUM_PRED_TOKENS,
+                        help="Jumlah token draft per langkah verifikasi")
+    parser.add_argument("--output", help="Simpan report JSON ke file ini")
+    args = parser.parse_args()
+
+    if not Path(medgemma_explain.MODEL_PATH).exists():
+        print(f"❌ Model tidak ditemukan: {medgemma_explain.MODEL_PATH}")
+        return 1
+    if model_registry.speculative_decoder() is None:
+        print("❌ llama_cpp.llama_speculative tidak tersedia (upgrade llama-cpp-python)")
+        return 1
+
+    cases = DEFAULT_CASES
+    if args.cases:
+        with open(args.cases, encoding="utf-8") as f:
+            cases = [(r["symptoms"], r.get("level", "URGENT")) for r in map(json.loads, filter(str.strip, f))]
+
+    # Konteks RAG diambil sekali supaya kedua mode mendapat prompt yang sama persis
+    contexts = [medgemma_explain.get_rag_context(symptoms) for symptoms, _ in cases]
+
+    baseline = run_mode(cases, contexts, speculative=False)
+    speculative = run_mode(cases, contexts, speculative=True, num_pred_tokens=args.num_pred_tokens)
+
+    base_tps = float(np.mean([r["tokens_per_s"] for r in baseline]))
+    spec_tps = float(np.mean([r["tokens_per_s"] for r in speculative]))
+    report = {
+        "cases": len(cases),
+        "num_pred_tokens": args.num_pred_tokens,
+        "baseline": {"mean_tokens_per_s": round(base_tps, 2),
+                     "p50_ms": round(float(np.percentile([r["total_ms"] for r in baseline], 50)), 1)},
+        "speculative": {"mean_tokens_per_s": round(spec_tps, 2),
+                        "p50_ms": round(float(np.percentile([r["total_ms"] for r in speculative], 50)), 1)},
+        "speedup": round(spec_tps / base_tps, 3) if base_tps else None,
+        "identical_outputs": sum(a["text"] == b["text"] for a, b in zip(baseline, speculative)),
+        "per_case": [
+            {"symptoms": a["symptoms"], "tokens": a["tokens"], "baseline_tps": a["tokens_per_s"],
+             "speculative_tps": b["tokens_per_s"], "identical": a["text"] == b["text"],
+             "first_diff_char": first_diff(a["text"], b["text"])}
+            for a, b in zip(baseline, speculative)
+        ],
+    }
+
+    print("\n📊 Speculative Decoding Benchmark (temperature 0):")
+    print("-" * 60)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if report["identical_outputs"] != len(cases):
+        print("⚠️  Output berbeda di temperature 0 — cek versi llama-cpp-python")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Report disimpan ke: {args.output}")
+    return 0 if report["identical_outputs"] == len(cases) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Benchmark triase: output JSON bebas vs grammar GBNF (token dihasilkan, latency, parse error)"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src" / "inference"))
+
+import triage_cli
+
+# Kasus campuran: red flag, ringan, dan pertanyaan umum
+DEFAULT_CASES = [
+    "demam tinggi 4 hari, bintik merah, nyeri sendi",
+    "nyeri dada menjalar ke lengan, keringat dingin",
+    "batuk pilek sejak kemarin",
+    "ini bahaya gak?",
+    "gatal dan ruam kemerahan di kulit",
+    "muntah terus dan lemas sejak pagi",
+    "luka di kaki tidak sembuh sudah seminggu",
+    "anak rewel dan tidak mau makan",
+]
+
+
+def run_mode(cases, use_grammar):
+    rows = []
+    for symptoms in cases:
+        timings = {}
+        level, reason = triage_cli.get_ai_triage(symptoms, timings, use_grammar=use_grammar)
+        rows.append({
+            "symptoms": symptoms,
+            "level": level,
+            "tokens": timings.get("completion_tokens", 0),
+            "total_ms": timings.get("total_ms", 0.0),
+            "parse_error": bool(timings.get("parse_error")),
+        })
+    return rows
+
+
+def summarize(rows):
+    tokens = [r["tokens"] for r in rows]
+    latency = [r["total_ms"] for r in rows]
+    return {
+        "mean_tokens": round(float(np.mean(tokens)), 1),
+        "p50_ms": round(float(np.percentile(latency, 50)), 1),
+        "p95_ms": round(float(np.percentile(latency, 95)), 1),
+        "parse_errors": sum(r["parse_error"] for r in rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", help="File teks, satu keluhan per baris (default: kasus bawaan)")
+    parser.add_argument("--output", help="Simpan report JSON ke file ini")
+    args = parser.parse_args()
+
+    if not Path(triage_cli.MODEL_PATH).exists():
+        print(f"❌ Model tidak ditemukan: {triage_cli.MODEL_PATH}")
+        return 1
+    if triage_cli.get_grammar() is None:
+        print("❌ llama_cpp.LlamaGrammar tidak tersedia")
+        return 1
+
+    cases = DEFAULT_CASES
+    if args.cases:
+        with open(args.cases, encoding="utf-8") as f:
+            cases = [line.strip() for line in f if line.strip()]
+
+    # Warm-up: load model + prefix KV cache supaya tidak masuk ke angka pertama
+    triage_cli.get_ai_triage(cases[0])
+
+    free = run_mode(cases, use_grammar=False)
+    constrained = run_mode(cases, use_grammar=True)
+
+    report = {
+        "cases": len(cases),
+        "free_json": summarize(free),
+        "grammar": summarize(constrained),
+        "tokens_saved_per_call": round(
+            float(np.mean([a["tokens"] - b["tokens"] for a, b in zip(free, constrained)])), 1
+        ),
+        "label_agreement": round(
+            float(np.mean([a["level"] == b["level"] for a, b in zip(free, constrained)])), 3
+        ),
+        "per_case": [
+            {"symptoms": a["symptoms"], "free": a["level"], "grammar": b["level"],
+             "free_tokens": a["tokens"], "grammar_tokens": b["tokens"]}
+            for a, b in zip(free, constrained)
+        ],
+    }
+
+    print("\n📊 Triage Grammar Benchmark:")
+    print("-" * 60)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✅ Report disimpan ke: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
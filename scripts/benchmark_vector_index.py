@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Benchmark NumPy vector index vs ChromaDB (latency + recall@k)"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src" / "rag"))
+
+import vector_index
+
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DB_PATH = "data/vectorstore"
+
+# Query pendek ala keluhan pasien (Bahasa Indonesia sehari-hari)
+DEFAULT_QUERIES = [
+    "demam tinggi 4 hari, bintik merah, nyeri sendi",
+    "nyeri dada menjalar ke lengan, keringat dingin",
+    "sesak napas dan batuk berdahak",
+    "diare cair lebih dari 3 kali sehari",
+    "luka bakar pada tangan",
+    "anak kejang disertai demam",
+    "gatal dan ruam kemerahan di kulit",
+    "muntah terus dan lemas",
+    "pendarahan hebat setelah jatuh",
+    "batuk lebih dari 2 minggu dan berat badan turun",
+]
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def time_queries(search_fn, vectors, k):
+    latencies = []
+    results = []
+    for vec in vectors:
+        t0 = time.perf_counter()
+        results.append(search_fn(vec, k))
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return results, latencies
+
+
+def benchmark(queries, k, index_path):
+    report = {"k": k, "queries": len(queries)}
+
+    t0 = time.perf_counter()
+    index = vector_index.NumpyVectorIndex(index_path)
+    report["numpy_open_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    report["numpy_chunks"] = len(index)
+    report["numpy_dtype"] = index.meta["dtype"]
+
+    print("🧠 Memuat model embedding...")
+    embedder = vector_index.SentenceEmbedder(index.meta.get("embed_model", EMBED_MODEL))
+    vectors = [embedder.embed_query(q) for q in queries]
+
+    np_results, np_lat = time_queries(
+        lambda vec, k: [chunk["text"] for _, chunk in index.search(vec, k=k)], vectors, k
+    )
+    report["numpy_p50_ms"] = round(percentile(np_lat, 50), 3)
+    report["numpy_p95_ms"] = round(percentile(np_lat, 95), 3)
+
+    if not os.path.exists(DB_PATH):
+        print(f"⚠️  {DB_PATH} tidak ada, skip perbandingan Chroma")
+        return report
+
+    t0 = time.perf_counter()
+    from langchain_community.vectorstores import Chroma
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    report["chroma_import_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    t0 = time.perf_counter()
+    db = Chroma(persist_directory=DB_PATH, embedding_function=HuggingFaceEmbeddings(model_name=EMBED_MODEL))
+    report["chroma_open_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    chroma_results, chroma_lat = time_queries(
+        lambda vec, k: [doc.page_content for doc in db.similarity_search_by_vector(list(map(float, vec)), k=k)],
+        vectors, k
+    )
+    report["chroma_p50_ms"] = round(percentile(chroma_lat, 50), 3)
+    report["chroma_p95_ms"] = round(percentile(chroma_lat, 95), 3)
+
+    # Recall@k: berapa banyak hasil Chroma yang juga ditemukan NumPy index
+    overlaps = [
+        len(set(a) & set(b)) / max(1, len(b))
+        for a, b in zip(np_results, chroma_results)
+    ]
+    report["recall_at_k_vs_chroma"] = round(float(np.mean(overlaps)), 4)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default=vector_index.INDEX_PATH)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", help="File teks, satu query per baris (default: query bawaan)")
+    parser.add_argument("--output", help="Simpan report JSON ke file ini")
+    args = parser.parse_args()
+
+    if not vector_index.NumpyVectorIndex.exists(args.index):
+        print(f"❌ NumPy index tidak ditemukan di {args.index}")
+        print("   Jalankan: ./run.sh python src/rag/build_knowledge.py --backend both")
+        return 1
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    report = benchmark(queries, args.k, args.index)
+
+    print("\n📊 Vector Index Benchmark:")
+    print("-" * 60)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report disimpan ke: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
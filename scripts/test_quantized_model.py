@@ -5,6 +5,9 @@ import sys
 from pathlib import Path
 from llama_cpp import Llama
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "inference"))
+import hardware_profile
+
 def test_model_load():
     """Test loading quantized model"""
     
@@ -18,11 +21,17 @@ def test_model_load():
     print("⏳ This may take 30-60 seconds...\n")
     
     try:
-        # Load model with CPU settings
+        # Load model with CPU settings (threads/batch/mmap from the host profile, see hardware_profile.py tune)
+        hw = hardware_profile.get(model_path)
+        print(f"   Hardware profile: {hw}")
         llm = Llama(
             model_path=model_path,
             n_ctx=2048,        # Context window
-            n_threads=4,       # CPU threads
+            n_threads=hw["n_threads"],
+            n_threads_batch=hw["n_threads_batch"],
+            n_batch=hw["n_batch"],
+            use_mmap=hw["use_mmap"],
+            use_mlock=hw["use_mlock"],
             n_gpu_layers=0,    # CPU only
             verbose=False
         )
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Cek mode triase logits: label argmax harus sama dengan decode greedy (grammar, temperature 0)"""
+
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src" / "inference"))
+
+import triage_cli
+import triage_rules
+
+# Prompt tetap, tidak cocok dengan rule engine (triage_rules) agar keputusan benar-benar dari model
+FIXED_CASES = [
+    "batuk pilek sejak kemarin",
+    "ini bahaya gak?",
+    "lemas dan pusing sejak pagi",
+    "anak rewel dan tidak mau makan",
+]
+
+
+def main():
+    if not Path(triage_cli.MODEL_PATH).exists():
+        print(f"❌ Model not found: {triage_cli.MODEL_PATH}")
+        return 1
+
+    flagged = [s for s in FIXED_CASES if triage_rules.classify(s)]
+    if flagged:
+        print(f"❌ Kasus cocok dengan rule engine, tidak menguji jalur logits: {flagged}")
+        return 1
+
+    mismatches = 0
+    for symptoms in FIXED_CASES:
+        logits_level, probs, _ = triage_cli.classify_logits(symptoms)
+        greedy_level, _ = triage_cli.get_ai_triage(symptoms, use_grammar=True)
+        ok = logits_level == greedy_level
+        mismatches += not ok
+        print(f"{'✅' if ok else '❌'} {symptoms!r}: logits={logits_level} greedy={greedy_level} "
+              f"probs={json.dumps(probs)}")
+
+    if mismatches:
+        print(f"\n❌ {mismatches}/{len(FIXED_CASES)} kasus berbeda: logit yang dibaca tidak sesuai posisi terakhir")
+        return 1
+    print(f"\n✅ Semua {len(FIXED_CASES)} kasus konsisten")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+MedConnect Edge - Batch JSONL I/O
+Dipakai mode batch triage_cli.py dan medvision_analyze.py: hasil ditulis per record
+(flush tiap baris), jadi proses yang terputus bisa dilanjutkan tanpa mengulang record
+yang sudah selesai.
+"""
+
+import json
+import os
+import time
+
+
+def iter_jsonl(path):
+    """Yield (nomor baris, record dict); baris kosong / rusak dilewati"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError:
+                print(f"⚠️  Baris {line_no} bukan JSON valid, dilewati")
+
+
+def load_done(path, key="id", accept=None):
+    """
+    Kumpulkan `key` dari record yang sudah ada di file output (hanya yang lolos `accept(record)`
+    jika diberikan, mis. supaya record error diproses ulang).
+    Baris terakhir yang terpotong (proses dihentikan saat menulis) dibuang dari file.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_bytes = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except ValueError:
+                break
+            valid_bytes += len(line)
+            if key in record and (accept is None or accept(record)):
+                done.add(record[key])
+    if valid_bytes != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+class JsonlWriter:
+    """Append satu record per baris + flush, supaya hasil aman walau proses di-kill"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Throughput:
+    """Hitung record/menit untuk laporan progres"""
+
+    def __init__(self):
+        self.t0 = time.time()
+        self.count = 0
+
+    def add(self, n=1):
+        self.count += n
+
+    def per_minute(self):
+        return self.count / max(time.time() - self.t0, 1e-6) * 60
+
+    def elapsed(self):
+        return time.time() - self.t0
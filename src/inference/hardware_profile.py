@@ -0,0 +1,315 @@
+"""
+MedConnect Edge - Hardware Profile
+Parameter llama.cpp (n_threads, n_threads_batch, n_batch, mmap/mlock, batas n_ctx) per model
+untuk mesin ini. `tune` mengukur prompt eval + generasi tiap GGUF di beberapa kombinasi lalu
+menyimpan profil per host; model_registry memakainya saat load. Tanpa profil (atau profil
+dari mesin lain) dipakai default aman.
+
+    ./run.sh python src/inference/hardware_profile.py tune
+    ./run.sh python src/inference/hardware_profile.py show
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+from datetime import datetime
+
+PROFILE_DIR = "data/hardware_profiles"
+PROFILE_PATH = os.environ.get("MEDCONNECT_HW_PROFILE")  # default: PROFILE_DIR/<hostname>.json
+MODELS_DIR = "models/gguf"
+PROFILE_VERSION = 1
+
+# Kandidat grid tune
+BATCH_SIZES = [128, 256, 512]
+CTX_CANDIDATES = [1024, 2048, 4096, 8192]
+KV_BYTES_PER_TOKEN = 128 * 1024  # sama dengan estimasi model_registry
+PROMPT_TOKENS = 256
+GEN_TOKENS = 32
+
+_profile = None
+_warned = False
+
+
+def cpu_counts():
+    """(core fisik, thread logis); core fisik dari /proc/cpuinfo jika psutil tidak ada"""
+    logical = os.cpu_count() or 1
+    physical = None
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+    except ImportError:
+        try:
+            cores = set()
+            phys_id = None
+            with open("/proc/cpuinfo") as f:
+                for line in f:
+                    if line.startswith("physical id"):
+                        phys_id = line.split(":")[1].strip()
+                    elif line.startswith("core id"):
+                        cores.add((phys_id, line.split(":")[1].strip()))
+            physical = len(cores) or None
+        except OSError:
+            pass
+    return physical or logical, logical
+
+
+def cpu_model():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def fingerprint():
+    physical, logical = cpu_counts()
+    return {
+        "hostname": socket.gethostname(),
+        "machine": platform.machine(),
+        "cpu_model": cpu_model(),
+        "physical_cores": physical,
+        "logical_cpus": logical,
+    }
+
+
+def safe_defaults():
+    """Tanpa profil: thread = core fisik (maks. 4, seperti nilai lama), setelan llama.cpp bawaan"""
+    physical, _ = cpu_counts()
+    n_threads = int(os.environ.get("MEDCONNECT_N_THREADS") or 0) or max(1, min(4, physical))
+    return {"n_threads": n_threads, "n_threads_batch": n_threads, "n_batch": 512,
+            "use_mmap": True, "use_mlock": False, "n_ctx_max": None}
+
+
+def profile_path():
+    return PROFILE_PATH or os.path.join(PROFILE_DIR, f"{socket.gethostname()}.json")
+
+
+def load():
+    """Profil host ini (dibaca sekali per proses), atau None jika belum di-tune / beda mesin"""
+    global _profile, _warned
+    if _profile is not None:
+        return _profile or None
+    _profile = {}
+    path = profile_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    host = fingerprint()
+    saved = data.get("host", {})
+    if data.get("version") != PROFILE_VERSION or any(
+            saved.get(k) != host[k] for k in ("cpu_model", "physical_cores", "logical_cpus")):
+        if not _warned:
+            sys.stderr.write(f"⚠️  Profil hardware {path} dari mesin lain, pakai default aman (jalankan tune)\n")
+            _warned = True
+        return None
+    _profile = data
+    return _profile
+
+
+def get(model_path):
+    """Parameter load untuk `model_path`: default aman ditimpa hasil tune model tersebut"""
+    params = safe_defaults()
+    profile = load()
+    if profile:
+        tuned = profile.get("models", {}).get(os.path.basename(model_path), {})
+        params.update({k: tuned[k] for k in params if k in tuned})
+        if os.environ.get("MEDCONNECT_N_THREADS"):
+            params["n_threads"] = params["n_threads_batch"] = int(os.environ["MEDCONNECT_N_THREADS"])
+    return params
+
+
+# ==========================================
+# TUNE
+# ==========================================
+def _thread_candidates():
+    physical, logical = cpu_counts()
+    return sorted({1, 2, 4, max(1, physical // 2), physical, logical} & set(range(1, logical + 1)))
+
+
+def _measure(model_path, n_threads, n_batch, use_mmap, use_mlock, n_ctx=1024):
+    """Load + ukur prompt eval (token/s) dan generasi greedy (token/s) untuk satu kombinasi"""
+    from llama_cpp import Llama
+
+    t0 = time.time()
+    llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_threads_batch=n_threads,
+                n_batch=n_batch, use_mmap=use_mmap, use_mlock=use_mlock, n_gpu_layers=0, verbose=False)
+    load_s = time.time() - t0
+    try:
+        text = " ".join(["Pasien demam tinggi disertai nyeri sendi dan bintik merah."] * 40)
+        tokens = llm.tokenize(text.encode("utf-8"))[:PROMPT_TOKENS]
+
+        llm.reset()
+        t0 = time.time()
+        llm.eval(tokens)
+        prompt_tps = len(tokens) / (time.time() - t0)
+
+        llm.reset()
+        n = 0
+        t_first = None
+        for _ in llm.generate(tokens[:32], temp=0.0):
+            n += 1
+            if t_first is None:
+                t_first = time.time()  # token pertama termasuk prompt eval, tidak dihitung
+            if n > GEN_TOKENS:
+                break
+        gen_tps = (n - 1) / (time.time() - t_first) if n > 1 else 0.0
+    finally:
+        if hasattr(llm, "close"):
+            llm.close()
+    return {"n_threads": n_threads, "n_batch": n_batch, "use_mmap": use_mmap, "use_mlock": use_mlock,
+            "load_s": round(load_s, 2), "prompt_tps": round(prompt_tps, 1), "gen_tps": round(gen_tps, 2)}
+
+
+def _n_ctx_max(model_path):
+    """n_ctx terbesar yang bobot + KV cache-nya muat di 60% RAM (sisanya untuk model lain + OS)"""
+    try:
+        import psutil
+        total = psutil.virtual_memory().total
+    except ImportError:
+        try:
+            total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (ValueError, OSError):
+            return None
+    budget = total * 0.6 - os.path.getsize(model_path)
+    fitting = [n for n in CTX_CANDIDATES if n * KV_BYTES_PER_TOKEN <= budget]
+    return max(fitting) if fitting else min(CTX_CANDIDATES)
+
+
+def tune_model(model_path, quick=False):
+    """
+    Pencarian bertahap (bukan grid penuh, satu load per kombinasi):
+    1. thread: n_threads dipilih dari token/s generasi, n_threads_batch dari prompt eval
+    2. n_batch dengan thread terbaik
+    3. mmap / mlock: load tercepat yang tidak menurunkan throughput
+    """
+    trials = []
+
+    def run(**kwargs):
+        try:
+            result = _measure(model_path, **kwargs)
+        except Exception as e:
+            result = dict(kwargs, error=str(e))
+        trials.append(result)
+        print(f"   {json.dumps(result)}")
+        return result
+
+    threads = _thread_candidates()
+    if quick:
+        threads = sorted({threads[0], threads[len(threads) // 2], threads[-1]})
+    by_threads = [r for r in (run(n_threads=t, n_batch=512, use_mmap=True, use_mlock=False) for t in threads)
+                  if "error" not in r]
+    if not by_threads:
+        raise RuntimeError(f"Semua percobaan gagal untuk {model_path}")
+    best_gen = max(by_threads, key=lambda r: r["gen_tps"])
+    best_prompt = max(by_threads, key=lambda r: r["prompt_tps"])
+
+    by_batch = [best_prompt] + [r for r in (run(n_threads=best_prompt["n_threads"], n_batch=b,
+                                                use_mmap=True, use_mlock=False)
+                                            for b in BATCH_SIZES if b != 512 and not quick) if "error" not in r]
+    best_batch = max(by_batch, key=lambda r: r["prompt_tps"])
+
+    # Semua kombinasi mmap/mlock (termasuk baseline mmap=True, mlock=False) diukur dengan thread generasi
+    # + n_batch terpilih; best_batch diukur dengan thread prompt, jadi hanya dipakai ulang jika sama
+    baseline_modes = ((True, True), (False, False))
+    if best_batch["n_threads"] == best_gen["n_threads"]:
+        memory = [best_batch]
+    else:
+        memory = []
+        baseline_modes = ((True, False),) + baseline_modes
+    memory += [r for r in (run(n_threads=best_gen["n_threads"], n_batch=best_batch["n_batch"],
+                               use_mmap=mmap, use_mlock=mlock)
+                           for mmap, mlock in baseline_modes) if "error" not in r]
+    if not memory:
+        memory = [best_batch]
+    # mlock gagal diam-diam jika ulimit memlock kecil; pilih load tercepat dengan throughput >= 95% baseline
+    baseline = next((r for r in memory if r["use_mmap"] and not r["use_mlock"]), best_gen)
+    ok = [r for r in memory if r["gen_tps"] >= 0.95 * baseline["gen_tps"]] or memory
+    best_memory = min(ok, key=lambda r: r["load_s"])
+
+    return {
+        "n_threads": best_gen["n_threads"],
+        "n_threads_batch": best_prompt["n_threads"],
+        "n_batch": best_batch["n_batch"],
+        "use_mmap": best_memory["use_mmap"],
+        "use_mlock": best_memory["use_mlock"],
+        "n_ctx_max": _n_ctx_max(model_path),
+        "prompt_tps": best_batch["prompt_tps"],
+        "gen_tps": best_gen["gen_tps"],
+        "file_size": os.path.getsize(model_path),
+        "trials": trials,
+    }
+
+
+def tune(model_paths=None, quick=False, output=None):
+    if model_paths is None:
+        # mmproj (CLIP) bukan model bahasa, tidak di-tune
+        model_paths = sorted(os.path.join(MODELS_DIR, f) for f in os.listdir(MODELS_DIR)
+                             if f.endswith(".gguf") and "mmproj" not in f) if os.path.isdir(MODELS_DIR) else []
+    if not model_paths:
+        print(f"❌ Tidak ada file GGUF di {MODELS_DIR}")
+        return None
+
+    output = output or profile_path()
+    profile = {"version": PROFILE_VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+               "host": fingerprint(), "models": {}}
+    # Lanjutkan profil lama host yang sama: model yang tidak di-tune ulang tetap tersimpan
+    if os.path.exists(output):
+        try:
+            with open(output) as f:
+                old = json.load(f)
+            if old.get("host", {}).get("cpu_model") == profile["host"]["cpu_model"]:
+                profile["models"].update(old.get("models", {}))
+        except (OSError, ValueError):
+            pass
+
+    for path in model_paths:
+        print(f"⏳ Tune {os.path.basename(path)} (thread kandidat: {_thread_candidates()})")
+        t0 = time.time()
+        profile["models"][os.path.basename(path)] = tune_model(path, quick=quick)
+        best = {k: v for k, v in profile["models"][os.path.basename(path)].items() if k != "trials"}
+        print(f"✅ {os.path.basename(path)} ({time.time() - t0:.0f}s): {json.dumps(best)}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"💾 Profil disimpan: {output}")
+    return profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_tune = sub.add_parser("tune", help="Micro-benchmark tiap GGUF lalu simpan profil host ini")
+    p_tune.add_argument("--model", action="append", help="Path GGUF (default: semua di models/gguf kecuali mmproj)")
+    p_tune.add_argument("--quick", action="store_true", help="Grid kecil (3 thread count, tanpa variasi n_batch)")
+    p_tune.add_argument("--output", help="Path profil (default: data/hardware_profiles/<hostname>.json)")
+    sub.add_parser("show", help="Tampilkan parameter efektif per model")
+    args = parser.parse_args()
+
+    if args.command == "tune":
+        try:
+            import llama_cpp  # noqa: F401
+        except ImportError:
+            print("❌ Library llama-cpp-python tidak terinstall")
+            sys.exit(1)
+        sys.exit(0 if tune(args.model, quick=args.quick, output=args.output) else 1)
+
+    profile = load()
+    print(f"Host: {json.dumps(fingerprint())}")
+    print(f"Profil: {profile_path()} ({'dipakai' if profile else 'tidak ada / beda mesin -> default aman'})")
+    names = sorted((profile or {}).get("models", {})) or [
+        f for f in (os.listdir(MODELS_DIR) if os.path.isdir(MODELS_DIR) else []) if f.endswith(".gguf")
+    ]
+    for name in names or ["(default)"]:
+        print(f"   {name}: {json.dumps(get(name))}")
@@ -0,0 +1,142 @@
+"""
+MedConnect Edge - Client untuk Inference Server lokal
+Dipakai oleh app.py dan CLI agar tidak perlu memuat model sendiri.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+# KONFIGURASI
+SERVER_URL = os.environ.get("MEDCONNECT_SERVER_URL", "http://127.0.0.1:8765")
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+SERVER_SCRIPT = os.path.join(ROOT_DIR, "src", "inference", "inference_server.py")
+SERVER_LOG = os.path.join(ROOT_DIR, "logs", "inference_server.log")
+
+
+def is_alive(timeout=0.5):
+    """Cek apakah server sudah jalan"""
+    try:
+        with urllib.request.urlopen(SERVER_URL + "/health", timeout=timeout) as resp:
+            return resp.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def request(endpoint, payload=None, timeout=600):
+    """
+    Kirim request JSON ke server.
+    Return dict hasil, atau None jika server tidak bisa dihubungi.
+    """
+    data = None
+    if payload is not None:
+        data = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(
+        SERVER_URL + endpoint,
+        data=data,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        # Server hidup tapi menolak request -> tetap kembalikan body error-nya
+        try:
+            return json.loads(e.read().decode("utf-8"))
+        except ValueError:
+            return {"status": "error", "error": f"HTTP {e.code}"}
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def stream(endpoint, payload, timeout=600):
+    """
+    Request ke endpoint streaming (JSONL).
+    Return generator event dict, atau None jika server tidak bisa dihubungi.
+    """
+    req = urllib.request.Request(
+        SERVER_URL + endpoint,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        return iter([{"type": "error", "status": "error", "error": f"HTTP {e.code}"}])
+    except (urllib.error.URLError, OSError):
+        return None
+
+    def events():
+        with resp:
+            for line in resp:
+                line = line.strip()
+                if line:
+                    yield json.loads(line.decode("utf-8"))
+
+    return events()
+
+
+@contextmanager
+def admitted(session, symptoms="", on_wait=None, poll_s=1.0):
+    """
+    Ambil slot di antrian admission server untuk satu kasus (lihat job_queue.py).
+    Selama antri, `on_wait(ticket)` dipanggil tiap poll dengan posisi + eta_s (poll = heartbeat).
+    Yield tiket dengan state "active" (sertakan job_id di setiap request stage), atau tiket
+    "rejected" / "cancelled" yang harus ditangani caller. Server lama tanpa /queue: yield None.
+    Slot dilepas saat keluar dari blok, termasuk karena exception (script Streamlit dihentikan).
+    """
+    ticket = request("/queue/join", {"session": session, "symptoms": symptoms}, timeout=10)
+    if ticket is None or ticket.get("status") == "error" and "job_id" not in ticket:
+        yield None
+        return
+
+    job_id = ticket.get("job_id")
+    stop = threading.Event()
+    try:
+        while ticket and ticket.get("state") == "queued":
+            if on_wait is not None:
+                on_wait(ticket)
+            time.sleep(poll_s)
+            ticket = request("/queue/status", {"job_id": job_id}, timeout=10)
+
+        if ticket and ticket.get("state") == "active":
+            # Stage bisa berjalan lama tanpa request (vision di CPU), jadi heartbeat di thread terpisah
+            def beat():
+                while not stop.wait(poll_s * 3):
+                    request("/queue/heartbeat", {"job_id": job_id}, timeout=5)
+
+            threading.Thread(target=beat, daemon=True).start()
+        yield ticket
+    finally:
+        stop.set()
+        if job_id:
+            request("/queue/leave", {"job_id": job_id}, timeout=5)
+
+
+def ensure_server(wait=60):
+    """Jalankan server di background jika belum ada, lalu tunggu sampai siap"""
+    if is_alive():
+        return True
+
+    os.makedirs(os.path.dirname(SERVER_LOG), exist_ok=True)
+    with open(SERVER_LOG, "ab") as log:
+        subprocess.Popen(
+            [sys.executable, SERVER_SCRIPT],
+            cwd=ROOT_DIR,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        if is_alive():
+            return True
+        time.sleep(0.5)
+    return False
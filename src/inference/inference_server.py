@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+MedConnect Edge - Local Inference Server
+Model dimuat sekali lalu dipakai ulang untuk semua request (triage, vision, explain).
+
+Jalankan:
+    ./run.sh python src/inference/inference_server.py --preload
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import startup_profile  # paling awal: hook --profile-startup sebelum dependency lain
+
+import medgemma_explain
+import medvision_analyze
+import job_queue
+import metrics
+import model_registry
+import model_scheduler
+import prefix_cache
+import rag_retriever
+import result_cache
+import triage_cli
+import triage_rules
+import vision_cache
+
+# KONFIGURASI
+HOST = os.environ.get("MEDCONNECT_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("MEDCONNECT_SERVER_PORT", "8765"))
+
+STARTED_AT = time.time()
+
+
+def handle_triage(payload):
+    return triage_cli.triage_case(
+        payload.get("symptoms", ""),
+        use_cache=not payload.get("no_cache"),
+        mode=payload.get("mode")
+    )
+
+
+def handle_triage_reason(payload):
+    reason = triage_cli.get_triage_reason(payload.get("symptoms", ""), payload.get("level", "NON-URGENT"))
+    return {"status": "success", "reason": reason}
+
+
+def handle_vision(payload):
+    # "image_hash" (upload_store, dari app.py) atau "image" (path absolut, CLI)
+    return medvision_analyze.analyze_medical_image(
+        payload.get("image", ""),
+        payload.get("query") or medvision_analyze.DEFAULT_QUERY,
+        use_cache=not payload.get("no_cache"),
+        image_hash=payload.get("image_hash")
+    )
+
+
+def handle_rag(payload):
+    timings = {}
+    context = medgemma_explain.get_rag_context(payload.get("symptoms", ""), timings)
+    return {"status": "ok", "rag_context": context, "timings": timings}
+
+
+def handle_explain(payload):
+    return medgemma_explain.generate_medical_explanation(
+        payload.get("symptoms", "-"),
+        payload.get("triage_level", "INFO"),
+        payload.get("triage_note", "-"),
+        payload.get("vision_text"),
+        use_cache=not payload.get("no_cache"),
+        rag_context=payload.get("rag_context")
+    )
+
+
+def handle_explain_stream(payload):
+    return medgemma_explain.stream_events(
+        payload.get("symptoms", "-"),
+        payload.get("triage_level", "INFO"),
+        payload.get("triage_note", "-"),
+        payload.get("vision_text"),
+        use_cache=not payload.get("no_cache"),
+        rag_context=payload.get("rag_context")
+    )
+
+
+def handle_health(payload=None):
+    return {
+        "status": "ok",
+        "uptime_s": round(time.time() - STARTED_AT, 1),
+        "models_loaded": {
+            "gemma": model_registry.is_loaded(triage_cli.MODEL_PATH),
+            "vision": model_registry.is_loaded(medvision_analyze.MODEL_PATH)
+        }
+    }
+
+
+def handle_models(payload=None):
+    return {"status": "ok", "models": model_registry.memory_report()}
+
+
+def handle_scheduler(payload=None):
+    return {"status": "ok", "scheduler": model_scheduler.stats()}
+
+
+def handle_scheduler_overlap(payload):
+    # Orchestrator: boleh vision ∥ triage hanya jika BakLLaVA + Gemma muat bersamaan
+    stages = payload.get("stages") or ["vision", "triage"]
+    return {"status": "ok", "stages": stages, "overlap": model_scheduler.can_overlap(*stages)}
+
+
+def handle_prefix_cache(payload=None):
+    return {"status": "ok", "prefix_cache": prefix_cache.stats()}
+
+
+def handle_vision_cache(payload=None):
+    return {"status": "ok", "vision_cache": vision_cache.stats()}
+
+
+def handle_result_cache(payload=None):
+    return {"status": "ok", "result_cache": result_cache.stats()}
+
+
+def handle_triage_rules(payload=None):
+    return {"status": "ok", "triage_rules": triage_rules.stats()}
+
+
+def handle_rag_stats(payload=None):
+    return {"status": "ok", "rag": rag_retriever.get_retriever().summary()}
+
+
+def handle_metrics_summary(payload=None):
+    return {"status": "ok", "metrics": metrics.summary(), "log_path": metrics.LOG_PATH}
+
+
+def handle_metrics(payload=None):
+    return metrics.prometheus_text()
+
+
+def handle_queue_join(payload):
+    return job_queue.join(payload.get("session"), payload.get("symptoms", ""), payload.get("level"))
+
+
+def handle_queue_status(payload):
+    return job_queue.status(payload.get("job_id"))
+
+
+def handle_queue_leave(payload):
+    return job_queue.leave(payload.get("job_id"))
+
+
+def handle_queue(payload=None):
+    return {"status": "ok", "queue": job_queue.stats()}
+
+
+POST_ROUTES = {
+    "/triage": handle_triage,
+    "/triage/reason": handle_triage_reason,
+    "/vision": handle_vision,
+    "/explain": handle_explain,
+    "/rag": handle_rag,
+    "/scheduler/overlap": handle_scheduler_overlap,
+    "/queue/join": handle_queue_join,
+    "/queue/status": handle_queue_status,
+    "/queue/heartbeat": handle_queue_status,
+    "/queue/leave": handle_queue_leave,
+}
+
+# Endpoint yang memakai model: hanya untuk job yang sedang active di antrian admission,
+# request tanpa job_id (CLI / batch) menunggu slot sebagai job sekali pakai
+QUEUED_ROUTES = {"/triage", "/triage/reason", "/vision", "/explain", "/rag", "/explain/stream"}
+
+# Endpoint yang mengirim JSONL baris demi baris (satu event per token)
+STREAM_ROUTES = {
+    "/explain/stream": handle_explain_stream,
+}
+
+GET_ROUTES = {
+    "/health": handle_health,
+    "/models": handle_models,
+    "/scheduler": handle_scheduler,
+    "/prefix-cache": handle_prefix_cache,
+    "/vision-cache": handle_vision_cache,
+    "/rag-stats": handle_rag_stats,
+    "/result-cache": handle_result_cache,
+    "/triage-rules": handle_triage_rules,
+    "/metrics/summary": handle_metrics_summary,
+    "/queue": handle_queue,
+}
+
+# Endpoint teks biasa (format eksposisi Prometheus)
+TEXT_ROUTES = {
+    "/metrics": handle_metrics,
+}
+
+
+def _guard_stream(events, job_id=None):
+    """Hentikan generasi begitu job dibatalkan (session hilang); tiap token = heartbeat job"""
+    try:
+        for event in events:
+            if job_id and not job_queue.touch(job_id):
+                yield {"type": "error", "status": "error", "cancelled": True, "error": "Job dibatalkan"}
+                return
+            yield event
+    finally:
+        events.close()
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    def _send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, code, text, content_type="text/plain; version=0.0.4; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
+        try:
+            for event in events:
+                self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        finally:
+            # Tutup generator agar lock model langsung dilepas walau client putus
+            events.close()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in TEXT_ROUTES:
+            self._send_text(200, TEXT_ROUTES[path]())
+            return
+        route = GET_ROUTES.get(path)
+        if route is None:
+            self._send_json(404, {"status": "error", "error": f"Unknown endpoint {self.path}"})
+            return
+        self._send_json(200, route())
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        route = POST_ROUTES.get(path) or STREAM_ROUTES.get(path)
+        if route is None:
+            self._send_json(404, {"status": "error", "error": f"Unknown endpoint {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"status": "error", "error": "Body harus JSON"})
+            return
+
+        if path not in QUEUED_ROUTES:
+            self._dispatch(path, route, payload)
+            return
+
+        job_id = payload.get("job_id")
+        if job_id:
+            if not job_queue.touch(job_id):
+                self._send_json(409, {"status": "error", "cancelled": True,
+                                      "error": "Job dibatalkan atau belum mendapat slot antrian"})
+                return
+            self._dispatch(path, route, payload)
+            return
+
+        with job_queue.oneshot(payload.get("symptoms", ""), payload.get("triage_level") or payload.get("level")) as ticket:
+            if ticket["status"] != "ok":
+                # Backpressure: antrian penuh
+                self._send_json(503, ticket)
+                return
+            self._dispatch(path, route, payload)
+
+    def _dispatch(self, path, route, payload):
+        if path in STREAM_ROUTES:
+            try:
+                self._send_stream(_guard_stream(route(payload), payload.get("job_id")))
+            except (BrokenPipeError, ConnectionResetError):
+                # Client (tab UI) ditutup di tengah generasi
+                pass
+            return
+
+        try:
+            self._send_json(200, route(payload))
+        except Exception as e:
+            self._send_json(500, {"status": "error", "error": str(e)})
+
+    def log_message(self, format, *args):
+        # Log ringkas ke stderr (stdout dipakai untuk pesan status)
+        sys.stderr.write("[server] %s\n" % (format % args))
+
+
+def preload_models():
+    """Muat semua model di awal agar request pertama tidak lambat"""
+    # Gemma cukup dimuat sekali untuk triage + explain (n_ctx dinegosiasi registry)
+    for name, path, n_ctx, clip in [
+        ("gemma", triage_cli.MODEL_PATH, triage_cli.N_CTX, None),
+        ("vision", medvision_analyze.MODEL_PATH, medvision_analyze.N_CTX, medvision_analyze.CLIP_PATH),
+    ]:
+        if not os.path.exists(path):
+            print(f"⚠️  Skip preload {name}: {path} tidak ditemukan")
+            continue
+        load_time = model_registry.preload(path, n_ctx=n_ctx, clip_model_path=clip)
+        print(f"✅ Model {name} siap ({load_time:.1f}s)")
+
+    # Model embedding + Chroma dibuka sekali di awal
+    retriever = rag_retriever.get_retriever()
+    if retriever.available():
+        retriever.search("demam")
+        print(f"✅ RAG retriever siap (load {retriever.stats['load_ms']:.0f}ms)")
+
+    # Evaluasi (atau baca dari disk) KV state instruksi statis triage & explain
+    if os.path.exists(triage_cli.MODEL_PATH):
+        for name, prefix in [("triage", triage_cli.TRIAGE_PREFIX), ("explain", medgemma_explain.EXPLAIN_PREFIX)]:
+            with model_registry.use_model(triage_cli.MODEL_PATH, n_ctx=triage_cli.N_CTX) as llm:
+                info = prefix_cache.restore_prefix(llm, triage_cli.MODEL_PATH, prefix)
+            print(f"✅ Prefix {name}: {info['tokens']} token dari {info['source']} ({info['ms']:.0f}ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--preload", action="store_true", help="Muat semua model saat start")
+    parser.add_argument("--ram-budget-mb", type=float, default=None, help="Batas RAM untuk model (default: MEDCONNECT_RAM_BUDGET_MB / 75%% RAM)")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Prompt-lookup speculative decoding untuk Gemma (default: MEDCONNECT_SPECULATIVE)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Cetak waktu import per dependency + load model (--preload) ke stderr")
+    args = parser.parse_args()
+
+    if args.speculative:
+        try:
+            model_registry.set_speculative(True)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+    if args.ram_budget_mb is not None:
+        model_registry.set_budget_mb(args.ram_budget_mb)
+
+    if args.preload:
+        preload_models()
+
+    server = ThreadingHTTPServer((args.host, args.port), InferenceHandler)
+    server.daemon_threads = True
+    print(f"🚀 MedConnect inference server di http://{args.host}:{args.port}")
+    startup_profile.mark("first_result")
+    startup_profile.report()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
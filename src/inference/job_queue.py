@@ -0,0 +1,245 @@
+"""
+MedConnect Edge - Antrian Admission
+Satu kasus "Analyze Case" = satu job. Hanya MAX_ACTIVE job yang boleh memakai model
+bersamaan (device 4 GB: satu kasus sekaligus); sisanya antri urut prioritas triase
+(EMERGENCY dari rule engine melompat ke depan), lalu FIFO.
+
+Alur client (inference_client.admitted):
+    POST /queue/join      {"session", "symptoms"} -> tiket {job_id, state, position, eta_s}
+    POST /queue/status    {"job_id"}  poll selama queued (sekaligus heartbeat)
+    POST /queue/heartbeat {"job_id"}  selama active
+    POST /queue/leave     {"job_id"}  selesai / dibatalkan
+
+Job yang heartbeat-nya berhenti (tab ditutup, session Streamlit hilang) dibatalkan dan
+slotnya dilepas. Request model tanpa job_id (CLI, batch) di-admit sebagai job sekali pakai.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+import triage_rules
+
+# KONFIGURASI
+MAX_ACTIVE = int(os.environ.get("MEDCONNECT_QUEUE_MAX_ACTIVE", "1"))
+MAX_DEPTH = int(os.environ.get("MEDCONNECT_QUEUE_MAX_DEPTH", "16"))  # lebih dari ini -> status "busy"
+HEARTBEAT_TIMEOUT_S = float(os.environ.get("MEDCONNECT_QUEUE_HEARTBEAT_S", "15"))
+DEFAULT_SERVICE_S = 45.0  # estimasi durasi satu kasus sebelum ada data
+
+PRIORITIES = {"EMERGENCY": 0, "URGENT": 1, "NON-URGENT": 2}
+
+_cond = threading.Condition()
+_jobs = {}  # job_id -> dict job
+_seq = itertools.count()
+_service_s = deque(maxlen=20)  # durasi job active yang selesai, untuk ETA
+_stats = {"joined": 0, "admitted": 0, "finished": 0, "cancelled": 0, "rejected": 0}
+
+
+def priority_for(symptoms, level=None):
+    """Level eksplisit (mis. dari triase sebelumnya) atau dari rule engine; tanpa red flag = NON-URGENT"""
+    if level not in PRIORITIES:
+        rule = triage_rules.classify(symptoms or "")
+        level = rule["level"] if rule else "NON-URGENT"
+    return level
+
+
+def _queued():
+    return sorted((j for j in _jobs.values() if j["state"] == "queued"), key=lambda j: (j["rank"], j["seq"]))
+
+
+def _active():
+    return [j for j in _jobs.values() if j["state"] == "active"]
+
+
+def _avg_service_s():
+    return sum(_service_s) / len(_service_s) if _service_s else DEFAULT_SERVICE_S
+
+
+def _eta_s(ahead):
+    """Simulasi slot: job active selesai setelah sisa rata-rata durasinya, lalu job di depan bergantian"""
+    avg = _avg_service_s()
+    now = time.time()
+    free = [max(0.0, avg - (now - j["admitted_at"])) for j in _active()]
+    free += [0.0] * (MAX_ACTIVE - len(free))
+    heapq.heapify(free)
+    for _ in range(ahead):
+        heapq.heappush(free, heapq.heappop(free) + avg)
+    return round(free[0], 1)
+
+
+def _reap():
+    """Batalkan job (bukan sekali pakai) yang heartbeat-nya kedaluwarsa. Caller memegang _cond."""
+    now = time.time()
+    for job in list(_jobs.values()):
+        if job["state"] in ("queued", "active") and not job["oneshot"] \
+                and now - job["heartbeat"] > HEARTBEAT_TIMEOUT_S:
+            _finish(job, "cancelled")
+
+
+def _finish(job, state):
+    """Caller memegang _cond"""
+    if job["state"] == "active":
+        if state == "done":
+            _service_s.append(time.time() - job["admitted_at"])
+        metrics.record("queue.service", (time.time() - job["admitted_at"]) * 1000, priority=job["priority"],
+                       state=state)
+    job["state"] = state
+    job["finished_at"] = time.time()
+    _stats["finished" if state == "done" else "cancelled"] += 1
+    _promote()
+    _cond.notify_all()
+    # Job selesai disimpan sebentar supaya status/leave yang terlambat tetap dapat jawaban
+    for old in [j for j in _jobs.values() if j.get("finished_at") and time.time() - j["finished_at"] > 300]:
+        del _jobs[old["job_id"]]
+
+
+def _promote():
+    """Isi slot kosong dari depan antrian. Caller memegang _cond."""
+    active = len(_active())
+    for job in _queued():
+        if active >= MAX_ACTIVE:
+            break
+        job["state"] = "active"
+        job["admitted_at"] = time.time()
+        active += 1
+        _stats["admitted"] += 1
+        metrics.record("queue.wait", (job["admitted_at"] - job["created"]) * 1000, priority=job["priority"])
+    metrics.gauge("queue_depth", len(_queued()), "Job yang menunggu slot model")
+    metrics.gauge("queue_active", active, "Job yang sedang memakai model")
+
+
+def _ticket(job):
+    out = {
+        "status": "ok",
+        "job_id": job["job_id"],
+        "state": job["state"],
+        "priority": job["priority"],
+        "wait_s": round((job.get("admitted_at") or time.time()) - job["created"], 1),
+    }
+    if job["state"] == "queued":
+        queued = _queued()
+        ahead = queued.index(job)
+        out.update(position=ahead + 1, queue_depth=len(queued), eta_s=_eta_s(ahead))
+    return out
+
+
+def join(session=None, symptoms="", level=None, oneshot=False):
+    """
+    Daftarkan job. Satu session hanya punya satu job: join ulang (klik Analyze lagi)
+    membatalkan job lama session tersebut. Return tiket, atau status "busy" jika antrian penuh.
+    """
+    priority = priority_for(symptoms, level)
+    with _cond:
+        _reap()
+        if session:
+            for job in list(_jobs.values()):
+                if job["session"] == session and job["state"] in ("queued", "active"):
+                    _finish(job, "cancelled")
+        queued = _queued()
+        # Antrian penuh: EMERGENCY tetap diterima, yang lain diminta coba lagi
+        if len(queued) >= MAX_DEPTH and priority != "EMERGENCY":
+            _stats["rejected"] += 1
+            return {"status": "busy", "state": "rejected", "queue_depth": len(queued),
+                    "retry_after_s": _eta_s(len(queued))}
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "session": session,
+            "priority": priority,
+            "rank": PRIORITIES[priority],
+            "seq": next(_seq),
+            "state": "queued",
+            "created": now,
+            "heartbeat": now,
+            "admitted_at": None,
+            "oneshot": oneshot,
+        }
+        _jobs[job["job_id"]] = job
+        _stats["joined"] += 1
+        _promote()
+        return _ticket(job)
+
+
+def status(job_id, heartbeat=True):
+    """Posisi + estimasi tunggu; dipanggil berkala oleh client sekaligus sebagai heartbeat"""
+    with _cond:
+        job = _jobs.get(job_id)
+        if job is None:
+            return {"status": "error", "state": "unknown", "error": "Job tidak dikenal"}
+        if heartbeat and job["state"] in ("queued", "active"):
+            job["heartbeat"] = time.time()
+        _reap()
+        return _ticket(job)
+
+
+def leave(job_id):
+    """Job selesai (active) atau batal (masih queued)"""
+    with _cond:
+        job = _jobs.get(job_id)
+        if job is None or job["state"] not in ("queued", "active"):
+            return {"status": "ok", "state": job["state"] if job else "unknown"}
+        _finish(job, "done" if job["state"] == "active" else "cancelled")
+        return {"status": "ok", "state": job["state"]}
+
+
+def is_cancelled(job_id):
+    with _cond:
+        job = _jobs.get(job_id)
+        return job is None or job["state"] not in ("queued", "active")
+
+
+def touch(job_id):
+    """
+    Request stage dari job yang sudah active: perbarui heartbeat. Return False jika job
+    sudah dibatalkan / tidak dikenal / belum mendapat slot (request harus ditolak).
+    """
+    with _cond:
+        job = _jobs.get(job_id)
+        if job is None or job["state"] != "active":
+            return False
+        job["heartbeat"] = time.time()
+        return True
+
+
+@contextmanager
+def oneshot(symptoms="", level=None):
+    """
+    Request tanpa job_id (CLI / batch): tunggu slot di thread server, lepas setelah selesai.
+    Yield tiket; status "busy" berarti antrian penuh dan request harus ditolak.
+    """
+    ticket = join(symptoms=symptoms, level=level, oneshot=True)
+    if ticket["status"] != "ok":
+        yield ticket
+        return
+    job_id = ticket["job_id"]
+    with _cond:
+        while _jobs[job_id]["state"] == "queued":
+            _reap()
+            _cond.wait(timeout=1.0)
+        ticket = _ticket(_jobs[job_id])
+    try:
+        yield ticket
+    finally:
+        leave(job_id)
+
+
+def stats():
+    with _cond:
+        _reap()
+        queued = _queued()
+        return dict(
+            _stats,
+            max_active=MAX_ACTIVE,
+            max_depth=MAX_DEPTH,
+            active=len(_active()),
+            queue_depth=len(queued),
+            queued_by_priority={p: sum(j["priority"] == p for j in queued) for p in PRIORITIES},
+            avg_service_s=round(_avg_service_s(), 1),
+            next_eta_s=_eta_s(len(queued)),
+        )
@@ -2,61 +2,55 @@ import argparse
 import json
 import os
 import sys
+import time
 
-# Import Library RAG
-try:
-    from langchain_community.vectorstores import Chroma
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-    from llama_cpp import Llama
-except ImportError:
-    print(json.dumps({"status": "error", "ai_explanation": "Library error. Pastikan install langchain & chromadb."}))
-    sys.exit(1)
+import startup_profile  # paling awal: hook --profile-startup sebelum dependency lain
+
+import inference_client
+import metrics
+import model_registry
+import model_scheduler
+import prefix_cache
+import rag_retriever
+import result_cache
 
 # KONFIGURASI
 MODEL_PATH = "models/gguf/gemma-2-2b-it-Q4_K_M.gguf"
-DB_PATH = "data/vectorstore"
-EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+N_CTX = 4096 # Context window besar buat nampung RAG
+MAX_TOKENS = 600
+TEMPERATURE = 0.2
+PROMPT_VERSION = "explain-v1"  # Naikkan jika prompt berubah (hasil lama di result cache tidak dipakai)
+
+# Instance Gemma yang sama dengan triage_cli (registry memilih n_ctx terbesar)
+model_scheduler.register_stage("explain", MODEL_PATH, N_CTX)
 
-def get_rag_context(query_text):
+def get_rag_context(query_text, timings=None):
     """Mencari referensi dari dokumen Kemenkes"""
-    if not os.path.exists(DB_PATH):
+    retriever = rag_retriever.get_retriever()
+    if not retriever.available():
         return ""
     
     try:
-        # Load Database
-        embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
-        db = Chroma(persist_directory=DB_PATH, embedding_function=embeddings)
-        
-        # Cari 3 paragraf paling relevan
-        docs = db.similarity_search(query_text, k=3)
-        
-        # Gabungkan hasil
-        context_str = "\n".join([f"- {doc.page_content}" for doc in docs])
+        # Retriever (embedding + Chroma) hidup selama proses, query berulang kena cache
+        context_str, rag_timings = retriever.get_context(query_text, k=3)
+        if timings is not None:
+            timings["rag"] = rag_timings
         return context_str
     except Exception as e:
         return f"Error membaca referensi: {str(e)}"
 
-def generate_medical_explanation(symptoms, triage_level, triage_note, vision_analysis=None):
-    if not os.path.exists(MODEL_PATH):
-        return {"status": "error", "ai_explanation": "Model not found."}
-
-    try:
-        # 1. Cari Referensi Dulu (RAG)
-        # Kita cari berdasarkan gejala user
-        rag_context = get_rag_context(symptoms)
-        
-        # 2. Siapkan Data Visual
-        vision_section = ""
-        if vision_analysis:
-            vision_section = f"\n[DATA VISUAL DARI KAMERA]: {vision_analysis}\n"
-        else:
-            vision_section = "\n[DATA VISUAL]: TIDAK ADA GAMBAR.\n"
-
-        # 3. Prompt Super Lengkap
-        # Perhatikan kita memasukkan {rag_context} ke dalam prompt
-        prompt = f"""<start_of_turn>user
+EXPLAIN_PREFIX = """<start_of_turn>user
 Anda adalah MedGemma, asisten medis AI yang bekerja berdasarkan Panduan Kemenkes RI.
 
+INSTRUKSI:
+1. Jawab pertanyaan pasien dengan ramah.
+2. JIKA ADA REFERENSI DI BAWAH: Gunakan informasi tersebut untuk memberikan saran medis yang akurat. Kutip referensinya (misal: "Berdasarkan panduan...").
+3. JIKA TIDAK ADA REFERENSI: Gunakan pengetahuan umum medis Anda, tapi berikan disclaimer.
+4. Berikan 3 langkah pertolongan pertama.
+"""
+
+def build_prompt(symptoms, triage_level, vision_section, rag_context):
+    return EXPLAIN_PREFIX + f"""
 DATA PASIEN:
 - Keluhan: "{symptoms}"
 - Triase: {triage_level}
@@ -65,41 +59,156 @@ DATA PASIEN:
 REFERENSI RESMI (KEMENKES/WHO):
 {rag_context}
 
-INSTRUKSI:
-1. Jawab pertanyaan pasien dengan ramah.
-2. JIKA ADA REFERENSI DI ATAS: Gunakan informasi tersebut untuk memberikan saran medis yang akurat. Kutip referensinya (misal: "Berdasarkan panduan...").
-3. JIKA TIDAK ADA REFERENSI: Gunakan pengetahuan umum medis Anda, tapi berikan disclaimer.
-4. Berikan 3 langkah pertolongan pertama.
-
 Jawab (Bahasa Indonesia):<end_of_turn>
 <start_of_turn>model
 """
 
-        # 4. Inferensi LLM
-        llm = Llama(
-            model_path=MODEL_PATH,
-            n_ctx=4096, # Context window besar buat nampung RAG
-            n_threads=4, 
-            verbose=False
-        )
+MODEL_LABEL = "MedGemma-2B + RAG (Kemenkes RI)" # Kita pamerin fitur RAG-nya
+
+def stream_medical_explanation(symptoms, triage_level, triage_note, vision_analysis=None, timings=None,
+                               rag_context=None, temperature=TEMPERATURE):
+    """
+    Generator: yield potongan teks begitu token dihasilkan.
+    Lock model dipegang selama generator berjalan, jadi konsumsi sampai habis.
+    Jika `timings` (dict) diberikan, diisi info prefix cache, TTFT, dan total waktu.
+    `rag_context` yang sudah diambil sebelumnya (orchestrator, stage rag) dipakai langsung.
+    `temperature` 0 dipakai benchmark speculative decoding untuk membandingkan output persis.
+    """
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError("Model not found.")
+
+    # 1. Cari Referensi Dulu (RAG)
+    # Kita cari berdasarkan gejala user
+    rag_timings = {}
+    if rag_context is None:
+        rag_context = get_rag_context(symptoms, rag_timings)
+    
+    # 2. Siapkan Data Visual
+    vision_section = ""
+    if vision_analysis:
+        vision_section = f"\n[DATA VISUAL DARI KAMERA]: {vision_analysis}\n"
+    else:
+        vision_section = "\n[DATA VISUAL]: TIDAK ADA GAMBAR.\n"
+
+    # 3. Prompt Super Lengkap
+    # Instruksi statis di depan (KV-nya di-cache), data pasien + {rag_context} di belakang
+    prompt = build_prompt(symptoms, triage_level, vision_section, rag_context)
 
-        output = llm(
+    # 4. Inferensi LLM
+    with model_registry.use_model(MODEL_PATH, n_ctx=N_CTX) as llm:
+        t0 = time.time()
+        rss_start = metrics.rss_bytes()
+        prefix_info = prefix_cache.restore_prefix(llm, MODEL_PATH, EXPLAIN_PREFIX)
+
+        speculative = getattr(llm, "draft_model", None) is not None
+        ttft = None
+        rss_first = rss_start
+        n_tokens = 0
+        for chunk in llm(
             prompt,
-            max_tokens=600, 
-            temperature=0.2, 
-            stop=["<end_of_turn>"]
-        )
+            max_tokens=MAX_TOKENS,
+            temperature=temperature,
+            stop=["<end_of_turn>"],
+            stream=True
+        ):
+            if ttft is None:
+                ttft = time.time() - t0
+                rss_first = metrics.rss_bytes()
+            n_tokens += 1
+            yield chunk['choices'][0]['text']
+
+    total = time.time() - t0
+    # Delta RSS per fase: prompt eval = sampai token pertama, generate = sisanya
+    metrics.record("explain.prompt_eval", (ttft or 0) * 1000, rss_first - rss_start, prefix=prefix_info["source"])
+    metrics.record("explain.generate", (total - (ttft or 0)) * 1000, metrics.rss_bytes() - rss_first,
+                   tokens=n_tokens, speculative=speculative)
+
+    if timings is not None:
+        timings.update(rag_timings)
+        timings.update({
+            "prefix": prefix_info,
+            "ttft_ms": round((ttft or 0) * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+            "speculative": speculative
+        })
+
+def cache_key(symptoms, triage_level, vision_analysis=None):
+    """Key result cache: semua yang masuk prompt + versi knowledge base RAG"""
+    return result_cache.make_key(
+        "explain", [MODEL_PATH], PROMPT_VERSION, EXPLAIN_PREFIX,
+        rag_retriever.get_retriever().version(),
+        result_cache.normalize_text(symptoms), triage_level,
+        result_cache.normalize_text(vision_analysis)
+    )
+
+def generate_medical_explanation(symptoms, triage_level, triage_note, vision_analysis=None, use_cache=True,
+                                 rag_context=None):
+    if not os.path.exists(MODEL_PATH):
+        return {"status": "error", "ai_explanation": "Model not found."}
+
+    try:
+        t0 = time.time()
+        key = cache_key(symptoms, triage_level, vision_analysis)
+        cached = result_cache.get("explain", key, bypass=not use_cache)
+        if cached is not None:
+            cached["cached"] = True
+            cached["timings"] = {"cache_ms": round((time.time() - t0) * 1000, 2)}
+            return cached
+
+        timings = {}
+        text = "".join(stream_medical_explanation(symptoms, triage_level, triage_note, vision_analysis, timings,
+                                                  rag_context))
 
-        return {
+        result = {
             "status": "success",
-            "model": "MedGemma-2B + RAG (Kemenkes RI)", # Kita pamerin fitur RAG-nya
-            "ai_explanation": output['choices'][0]['text'].strip(),
-            "method": "RAG-Enhanced Reasoning"
+            "model": MODEL_LABEL,
+            "ai_explanation": text.strip(),
+            "method": "RAG-Enhanced Reasoning",
+            "timings": timings
         }
+        result_cache.put("explain", key, result, bypass=not use_cache)
+        return result
 
     except Exception as e:
         return {"status": "error", "ai_explanation": str(e)}
 
+def stream_events(symptoms, triage_level, triage_note, vision_analysis=None, use_cache=True, rag_context=None):
+    """
+    Event JSONL untuk mode --stream dan endpoint /explain/stream:
+    {"type": "token", "text": ...} berkali-kali, lalu satu {"type": "done", ...hasil lengkap}
+    atau {"type": "error", ...}. Hasil dari result cache dikirim sebagai satu token.
+    """
+    timings = {}
+    pieces = []
+    try:
+        t0 = time.time()
+        key = cache_key(symptoms, triage_level, vision_analysis)
+        cached = result_cache.get("explain", key, bypass=not use_cache)
+        if cached is not None:
+            cached["cached"] = True
+            cached["timings"] = {"cache_ms": round((time.time() - t0) * 1000, 2)}
+            yield {"type": "token", "text": cached["ai_explanation"]}
+            yield dict(cached, type="done")
+            return
+
+        for text in stream_medical_explanation(symptoms, triage_level, triage_note, vision_analysis, timings,
+                                               rag_context):
+            pieces.append(text)
+            yield {"type": "token", "text": text}
+    except Exception as e:
+        yield {"type": "error", "status": "error", "ai_explanation": str(e)}
+        return
+
+    result = {
+        "status": "success",
+        "model": MODEL_LABEL,
+        "ai_explanation": "".join(pieces).strip(),
+        "method": "RAG-Enhanced Reasoning",
+        "timings": timings
+    }
+    result_cache.put("explain", key, result, bypass=not use_cache)
+    yield dict(result, type="done")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--symptoms", default="-")
@@ -107,16 +216,60 @@ if __name__ == "__main__":
     parser.add_argument("--triage-note", default="-")
     parser.add_argument("--vision-text", default=None)
     parser.add_argument("--json", action="store_true")
+    parser.add_argument("--stream", action="store_true", help="Output JSONL per token (lihat stream_events)")
+    parser.add_argument("--local", action="store_true", help="Load model di proses ini, tanpa inference server")
+    parser.add_argument("--no-cache", action="store_true", help="Abaikan result cache (selalu jalankan model)")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Prompt-lookup speculative decoding (selalu lokal; server: inference_server.py --speculative)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Cetak waktu import per dependency + load model ke stderr")
     args = parser.parse_args()
 
-    result = generate_medical_explanation(
-        args.symptoms, 
-        args.triage_level, 
-        args.triage_note,
-        args.vision_text
-    )
-    
+    if args.speculative:
+        try:
+            model_registry.set_speculative(True)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        args.local = True
+
+    payload = {
+        "symptoms": args.symptoms,
+        "triage_level": args.triage_level,
+        "triage_note": args.triage_note,
+        "vision_text": args.vision_text,
+        "no_cache": args.no_cache
+    }
+
+    if args.stream:
+        events = None
+        if not args.local:
+            events = inference_client.stream("/explain/stream", payload)
+        if events is None:
+            events = stream_events(args.symptoms, args.triage_level, args.triage_note, args.vision_text,
+                                   use_cache=not args.no_cache)
+        for event in events:
+            if event.get("type") == "token":
+                startup_profile.mark("first_result")
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+        startup_profile.report()
+        sys.exit(0)
+
+    result = None
+    if not args.local:
+        result = inference_client.request("/explain", payload)
+    if result is None:
+        result = generate_medical_explanation(
+            args.symptoms, 
+            args.triage_level, 
+            args.triage_note,
+            args.vision_text,
+            use_cache=not args.no_cache
+        )
+    startup_profile.mark("first_result")
+
     if args.json:
         print(json.dumps(result))
     else:
         print(result['ai_explanation'])
+    startup_profile.report()
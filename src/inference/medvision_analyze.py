@@ -1,23 +1,54 @@
 import argparse
+import glob
 import json
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-# Coba import Llama
-try:
-    from llama_cpp import Llama
-    from llama_cpp.llama_chat_format import Llava15ChatHandler
-except ImportError:
-    print(json.dumps({"status": "error", "analysis": "Library llama-cpp-python error"}))
-    sys.exit(1)
+import startup_profile  # paling awal: hook --profile-startup sebelum dependency lain
+
+import batch_io
+import inference_client
+import metrics
+import model_registry
+import model_scheduler
+import result_cache
+import upload_store
+import vision_cache
 
 # ==========================================
 # KONFIGURASI MODEL VISION (BakLLaVA)
 # ==========================================
 MODEL_PATH = "models/gguf/ggml-model-q4_k.gguf"
 CLIP_PATH = "models/gguf/mmproj-model-f16.gguf"
+N_CTX = 2048
+DEFAULT_QUERY = "Describe the medical condition in this image."
+PROMPT_VERSION = "vision-v1"  # Naikkan jika prompt berubah (hasil lama di result cache tidak dipakai)
+# Mode batch: gambar di-decode + resize di thread worker sementara model jalan.
+# PREFETCH membatasi jumlah gambar siap pakai di RAM (~200 KB per gambar 336px base64)
+PREFETCH = int(os.environ.get("MEDCONNECT_VISION_PREFETCH", "4"))
+PREFETCH_WORKERS = int(os.environ.get("MEDCONNECT_VISION_PREFETCH_WORKERS", "2"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+model_scheduler.register_stage("vision", MODEL_PATH, N_CTX, clip_model_path=CLIP_PATH)
+
+def analyze_medical_image(image_path, user_query, use_cache=True, prepared=None, image_hash=None):
+    """
+    `prepared`: hasil vision_cache.prepare_image yang sudah dibuat di luar (prefetch batch).
+    `image_hash`: gambar dari upload_store (app.py); file tidak perlu di-hash ulang dan result
+    cache / turunan 336px / embedding CLIP langsung dicari dengan hash ini.
+    """
+    if image_hash is not None:
+        image_path = upload_store.path_for(image_hash)
+        if image_path is None:
+            return {
+                "status": "error",
+                "analysis": f"Gambar tidak ada di upload store (sudah di-GC?): {image_hash}",
+                "model": "Error"
+            }
 
-def analyze_medical_image(image_path, user_query):
     # 1. Validasi File
     if not os.path.exists(MODEL_PATH) or not os.path.exists(CLIP_PATH):
         return {
@@ -34,50 +65,69 @@ def analyze_medical_image(image_path, user_query):
         }
 
     try:
-        # [FIX] Konversi ke Absolute Path agar 'file://' tidak error
-        abs_path = os.path.abspath(image_path)
-        
-        # 2. Setup "Mata" (Chat Handler untuk BakLLaVA/LLaVA v1.5)
-        # verbose=False agar log tidak mengotori JSON output
-        chat_handler = Llava15ChatHandler(clip_model_path=CLIP_PATH, verbose=False)
-
-        # 3. Load Model (Vision + Text)
-        llm = Llama(
-            model_path=MODEL_PATH,
-            chat_handler=chat_handler,
-            n_ctx=2048, 
-            n_threads=4, # Sesuaikan core CPU
-            n_gpu_layers=0, # Paksa CPU
-            verbose=False
+        t_start = time.time()
+        content_hash = prepared["hash"] if prepared else image_hash or vision_cache.file_sha256(image_path)
+        cache_key = result_cache.make_key(
+            "vision", [MODEL_PATH, CLIP_PATH], PROMPT_VERSION, vision_cache.CLIP_IMAGE_SIZE,
+            content_hash, result_cache.normalize_text(user_query)
         )
+        cached = result_cache.get("vision", cache_key, bypass=not use_cache)
+        if cached is not None:
+            cached["cached"] = True
+            cached["timings"] = {"cache_ms": round((time.time() - t_start) * 1000, 2)}
+            return cached
+
+        # Kecilkan ke resolusi CLIP + koreksi EXIF (untuk cache embedding)
+        image = prepared or vision_cache.prepare_image(image_path, content_hash=content_hash)
 
-        # 4. Prompting dengan Gambar
+        # 2. Prompting dengan Gambar
         prompt_system = "You are an AI Medical Assistant. Analyze this clinical image and describe the visible symptoms or conditions."
         
-        response = llm.create_chat_completion(
-            messages=[
-                {"role": "system", "content": prompt_system},
-                {
-                    "role": "user",
-                    "content": [
-                        # [FIX] Gunakan abs_path di sini
-                        {"type": "image_url", "image_url": {"url": f"file://{abs_path}"}},
-                        {"type": "text", "text": user_query}
-                    ]
-                }
-            ],
-            max_tokens=300,
-            temperature=0.1
-        )
+        # Sambil BakLLaVA jalan, Gemma untuk triase dimuat di background (jika muat di RAM)
+        model_scheduler.preload_next("vision")
 
+        # Model + chat handler LLaVA 1.5 dimuat sekali lewat registry
+        with model_registry.use_model(MODEL_PATH, n_ctx=N_CTX, clip_model_path=CLIP_PATH) as llm:
+            vision_cache.install(llm, CLIP_PATH)
+            cache_before = vision_cache.stats()
+            t_generate = time.time()
+            rss_start = metrics.rss_bytes()
+            response = llm.create_chat_completion(
+                messages=[
+                    {"role": "system", "content": prompt_system},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "image_url", "image_url": {"url": image["url"]}},
+                            {"type": "text", "text": user_query}
+                        ]
+                    }
+                ],
+                max_tokens=300,
+                temperature=0.1
+            )
+            cache_after = vision_cache.stats()
+
+        # Termasuk encode CLIP (span vision.image_encode terpisah jika embedding tidak di-cache)
+        metrics.record("vision.generate", (time.time() - t_generate) * 1000, metrics.rss_bytes() - rss_start,
+                       tokens=response.get("usage", {}).get("completion_tokens"))
         analysis_text = response["choices"][0]["message"]["content"]
 
-        return {
+        result = {
             "status": "success",
             "analysis": analysis_text,
             "model": "BakLLaVA-1 (Local Vision)",
-            "method": "Offline Multimodal Inference"
+            "method": "Offline Multimodal Inference",
+            "image_hash": image["hash"],
+            "timings": {
+                "preprocess_ms": image["ms"],
+                "clip_cached": cache_after["encoded"] == cache_before["encoded"],
+                "completion_tokens": response.get("usage", {}).get("completion_tokens"),
+                "total_ms": round((time.time() - t_start) * 1000, 1),
+            }
         }
+        result_cache.put("vision", cache_key, result, bypass=not use_cache)
+        return result
 
     except Exception as e:
         return {
@@ -86,16 +136,114 @@ def analyze_medical_image(image_path, user_query):
             "model": "Crash"
         }
 
+def list_images(directory=None, pattern=None):
+    """Daftar gambar dari --dir (rekursif, filter ekstensi) dan/atau --glob, terurut"""
+    paths = set()
+    if directory:
+        for root, _, files in os.walk(directory):
+            paths.update(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    if pattern:
+        paths.update(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(paths)
+
+def _prefetch(image_path):
+    """Jalan di thread worker: hash + decode + resize (PIL melepas GIL saat decode)"""
+    t0 = time.time()
+    try:
+        return vision_cache.prepare_image(image_path), round((time.time() - t0) * 1000, 1), None
+    except Exception as e:
+        return None, round((time.time() - t0) * 1000, 1), str(e)
+
+def run_batch(paths, output_path, user_query=DEFAULT_QUERY, use_cache=True,
+              prefetch=PREFETCH, workers=PREFETCH_WORKERS):
+    """
+    Analisis banyak gambar dengan model vision dimuat sekali di proses ini. Gambar berikutnya
+    disiapkan di thread worker selama model memproses gambar sekarang (antrian maks. `prefetch`).
+    Hasil JSONL per gambar (flush tiap baris); gambar yang sudah ada di output dilewati saat rerun.
+    """
+    # Hanya hasil sukses yang dilewati; gambar yang error dicoba lagi saat rerun
+    done = batch_io.load_done(output_path, key="image", accept=lambda r: r.get("status") == "success")
+    todo = [p for p in paths if os.path.abspath(p) not in done]
+    print(f"🖼️  {len(paths)} gambar | {len(paths) - len(todo)} sudah diproses | {len(todo)} antri")
+
+    counts = {"success": 0, "error": 0, "cached": 0}
+    meter = batch_io.Throughput()
+    with batch_io.JsonlWriter(output_path) as writer, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        window = deque()
+        pending = iter(todo)
+        for path in pending:
+            window.append((path, executor.submit(_prefetch, path)))
+            if len(window) >= max(1, prefetch):
+                break
+
+        while window:
+            path, future = window.popleft()
+            t_wait = time.time()
+            prepared, prep_ms, error = future.result()
+            wait_ms = round((time.time() - t_wait) * 1000, 1)
+            # Isi ulang antrian sebelum model jalan, supaya decode berikutnya tumpang tindih
+            nxt = next(pending, None)
+            if nxt is not None:
+                window.append((nxt, executor.submit(_prefetch, nxt)))
+
+            if error:
+                result = {"status": "error", "analysis": f"Gagal membaca gambar: {error}", "model": "Error"}
+            else:
+                result = analyze_medical_image(path, user_query, use_cache=use_cache, prepared=prepared)
+            timings = dict(result.get("timings", {}), prefetch_ms=prep_ms, queue_wait_ms=wait_ms)
+
+            writer.write(dict(result, image=os.path.abspath(path), timings=timings))
+            counts["cached" if result.get("cached") else result.get("status", "error")] += 1
+            meter.add()
+            print(f"{'✅' if result.get('status') == 'success' else '❌'} [{meter.count}/{len(todo)}] "
+                  f"{os.path.basename(path)} ({timings.get('total_ms', timings.get('cache_ms', 0))} ms)")
+
+    summary = dict(counts, processed=meter.count, skipped=len(paths) - len(todo),
+                   elapsed_s=round(meter.elapsed(), 1), images_per_min=round(meter.per_minute(), 1),
+                   output=output_path)
+    print(f"✅ Batch selesai: {meter.count} gambar dalam {summary['elapsed_s']}s "
+          f"({summary['images_per_min']} gambar/menit)")
+    return summary
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--image", required=True, help="Path ke file gambar")
-    parser.add_argument("--query", default="Describe the medical condition in this image.", help="Pertanyaan")
+    parser.add_argument("--image", help="Path ke file gambar")
+    parser.add_argument("--dir", help="Mode batch: semua gambar di folder ini (rekursif)")
+    parser.add_argument("--glob", help="Mode batch: pola file, mis. 'foto/**/*.jpg'")
+    parser.add_argument("--output", default="data/vision_results.jsonl", help="Mode batch: file hasil JSONL")
+    parser.add_argument("--query", default=DEFAULT_QUERY, help="Pertanyaan")
     parser.add_argument("--json", action="store_true")
+    parser.add_argument("--local", action="store_true", help="Load model di proses ini, tanpa inference server")
+    parser.add_argument("--no-cache", action="store_true", help="Abaikan result cache (selalu jalankan model)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Cetak waktu import per dependency + load model ke stderr")
     args = parser.parse_args()
 
-    result = analyze_medical_image(args.image, args.query)
-    
+    if args.dir or args.glob:
+        # Batch selalu lokal: model + chat handler dimuat sekali di proses ini
+        paths = list_images(args.dir, args.glob)
+        if not paths:
+            parser.error("Tidak ada gambar yang cocok dengan --dir / --glob")
+        summary = run_batch(paths, args.output, args.query, use_cache=not args.no_cache)
+        print(json.dumps(summary, ensure_ascii=False))
+        startup_profile.report()
+        sys.exit(0)
+    if not args.image:
+        parser.error("--image wajib diisi (atau --dir / --glob untuk mode batch)")
+
+    result = None
+    if not args.local:
+        # Server butuh path absolut karena cwd-nya bisa berbeda
+        result = inference_client.request("/vision", {
+            "image": os.path.abspath(args.image), "query": args.query, "no_cache": args.no_cache
+        })
+    if result is None:
+        result = analyze_medical_image(args.image, args.query, use_cache=not args.no_cache)
+    startup_profile.mark("first_result")
+
     if args.json:
         print(json.dumps(result))
     else:
         print(result['analysis'])
+    startup_profile.report()
@@ -0,0 +1,188 @@
+"""
+MedConnect Edge - Instrumentasi Hot Path
+Span per fase (load model, prompt eval, generate, embed/search RAG, encode gambar) dengan
+jumlah token dan delta RSS. Tiap span ditulis sebagai satu baris JSONL (logs/metrics.jsonl)
+dan disimpan di jendela bergulir per nama span untuk p50/p95:
+
+    with metrics.span("rag.search", k=3):
+        ...
+    metrics.record("triage.generate", ms, tokens=42)
+
+Server mengekspos GET /metrics (format teks Prometheus) dan GET /metrics/summary (JSON
+untuk tab System Info). Tanpa server, summary bisa dihitung ulang dari file log.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# KONFIGURASI
+ENABLED = os.environ.get("MEDCONNECT_METRICS", "1") != "0"
+LOG_PATH = os.environ.get("MEDCONNECT_METRICS_LOG", "logs/metrics.jsonl")
+LOG_MAX_MB = float(os.environ.get("MEDCONNECT_METRICS_LOG_MB", "20"))  # lalu diputar ke .1
+WINDOW = int(os.environ.get("MEDCONNECT_METRICS_WINDOW", "500"))  # sampel per span untuk p50/p95
+
+_lock = threading.Lock()
+_windows = {}  # nama span -> deque(ms)
+_totals = {}   # nama span -> {"count", "sum_ms", "tokens"}
+_gauges = {}   # nama -> (nilai, help), mis. kedalaman antrian
+_log = None
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes():
+    """RSS proses saat ini dari /proc (murah, dipanggil di setiap span); 0 jika tidak tersedia"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _write_log(entry):
+    global _log
+    try:
+        if _log is None:
+            os.makedirs(os.path.dirname(os.path.abspath(LOG_PATH)), exist_ok=True)
+            _log = open(LOG_PATH, "a", encoding="utf-8")
+        elif _log.tell() > LOG_MAX_MB * 1024 ** 2:
+            _log.close()
+            os.replace(LOG_PATH, LOG_PATH + ".1")
+            _log = open(LOG_PATH, "a", encoding="utf-8")
+        _log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        _log.flush()
+    except OSError:
+        # Metrics tidak boleh menggagalkan inferensi
+        _log = None
+
+
+def record(name, ms, rss_delta_bytes=None, **attrs):
+    """Catat span yang durasinya sudah diukur di tempat lain (mis. dari dict timings)"""
+    if not ENABLED or ms is None:
+        return
+    entry = {"ts": round(time.time(), 3), "span": name, "ms": round(float(ms), 2)}
+    if rss_delta_bytes is not None:
+        entry["rss_delta_mb"] = round(rss_delta_bytes / 1024 ** 2, 2)
+    entry.update({k: v for k, v in attrs.items() if v is not None})
+    with _lock:
+        window = _windows.get(name)
+        if window is None:
+            window = _windows[name] = deque(maxlen=WINDOW)
+            _totals[name] = {"count": 0, "sum_ms": 0.0, "tokens": 0}
+        window.append(entry["ms"])
+        totals = _totals[name]
+        totals["count"] += 1
+        totals["sum_ms"] += entry["ms"]
+        totals["tokens"] += int(attrs.get("tokens") or 0)
+        _write_log(entry)
+
+
+def gauge(name, value, help_text=""):
+    """Nilai sesaat (bukan durasi), diekspos sebagai gauge Prometheus medconnect_<name>"""
+    with _lock:
+        _gauges[name] = (value, help_text)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Ukur blok kode. Yield dict atribut yang bisa dilengkapi di dalam blok
+    (mis. attrs["tokens"] = n) sebelum span dicatat.
+    """
+    if not ENABLED:
+        yield attrs
+        return
+    rss_before = rss_bytes()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record(name, (time.perf_counter() - t0) * 1000, rss_bytes() - rss_before, **attrs)
+
+
+def _summarize(name, values, totals=None):
+    import numpy as np  # hanya untuk summary; record() di hot path tidak butuh numpy
+
+    arr = np.asarray(values, dtype=np.float64)
+    out = {
+        "span": name,
+        "n": len(arr),
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+        "mean_ms": round(float(arr.mean()), 2),
+    }
+    if totals is not None:
+        out["count"] = totals["count"]
+        out["sum_ms"] = round(totals["sum_ms"], 2)
+        out["tokens"] = totals["tokens"]
+    return out
+
+
+def summary():
+    """p50/p95/mean per span dari jendela bergulir proses ini, urut nama"""
+    with _lock:
+        items = [(name, list(window), dict(_totals[name])) for name, window in _windows.items()]
+    return [_summarize(name, values, totals) for name, values, totals in sorted(items) if values]
+
+
+def summary_from_log(path=LOG_PATH, window=WINDOW):
+    """Summary dari file JSONL (untuk UI / CLI saat server tidak jalan)"""
+    windows = {}
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            windows.setdefault(entry["span"], deque(maxlen=window)).append(entry["ms"])
+    return [_summarize(name, list(values)) for name, values in sorted(windows.items())]
+
+
+def prometheus_text():
+    """Format eksposisi teks Prometheus (summary per span + RSS proses)"""
+    lines = [
+        "# HELP medconnect_span_ms Durasi span hot path (ms), jendela bergulir",
+        "# TYPE medconnect_span_ms summary",
+    ]
+    rows = summary()
+    for s in rows:
+        label = f'span="{s["span"]}"'
+        lines.append(f'medconnect_span_ms{{{label},quantile="0.5"}} {s["p50_ms"]}')
+        lines.append(f'medconnect_span_ms{{{label},quantile="0.95"}} {s["p95_ms"]}')
+        lines.append(f"medconnect_span_ms_sum{{{label}}} {s['sum_ms']}")
+        lines.append(f"medconnect_span_ms_count{{{label}}} {s['count']}")
+    lines += [
+        "# HELP medconnect_span_tokens_total Token yang diproses per span",
+        "# TYPE medconnect_span_tokens_total counter",
+    ]
+    for s in rows:
+        lines.append(f'medconnect_span_tokens_total{{span="{s["span"]}"}} {s["tokens"]}')
+    with _lock:
+        gauges = sorted(_gauges.items())
+    for name, (value, help_text) in gauges:
+        lines += [
+            f"# HELP medconnect_{name} {help_text or name}",
+            f"# TYPE medconnect_{name} gauge",
+            f"medconnect_{name} {value}",
+        ]
+    lines += [
+        "# HELP medconnect_process_rss_bytes RSS proses inference server",
+        "# TYPE medconnect_process_rss_bytes gauge",
+        f"medconnect_process_rss_bytes {rss_bytes()}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    # Ringkasan dari file log: ./run.sh python src/inference/metrics.py
+    for row in summary_from_log():
+        print(f"{row['span']:24s} n={row['n']:4d}  p50={row['p50_ms']:9.1f} ms  p95={row['p95_ms']:9.1f} ms")
@@ -0,0 +1,421 @@
+"""
+MedConnect Edge - Model Registry
+Satu instance Llama per file GGUF, dipakai bersama oleh semua stage
+(triage & explain sama-sama memakai Gemma-2-2B -> cukup satu mmap + satu KV cache).
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import hardware_profile
+import metrics
+import startup_profile
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# llama_cpp (libllama + jinja2 untuk chat format) baru di-import saat model pertama dimuat,
+# jadi CLI yang dijawab server / rule engine tidak membayar ratusan ms import-nya
+
+# n_threads / n_batch / mmap / mlock per model dari profil host (hardware_profile.py tune)
+DEFAULT_CTX = 2048
+
+# Estimasi KV cache + buffer per token context (Gemma-2B ~106KB, Mistral-7B ~128KB)
+KV_BYTES_PER_TOKEN = 128 * 1024
+
+# Speculative decoding (prompt lookup): token draft diambil dari n-gram yang sudah ada di prompt
+# (referensi RAG yang dikutip) lalu diverifikasi sekaligus dalam satu batch. Hanya model teks.
+# Butuh logits_all, jadi matrix skor n_ctx x n_vocab float32 ikut dialokasikan (Gemma: ~1 MB/token)
+SPECULATIVE = os.environ.get("MEDCONNECT_SPECULATIVE", "0") == "1"
+SPEC_NUM_PRED_TOKENS = int(os.environ.get("MEDCONNECT_SPEC_TOKENS", "10"))
+SPEC_MAX_NGRAM = int(os.environ.get("MEDCONNECT_SPEC_NGRAM", "2"))
+SPEC_BYTES_PER_TOKEN = 256000 * 4
+
+
+def _default_budget_bytes():
+    """MEDCONNECT_RAM_BUDGET_MB, atau 75% RAM fisik. 0 = tanpa batas"""
+    env = os.environ.get("MEDCONNECT_RAM_BUDGET_MB")
+    if env:
+        return int(float(env) * 1024 ** 2)
+    if psutil is None:
+        return 0
+    return int(psutil.virtual_memory().total * 0.75)
+
+
+_budget_bytes = _default_budget_bytes()
+
+_models = {}      # model_path -> entry (dict)
+_ctx_hints = {}   # model_path -> n_ctx terbesar yang diminta stage mana pun
+_registry_lock = threading.Lock()
+
+_stats = {
+    "hits": 0,        # model sudah resident saat dipakai
+    "misses": 0,      # harus load dulu
+    "loads": 0,
+    "evictions": 0,
+    "preloads": 0,
+    "preload_skipped": 0,
+    "over_budget_loads": 0,
+}
+
+
+def _rss_bytes():
+    if psutil is None:
+        return 0
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def _mapped_rss_bytes(model_path):
+    """RSS dari mapping file GGUF (Linux /proc/self/smaps), None jika tidak tersedia"""
+    target = os.path.abspath(model_path)
+    total_kb = 0
+    in_target = False
+    try:
+        with open("/proc/self/smaps") as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if not parts[0].endswith(":"):
+                    # Baris header mapping: "addr perms offset dev inode [path]"
+                    in_target = len(parts) >= 6 and parts[5] == target
+                elif in_target and parts[0] == "Rss:":
+                    total_kb += int(parts[1])
+    except OSError:
+        return None
+    return total_kb * 1024
+
+
+def register(model_path, n_ctx):
+    """
+    Daftarkan kebutuhan context sebuah stage.
+    Load pertama langsung memakai n_ctx terbesar sehingga tidak perlu reload.
+    """
+    with _registry_lock:
+        _ctx_hints[model_path] = max(_ctx_hints.get(model_path, 0), n_ctx)
+
+
+def _wanted_ctx(model_path, n_ctx):
+    """
+    n_ctx terbesar yang didaftarkan stage, dibatasi n_ctx_max profil host (RAM kecil)
+    tapi tidak pernah di bawah n_ctx yang diminta pemanggil
+    """
+    with _registry_lock:
+        hint = _ctx_hints.get(model_path, 0)
+    n_ctx_max = hardware_profile.get(model_path)["n_ctx_max"]
+    if n_ctx_max:
+        hint = min(hint, n_ctx_max)
+    return max(n_ctx, hint)
+
+
+def _build_llama(model_path, n_ctx, clip_model_path=None):
+    Llama = startup_profile.load("llama_cpp", "Llama")
+    if Llama is None:
+        raise RuntimeError("Library llama-cpp-python tidak terinstall")
+
+    kwargs = {}
+    if clip_model_path:
+        # verbose=False agar log tidak mengotori JSON output
+        Llava15ChatHandler = startup_profile.load("llama_cpp.llama_chat_format", "Llava15ChatHandler")
+        kwargs["chat_handler"] = Llava15ChatHandler(clip_model_path=clip_model_path, verbose=False)
+    elif _speculative_enabled():
+        kwargs["draft_model"] = speculative_decoder()(
+            max_ngram_size=SPEC_MAX_NGRAM, num_pred_tokens=SPEC_NUM_PRED_TOKENS
+        )
+
+    hw = hardware_profile.get(model_path)
+    return Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=hw["n_threads"],
+        n_threads_batch=hw["n_threads_batch"],
+        n_batch=hw["n_batch"],
+        use_mmap=hw["use_mmap"],
+        use_mlock=hw["use_mlock"],
+        n_gpu_layers=0, # Paksa CPU
+        verbose=False,
+        **kwargs
+    )
+
+
+def speculative_decoder():
+    """Class LlamaPromptLookupDecoding, atau None jika llama-cpp-python belum mendukung"""
+    return startup_profile.load("llama_cpp.llama_speculative", "LlamaPromptLookupDecoding")
+
+
+def _speculative_enabled():
+    return SPECULATIVE and speculative_decoder() is not None
+
+
+def set_speculative(enabled, num_pred_tokens=None):
+    """
+    Aktifkan/matikan prompt-lookup decoding (flag --speculative). Berlaku untuk model teks
+    yang dimuat setelah ini; model yang sudah resident dengan setelan lain di-unload.
+    """
+    global SPECULATIVE, SPEC_NUM_PRED_TOKENS
+    if enabled and speculative_decoder() is None:
+        raise RuntimeError("llama_cpp.llama_speculative tidak tersedia (upgrade llama-cpp-python)")
+    SPECULATIVE = bool(enabled)
+    if num_pred_tokens:
+        SPEC_NUM_PRED_TOKENS = int(num_pred_tokens)
+    with _registry_lock:
+        entries = list(_models.values())
+    for entry in entries:
+        if entry["clip_path"] is None and entry["llm"] is not None \
+                and (getattr(entry["llm"], "draft_model", None) is not None) != SPECULATIVE:
+            unload(entry["path"])
+
+
+def _get_entry(model_path, clip_model_path=None):
+    with _registry_lock:
+        entry = _models.get(model_path)
+        if entry is None:
+            entry = {
+                "path": model_path,
+                "clip_path": clip_model_path,
+                "llm": None,
+                "n_ctx": 0,
+                "lock": threading.RLock(),
+                "loaded_at": None,
+                "load_time_s": 0.0,
+                "rss_delta_bytes": 0,
+                "footprint_bytes": 0,
+                "last_used": None,
+                "uses": 0,
+                "reloads": 0,
+                "in_use": 0,
+            }
+            _models[model_path] = entry
+        return entry
+
+
+def _file_bytes(entry):
+    total = 0
+    for path in (entry["path"], entry["clip_path"]):
+        if path and os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def _static_estimate(entry, n_ctx):
+    estimate = _file_bytes(entry) + n_ctx * KV_BYTES_PER_TOKEN
+    if entry["clip_path"] is None and _speculative_enabled():
+        estimate += n_ctx * SPEC_BYTES_PER_TOKEN
+    return estimate
+
+
+def estimate_bytes(entry, n_ctx):
+    """Perkiraan footprint model: bobot GGUF (+mmproj) + KV cache, atau hasil ukur load sebelumnya"""
+    return max(_static_estimate(entry, n_ctx), entry["footprint_bytes"])
+
+
+def _resident_bytes(exclude=None):
+    with _registry_lock:
+        return sum(
+            e["footprint_bytes"] for e in _models.values()
+            if e["llm"] is not None and e is not exclude
+        )
+
+
+def _make_room(entry, need_bytes):
+    """
+    Evict model Least-Recently-Used sampai `need_bytes` muat di budget.
+    Model yang sedang dipakai (lock dipegang stage lain) tidak disentuh.
+    Return True jika akhirnya muat.
+    """
+    if _budget_bytes <= 0:
+        return True
+
+    while _resident_bytes(exclude=entry) + need_bytes > _budget_bytes:
+        with _registry_lock:
+            candidates = sorted(
+                (e for e in _models.values()
+                 if e is not entry and e["llm"] is not None and e["in_use"] == 0),
+                key=lambda e: e["last_used"] or 0
+            )
+        evicted = False
+        for victim in candidates:
+            # Non-blocking: kalau stage lain sedang memakainya, coba kandidat berikutnya
+            if not victim["lock"].acquire(blocking=False):
+                continue
+            try:
+                if victim["llm"] is not None and victim["in_use"] == 0:
+                    _close(victim)
+                    _stats["evictions"] += 1
+                    evicted = True
+            finally:
+                victim["lock"].release()
+            if evicted:
+                break
+        if not evicted:
+            return False
+    return True
+
+
+def _ensure_loaded(entry, n_ctx, allow_over_budget=True):
+    """
+    Load (atau reload dengan context lebih besar). Caller wajib memegang entry['lock'].
+    Return instance Llama, atau None jika allow_over_budget=False dan model tidak muat.
+    """
+    wanted = _wanted_ctx(entry["path"], n_ctx)
+
+    if entry["llm"] is not None and entry["n_ctx"] >= wanted:
+        _stats["hits"] += 1
+        return entry["llm"]
+
+    if entry["llm"] is not None:
+        # Context kurang besar -> lepas instance lama dulu agar tidak double mmap
+        _close(entry)
+        entry["reloads"] += 1
+
+    if not _make_room(entry, estimate_bytes(entry, wanted)):
+        if not allow_over_budget:
+            return None
+        # Lebih baik jalan lambat (swap/page cache) daripada gagal total
+        _stats["over_budget_loads"] += 1
+
+    _stats["misses"] += 1
+    rss_before = _rss_bytes()
+    t0 = time.time()
+    with metrics.span("model.load", model=os.path.basename(entry["path"]), n_ctx=wanted):
+        entry["llm"] = _build_llama(entry["path"], wanted, entry["clip_path"])
+    entry["n_ctx"] = wanted
+    entry["load_time_s"] = time.time() - t0
+    startup_profile.record("model", os.path.basename(entry["path"]), entry["load_time_s"] * 1000)
+    entry["rss_delta_bytes"] = max(0, _rss_bytes() - rss_before)
+    # mmap bisa belum ter-page-in saat load, jadi pakai estimasi sebagai batas bawah
+    entry["footprint_bytes"] = max(entry["rss_delta_bytes"], _static_estimate(entry, wanted))
+    entry["loaded_at"] = time.time()
+    _stats["loads"] += 1
+    return entry["llm"]
+
+
+def _close(entry):
+    llm = entry["llm"]
+    entry["llm"] = None
+    entry["n_ctx"] = 0
+    if llm is not None and hasattr(llm, "close"):
+        llm.close()
+
+
+@contextmanager
+def use_model(model_path, n_ctx=DEFAULT_CTX, clip_model_path=None):
+    """
+    Pinjam instance bersama untuk satu inferensi.
+    Lock per model memastikan hanya satu stage yang memakai KV cache pada satu waktu.
+    """
+    entry = _get_entry(model_path, clip_model_path)
+    with entry["lock"]:
+        entry["in_use"] += 1
+        try:
+            llm = _ensure_loaded(entry, n_ctx)
+            entry["uses"] += 1
+            entry["last_used"] = time.time()
+            yield llm
+        finally:
+            entry["in_use"] -= 1
+            entry["last_used"] = time.time()
+
+
+def preload(model_path, n_ctx=DEFAULT_CTX, clip_model_path=None, allow_over_budget=True):
+    """
+    Muat model tanpa inferensi (server --preload / preload stage berikutnya).
+    Return waktu load dalam detik, atau None jika dilewati karena budget.
+    """
+    entry = _get_entry(model_path, clip_model_path)
+    with entry["lock"]:
+        if entry["llm"] is not None:
+            return 0.0
+        if _ensure_loaded(entry, n_ctx, allow_over_budget=allow_over_budget) is None:
+            _stats["preload_skipped"] += 1
+            return None
+        _stats["preloads"] += 1
+        entry["last_used"] = time.time()
+    return entry["load_time_s"]
+
+
+def fits_budget(model_path, n_ctx=DEFAULT_CTX, clip_model_path=None):
+    """Cek apakah model bisa dimuat tanpa melewati budget (tanpa evict apa pun)"""
+    if _budget_bytes <= 0:
+        return True
+    entry = _get_entry(model_path, clip_model_path)
+    wanted = _wanted_ctx(model_path, n_ctx)
+    return _resident_bytes(exclude=entry) + estimate_bytes(entry, wanted) <= _budget_bytes
+
+
+def fits_together(specs):
+    """
+    Cek apakah semua model di `specs` [(model_path, n_ctx, clip_model_path)] bisa resident
+    bersamaan di budget, di samping model lain yang sudah dimuat (tanpa evict apa pun)
+    """
+    if _budget_bytes <= 0:
+        return True
+    entries = [(_get_entry(path, clip), _wanted_ctx(path, n_ctx)) for path, n_ctx, clip in specs]
+    wanted = {id(entry) for entry, _ in entries}
+    with _registry_lock:
+        others = sum(
+            e["footprint_bytes"] for e in _models.values()
+            if e["llm"] is not None and id(e) not in wanted
+        )
+    return others + sum(estimate_bytes(entry, n_ctx) for entry, n_ctx in entries) <= _budget_bytes
+
+
+def set_budget_mb(budget_mb):
+    global _budget_bytes
+    _budget_bytes = int(budget_mb * 1024 ** 2)
+
+
+def unload(model_path):
+    entry = _models.get(model_path)
+    if entry is None:
+        return False
+    with entry["lock"]:
+        loaded = entry["llm"] is not None
+        _close(entry)
+    return loaded
+
+
+def is_loaded(model_path):
+    entry = _models.get(model_path)
+    return entry is not None and entry["llm"] is not None
+
+
+def memory_report():
+    """Ringkasan memori per model untuk tab System Info"""
+    report = []
+    with _registry_lock:
+        entries = list(_models.values())
+    for entry in entries:
+        mapped = _mapped_rss_bytes(entry["path"]) if entry["llm"] is not None else 0
+        file_bytes = os.path.getsize(entry["path"]) if os.path.exists(entry["path"]) else 0
+        report.append({
+            "model": os.path.basename(entry["path"]),
+            "loaded": entry["llm"] is not None,
+            "n_ctx": entry["n_ctx"],
+            "file_mb": round(file_bytes / 1024 ** 2, 1),
+            "mmap_resident_mb": None if mapped is None else round(mapped / 1024 ** 2, 1),
+            "load_rss_delta_mb": round(entry["rss_delta_bytes"] / 1024 ** 2, 1),
+            "load_time_s": round(entry["load_time_s"], 2),
+            "uses": entry["uses"],
+            "reloads": entry["reloads"],
+            "speculative": getattr(entry["llm"], "draft_model", None) is not None,
+            "footprint_mb": round(entry["footprint_bytes"] / 1024 ** 2, 1) if entry["llm"] is not None else 0,
+            "last_used": entry["last_used"],
+        })
+    return report
+
+
+def stats():
+    """Counter load / eviction / hit rate untuk monitoring"""
+    lookups = _stats["hits"] + _stats["misses"]
+    return dict(
+        _stats,
+        hit_rate=round(_stats["hits"] / lookups, 3) if lookups else None,
+        budget_mb=round(_budget_bytes / 1024 ** 2, 1) if _budget_bytes > 0 else None,
+        resident_mb=round(_resident_bytes() / 1024 ** 2, 1),
+        loaded_models=sum(1 for e in list(_models.values()) if e["llm"] is not None),
+    )
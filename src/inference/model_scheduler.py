@@ -0,0 +1,99 @@
+"""
+MedConnect Edge - Model Scheduler
+Urutan pipeline vision -> triage -> explain. Saat satu stage jalan, model stage
+berikutnya bisa dimuat di background selama masih muat di RAM budget registry.
+"""
+
+import os
+import threading
+
+import model_registry
+
+PIPELINE = ["vision", "triage", "explain"]
+
+# Preload stage berikutnya (MEDCONNECT_PRELOAD_NEXT=0 untuk mematikan)
+PRELOAD_NEXT = os.environ.get("MEDCONNECT_PRELOAD_NEXT", "1") != "0"
+
+_stages = {}  # nama stage -> {"model_path", "n_ctx", "clip_model_path"}
+_preloading = set()
+_preload_lock = threading.Lock()
+
+
+def register_stage(stage, model_path, n_ctx, clip_model_path=None):
+    """Dipanggil modul inference saat import agar scheduler tahu model tiap stage"""
+    _stages[stage] = {
+        "model_path": model_path,
+        "n_ctx": n_ctx,
+        "clip_model_path": clip_model_path,
+    }
+    model_registry.register(model_path, n_ctx)
+
+
+def next_stage(stage):
+    if stage not in PIPELINE:
+        return None
+    idx = PIPELINE.index(stage)
+    return PIPELINE[idx + 1] if idx + 1 < len(PIPELINE) else None
+
+
+def _preload_worker(spec):
+    try:
+        # Tanpa evict paksa: kalau tidak muat di budget, lewati saja
+        model_registry.preload(
+            spec["model_path"],
+            n_ctx=spec["n_ctx"],
+            clip_model_path=spec["clip_model_path"],
+            allow_over_budget=False
+        )
+    except Exception:
+        pass
+    finally:
+        with _preload_lock:
+            _preloading.discard(spec["model_path"])
+
+
+def preload_next(stage):
+    """
+    Mulai load model stage berikutnya di background thread.
+    Return thread-nya, atau None jika tidak perlu (sudah resident / tidak muat / dimatikan).
+    """
+    if not PRELOAD_NEXT:
+        return None
+
+    spec = _stages.get(next_stage(stage))
+    if spec is None or not os.path.exists(spec["model_path"]):
+        return None
+    if model_registry.is_loaded(spec["model_path"]):
+        return None
+    if not model_registry.fits_budget(spec["model_path"], spec["n_ctx"], spec["clip_model_path"]):
+        return None
+
+    with _preload_lock:
+        if spec["model_path"] in _preloading:
+            return None
+        _preloading.add(spec["model_path"])
+
+    thread = threading.Thread(target=_preload_worker, args=(spec,), daemon=True)
+    thread.start()
+    return thread
+
+
+def can_overlap(*stages):
+    """
+    True jika model semua stage muat di RAM budget bersamaan, sehingga stage-stage itu boleh
+    jalan paralel. Stage yang belum terdaftar dianggap tidak muat (caller menjalankan berurutan).
+    """
+    specs = [_stages.get(stage) for stage in stages]
+    if any(spec is None for spec in specs):
+        return False
+    return model_registry.fits_together(
+        [(spec["model_path"], spec["n_ctx"], spec["clip_model_path"]) for spec in specs]
+    )
+
+
+def stats():
+    return dict(
+        model_registry.stats(),
+        preload_next=PRELOAD_NEXT,
+        preloading=sorted(_preloading),
+    )
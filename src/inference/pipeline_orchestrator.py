@@ -0,0 +1,195 @@
+"""
+MedConnect Edge - Pipeline Orchestrator
+Stage "Analyze Case" dijalankan sebagai graph dependensi di thread pool, bukan berurutan:
+
+    rag ─────────────┐
+    triage_text ─────┼─> triage_final ─> explain (di-stream oleh caller)
+    vision ──────────┘
+
+- rag dan triage_text (triase sementara, teks saja) mulai begitu ada gejala
+- vision (BakLLaVA) jalan paralel dengan triage_text hanya jika BakLLaVA + Gemma muat di RAM
+  budget bersamaan (POST /scheduler/overlap); kalau tidak, vision dulu lalu triage_text,
+  supaya registry bisa meng-evict satu model sebelum memuat yang lain
+- triage_final hanya menjalankan triase ulang jika hasil vision bisa mengubah keputusan
+Semua stage memanggil inference server lewat inference_client.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import inference_client
+
+MAX_WORKERS = 4
+
+
+class Stage:
+    def __init__(self, name, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+class PipelineOrchestrator:
+    """
+    Jalankan stage begitu semua dependensinya selesai. `fn(results)` menerima dict hasil
+    stage sebelumnya; stage yang mengembalikan None dianggap dilewati.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self.stages = {}
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' bergantung pada stage yang belum ada: {dep}")
+        self.stages[name] = Stage(name, fn, deps)
+        return self
+
+    def run(self, on_stage_done=None):
+        """
+        Return (results, timings). timings[stage] = start_ms / end_ms relatif terhadap awal
+        pipeline + wall_ms dan status. `on_stage_done(name, result)` dipanggil dari thread
+        pemanggil (aman untuk update UI Streamlit).
+        """
+        t0 = time.time()
+        results = {}
+        timings = {}
+        pending = dict(self.stages)
+        running = {}
+
+        def timed(stage, inputs):
+            start = time.time()
+            try:
+                value, status = stage.fn(inputs), "ok"
+            except Exception as e:
+                value, status = {"status": "error", "error": str(e)}, "error"
+            end = time.time()
+            return value, {
+                "start_ms": round((start - t0) * 1000, 1),
+                "end_ms": round((end - t0) * 1000, 1),
+                "wall_ms": round((end - start) * 1000, 1),
+                "status": status if value is not None else "skipped",
+            }
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in [n for n, s in pending.items() if all(d in results for d in s.deps)]:
+                    stage = pending.pop(name)
+                    inputs = {d: results[d] for d in stage.deps}
+                    running[executor.submit(timed, stage, inputs)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name], timings[name] = future.result()
+                    if on_stage_done is not None:
+                        on_stage_done(name, results[name])
+
+        timings["total_ms"] = round((time.time() - t0) * 1000, 1)
+        return results, timings
+
+
+def combine_input(symptoms, vision_text):
+    """Gabungkan keluhan + hasil vision untuk triase (sama seperti alur lama app.py)"""
+    if not symptoms.strip():
+        return f"Patient condition based on image: {vision_text}"
+    return symptoms + f" [Visual Context from Image: {vision_text}]"
+
+
+def build_case_pipeline(symptoms, image_path=None, no_cache=False, triage_mode=None, call=None, job_id=None,
+                        image_hash=None):
+    """
+    Graph stage untuk satu kasus (tanpa explain, yang di-stream terpisah oleh caller).
+    `call(endpoint, payload)` default inference_client.request; benchmark memakai handler
+    server langsung di proses yang sama. `job_id` dari antrian admission ikut di setiap request.
+    Gambar dari upload_store dikirim sebagai `image_hash`, selain itu path file (`image_path`).
+    """
+    has_text = bool(symptoms.strip())
+    base_call = call or inference_client.request
+
+    def call(endpoint, payload):
+        if job_id:
+            payload = dict(payload, job_id=job_id)
+        return base_call(endpoint, payload)
+
+    def rag(_):
+        if not has_text:
+            return None
+        return call("/rag", {"symptoms": symptoms})
+
+    def triage_text(_):
+        if not has_text:
+            return None
+        return call("/triage", {"symptoms": symptoms, "no_cache": no_cache, "mode": triage_mode})
+
+    def vision(_):
+        if image_hash:
+            return call("/vision", {"image_hash": image_hash, "no_cache": no_cache})
+        if not image_path:
+            return None
+        return call("/vision", {"image": image_path, "no_cache": no_cache})
+
+    # Ada gambar dan teks: cek dulu apakah dua model boleh resident bersamaan.
+    # Server tidak menjawab -> anggap tidak muat (berurutan selalu aman untuk RAM)
+    overlap = True
+    if has_text and (image_hash or image_path):
+        res = call("/scheduler/overlap", {"stages": ["vision", "triage"]})
+        overlap = bool(res and res.get("overlap"))
+
+    def triage_final(inputs):
+        provisional = inputs["triage_text"]
+        vis = inputs["vision"]
+        vision_text = vis.get("analysis", "") if vis and vis.get("status") == "success" else ""
+
+        if not vision_text:
+            # Tidak ada konteks visual -> triase sementara sudah final
+            return dict(provisional, retriaged=False) if provisional else None
+        if provisional and provisional.get("triage_level") == "EMERGENCY":
+            # Sudah level tertinggi, konteks visual tidak mengubah keputusan
+            return dict(provisional, retriaged=False)
+
+        final = call("/triage", {
+            "symptoms": combine_input(symptoms, vision_text), "no_cache": no_cache, "mode": triage_mode
+        })
+        if not final or "triage_level" not in final:
+            return dict(provisional, retriaged=False) if provisional else final
+        final["retriaged"] = True
+        final["changed"] = bool(provisional) and final["triage_level"] != provisional.get("triage_level")
+        return final
+
+    return (
+        PipelineOrchestrator()
+        .add("rag", rag)
+        .add("vision", vision)
+        .add("triage_text", triage_text, deps=() if overlap else ("vision",))
+        .add("triage_final", triage_final, deps=("triage_text", "vision"))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symptoms", default="")
+    parser.add_argument("--image", default=None)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--triage-mode", choices=["generate", "logits"], default=None)
+    args = parser.parse_args()
+
+    if not inference_client.ensure_server():
+        print("❌ Inference server gagal start. Cek logs/inference_server.log")
+        raise SystemExit(1)
+
+    # Server butuh path absolut karena cwd-nya bisa berbeda
+    image_path = os.path.abspath(args.image) if args.image else None
+    on_wait = lambda t: print(f"⏳ Antrian #{t['position']} ({t['priority']}), estimasi {t['eta_s']:.0f}s")
+    with inference_client.admitted(f"cli-{os.getpid()}", args.symptoms, on_wait) as ticket:
+        if ticket is not None and ticket.get("state") != "active":
+            print(f"❌ Tidak mendapat slot antrian: {json.dumps(ticket)}")
+            raise SystemExit(1)
+        pipeline = build_case_pipeline(args.symptoms, image_path, args.no_cache, args.triage_mode,
+                                       job_id=ticket and ticket["job_id"])
+        results, timings = pipeline.run(lambda name, _: print(f"✅ {name} selesai"))
+    print(json.dumps({"results": results, "timings": timings}, ensure_ascii=False, indent=2))
@@ -0,0 +1,112 @@
+"""
+MedConnect Edge - Prompt Prefix KV Cache
+Instruksi statis di awal prompt triase/penjelasan cukup dievaluasi sekali per model load.
+State KV-nya disimpan (RAM + disk) lalu di-restore sebelum tiap request, sehingga
+llama.cpp hanya perlu memproses bagian prompt yang berisi data pasien.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+import weakref
+
+import metrics
+
+# KONFIGURASI
+CACHE_DIR = os.environ.get("MEDCONNECT_PREFIX_CACHE_DIR", "data/cache/prefix_kv")
+ENABLED = os.environ.get("MEDCONNECT_PREFIX_CACHE", "1") != "0"
+
+# llm -> {key: LlamaState}; hilang otomatis saat model di-evict/reload
+_states = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+_stats = {"memory_hits": 0, "disk_hits": 0, "evaluated": 0, "errors": 0}
+
+
+def _state_key(model_path, n_ctx, prefix):
+    """Key berubah jika file model, ukuran context, atau teks prefix berubah"""
+    h = hashlib.sha256()
+    st = os.stat(model_path)
+    h.update(os.path.abspath(model_path).encode("utf-8"))
+    h.update(f"{st.st_size}:{int(st.st_mtime)}:{n_ctx}".encode("utf-8"))
+    h.update(prefix.encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def _compact(state):
+    # Logits prefix tidak dipakai (suffix selalu dievaluasi ulang), simpan 1 baris saja
+    # supaya state di RAM/disk hanya berisi KV cache, bukan n_batch x vocab float32.
+    state.scores = state.scores[-1:].copy()
+    return state
+
+
+def _load_from_disk(key):
+    path = os.path.join(CACHE_DIR, key + ".pkl")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # File rusak/beda versi llama_cpp -> evaluasi ulang
+        os.remove(path)
+        return None
+
+
+def _save_to_disk(key, state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, key + ".pkl")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def restore_prefix(llm, model_path, prefix):
+    """
+    Pastikan KV cache `llm` berisi `prefix`. Caller wajib memegang lock model (registry).
+    Return dict info: source (memory/disk/eval/disabled), tokens, ms.
+    """
+    t0 = time.time()
+    if not ENABLED:
+        return {"source": "disabled", "tokens": 0, "ms": 0.0}
+
+    try:
+        key = _state_key(model_path, llm.n_ctx(), prefix)
+        with _lock:
+            per_model = _states.setdefault(llm, {})
+            state = per_model.get(key)
+
+        if state is not None:
+            source = "memory"
+            _stats["memory_hits"] += 1
+        else:
+            state = _load_from_disk(key)
+            if state is not None:
+                source = "disk"
+                _stats["disk_hits"] += 1
+            else:
+                source = "eval"
+                tokens = llm.tokenize(prefix.encode("utf-8"), add_bos=True, special=True)
+                llm.reset()
+                with metrics.span("prefix.eval", tokens=len(tokens)):
+                    llm.eval(tokens)
+                state = _compact(llm.save_state())
+                _save_to_disk(key, state)
+                _stats["evaluated"] += 1
+            with _lock:
+                per_model[key] = state
+
+        llm.load_state(state)
+        return {"source": source, "tokens": int(state.n_tokens), "ms": round((time.time() - t0) * 1000, 1)}
+    except Exception as e:
+        # Cache hanya optimasi: kalau gagal, prompt tetap dievaluasi penuh
+        _stats["errors"] += 1
+        llm.reset()
+        return {"source": "error", "tokens": 0, "ms": round((time.time() - t0) * 1000, 1), "error": str(e)}
+
+
+def stats():
+    return dict(_stats, enabled=ENABLED, cache_dir=CACHE_DIR)
@@ -0,0 +1,258 @@
+"""
+MedConnect Edge - RAG Retriever
+Model embedding (MiniLM) dan vector store dibuka sekali per proses, bukan per query.
+Embedding query dan hasil top-k di-cache (LRU) berdasarkan teks query yang dinormalisasi;
+cache dibuang dan index dibuka ulang begitu knowledge base di-build ulang (version()).
+
+Backend dipilih lewat MEDCONNECT_RAG_BACKEND:
+- chroma : ChromaDB via langchain (default)
+- numpy  : matrix .npy memory-mapped dari src/rag/vector_index.py
+
+Jika index BM25 (src/rag/bm25_index.py) ada dan MEDCONNECT_RAG_HYBRID=1, hasil vektor
+digabung dengan hasil kata kunci BM25 via reciprocal rank fusion.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Modul index dipakai bersama dengan build_knowledge.py. bm25_index / vector_index (numpy)
+# baru di-import di backend yang memakainya: tanpa index, explain tidak membayar import numpy
+RAG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "rag"))
+if RAG_DIR not in sys.path:
+    sys.path.append(RAG_DIR)
+
+import metrics
+
+# KONFIGURASI
+DB_PATH = "data/vectorstore"
+NUMPY_INDEX_PATH = os.environ.get("MEDCONNECT_NUMPY_INDEX_PATH", "data/vectorstore_np")  # = vector_index.INDEX_PATH
+BM25_PATH = os.environ.get("MEDCONNECT_BM25_PATH", "data/bm25_index")  # = bm25_index.BM25_PATH
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CACHE_SIZE = int(os.environ.get("MEDCONNECT_RAG_CACHE_SIZE", "256"))
+RAG_BACKEND = os.environ.get("MEDCONNECT_RAG_BACKEND", "chroma")
+HYBRID = os.environ.get("MEDCONNECT_RAG_HYBRID", "1") == "1"
+HYBRID_CANDIDATES = 4  # kandidat per ranking = k * HYBRID_CANDIDATES sebelum fusion
+
+
+def _index_exists(path):
+    """Sama dengan NumpyVectorIndex.exists / Bm25Index.exists, tanpa import modul index"""
+    return os.path.exists(os.path.join(path, "meta.json"))
+
+
+def normalize_query(text):
+    """Huruf kecil + spasi dirapikan, supaya 'Demam  tinggi' dan 'demam tinggi' satu cache"""
+    return " ".join(text.lower().split())
+
+
+class _LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RagRetriever:
+    def __init__(self, db_path=None, embed_model=EMBED_MODEL, cache_size=CACHE_SIZE, backend=RAG_BACKEND,
+                 hybrid=HYBRID, bm25_path=BM25_PATH):
+        if backend not in ("chroma", "numpy"):
+            raise ValueError(f"RAG backend tidak dikenal: {backend}")
+        self.backend = backend
+        if db_path is None:
+            db_path = NUMPY_INDEX_PATH if backend == "numpy" else DB_PATH
+        self.db_path = db_path
+        self.embed_model = embed_model
+        self._embeddings = None
+        self._db = None
+        self._bm25 = None
+        self.bm25_path = bm25_path
+        self._hybrid_wanted = hybrid
+        self.hybrid = False
+        self._version = None
+        self._lock = threading.Lock()
+        self._embed_cache = _LRU(cache_size)
+        self._result_cache = _LRU(cache_size)
+        self.stats = {
+            "queries": 0,
+            "embed_cache_hits": 0,
+            "result_cache_hits": 0,
+            "bm25_only_hits": 0,
+            "reloads": 0,
+            "load_ms": 0.0,
+            "last_timings": None,
+        }
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        """
+        Caller memegang _lock. Jika knowledge base berubah sejak dicek terakhir (build_knowledge.py
+        menambah PDF, index BM25 baru dibuat), buang kedua LRU lalu buka ulang index saat query
+        berikutnya, termasuk memutuskan ulang mode hybrid.
+        """
+        version = self.version()
+        if version == self._version:
+            return
+        if self._version is not None:
+            self.stats["reloads"] += 1
+        self._version = version
+        self._embed_cache = _LRU(self._embed_cache.maxsize)
+        self._result_cache = _LRU(self._result_cache.maxsize)
+        # Index numpy di-mmap dari file lama (folder diganti saat build), jadi dibuka ulang juga
+        self._db = None
+        self._embeddings = None
+        self.hybrid = self._hybrid_wanted and _index_exists(self.bm25_path)
+        self._bm25 = None
+        if self.hybrid:
+            import bm25_index
+            # Lazy: vocab + posting baru dibuka saat query pertama
+            self._bm25 = bm25_index.Bm25Index(self.bm25_path)
+
+    def available(self):
+        if self.backend == "numpy":
+            return _index_exists(self.db_path)
+        return os.path.exists(self.db_path)
+
+    def _load(self):
+        """Muat model embedding + buka vector store (sekali saja)"""
+        if self._db is not None:
+            return
+        t0 = time.time()
+        if self.backend == "numpy":
+            import vector_index
+            self._db = vector_index.NumpyVectorIndex(self.db_path)
+            self._embeddings = vector_index.SentenceEmbedder(self._db.meta.get("embed_model", self.embed_model))
+        else:
+            # Import di sini: backend numpy tidak perlu membayar import langchain + chromadb
+            try:
+                from langchain_community.vectorstores import Chroma
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+            except ImportError:
+                raise RuntimeError("Library error. Pastikan install langchain & chromadb.")
+            self._embeddings = HuggingFaceEmbeddings(model_name=self.embed_model)
+            self._db = Chroma(persist_directory=self.db_path, embedding_function=self._embeddings)
+        self.stats["load_ms"] = round((time.time() - t0) * 1000, 1)
+        metrics.record("rag.load", self.stats["load_ms"], backend=self.backend)
+
+    def _search_vector(self, vector, k):
+        if self.backend == "numpy":
+            return [chunk["text"] for _, chunk in self._db.search(vector, k=k)]
+        docs = self._db.similarity_search_by_vector(vector, k=k)
+        return [doc.page_content for doc in docs]
+
+    def search(self, query_text, k=3):
+        """
+        Return (list teks dokumen, timings).
+        timings memisahkan waktu embed dan search (ms) + status cache.
+        """
+        key = (normalize_query(query_text), k)
+        timings = {"embed_ms": 0.0, "search_ms": 0.0, "bm25_ms": 0.0,
+                   "embed_cached": False, "result_cached": False}
+
+        with self._lock:
+            self._refresh()
+            timings["hybrid"] = hybrid = self.hybrid
+            self.stats["queries"] += 1
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                self.stats["result_cache_hits"] += 1
+                timings["result_cached"] = True
+                self.stats["last_timings"] = timings
+                return cached, timings
+
+            self._load()
+
+            # 1. Embed query
+            t0 = time.time()
+            vector = self._embed_cache.get(key[0])
+            if vector is None:
+                vector = self._embeddings.embed_query(key[0])
+                self._embed_cache.put(key[0], vector)
+            else:
+                self.stats["embed_cache_hits"] += 1
+                timings["embed_cached"] = True
+            timings["embed_ms"] = round((time.time() - t0) * 1000, 2)
+
+            # 2. Cari k paragraf paling relevan
+            t0 = time.time()
+            n_candidates = k * HYBRID_CANDIDATES if self.hybrid else k
+            texts = self._search_vector(vector, n_candidates)
+            timings["search_ms"] = round((time.time() - t0) * 1000, 2)
+
+            # 3. Hybrid: gabungkan dengan ranking kata kunci BM25
+            if self.hybrid:
+                t0 = time.time()
+                keyword_texts = [chunk["text"] for _, chunk in self._bm25.search(key[0], k=n_candidates)]
+                import bm25_index
+                fused = bm25_index.reciprocal_rank_fusion([texts, keyword_texts], k=k)
+                if set(fused) - set(texts[:k]):
+                    self.stats["bm25_only_hits"] += 1
+                texts = fused
+                timings["bm25_ms"] = round((time.time() - t0) * 1000, 2)
+
+            self._result_cache.put(key, texts)
+            self.stats["last_timings"] = timings
+
+        metrics.record("rag.embed", timings["embed_ms"], cached=timings["embed_cached"])
+        metrics.record("rag.search", timings["search_ms"], k=n_candidates, backend=self.backend)
+        if hybrid:
+            metrics.record("rag.bm25", timings["bm25_ms"], k=n_candidates)
+        return texts, timings
+
+    def version(self):
+        """
+        Berubah setiap knowledge base di-build ulang (manifest ingestion ditulis ulang) atau index
+        BM25 baru muncul. Dipakai LRU retriever (_refresh) dan result_cache supaya jawaban lama
+        tidak dipakai setelah PDF baru masuk.
+        """
+        hybrid = self._hybrid_wanted and _index_exists(self.bm25_path)
+        parts = [self.backend, str(hybrid)]
+        stores = [self.db_path] + ([self.bm25_path] if hybrid else [])
+        for store in stores:
+            manifest = os.path.join(store, "ingest_manifest.json")  # lihat build_knowledge.MANIFEST_NAME
+            parts.append(str(os.path.getmtime(manifest)) if os.path.exists(manifest) else "-")
+        return ":".join(parts)
+
+    def get_context(self, query_text, k=3):
+        """Teks referensi siap masuk prompt + timings"""
+        texts, timings = self.search(query_text, k=k)
+        return "\n".join([f"- {text}" for text in texts]), timings
+
+    def summary(self):
+        return dict(
+            self.stats,
+            backend=self.backend,
+            hybrid=self.hybrid,
+            loaded=self._db is not None,
+            embed_cache_size=len(self._embed_cache),
+            result_cache_size=len(self._result_cache),
+        )
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever():
+    """Retriever bersama untuk seluruh proses (server / CLI)"""
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            _retriever = RagRetriever()
+        return _retriever
@@ -0,0 +1,159 @@
+"""
+MedConnect Edge - Persistent Result Cache
+Ketiga stage berjalan di temperature 0.0-0.2, jadi kasus yang sama (tab Examples,
+retry setelah UI timeout, pertanyaan lanjutan) cukup dijawab dari SQLite dalam
+hitungan milidetik. Key = hash dari input yang dinormalisasi + file model + versi prompt.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# KONFIGURASI
+DB_PATH = os.environ.get("MEDCONNECT_RESULT_CACHE_PATH", "data/cache/results.sqlite")
+ENABLED = os.environ.get("MEDCONNECT_RESULT_CACHE", "1") != "0"
+TTL_HOURS = float(os.environ.get("MEDCONNECT_RESULT_CACHE_TTL_H", "168"))
+MAX_MB = float(os.environ.get("MEDCONNECT_RESULT_CACHE_MB", "64"))
+
+_lock = threading.Lock()
+_conn = None
+
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "bypassed": 0, "writes": 0, "errors": 0}
+_stage_stats = {}
+
+
+def normalize_text(text):
+    """Huruf kecil + spasi dirapikan, supaya 'Demam  tinggi' dan 'demam tinggi' satu key"""
+    return " ".join((text or "").lower().split())
+
+
+def model_tag(model_path):
+    """Identitas file model: path + ukuran + mtime (model diganti -> key berubah)"""
+    if not os.path.exists(model_path):
+        return f"{model_path}:missing"
+    st = os.stat(model_path)
+    return f"{os.path.abspath(model_path)}:{st.st_size}:{int(st.st_mtime)}"
+
+
+def make_key(stage, model_paths, prompt_version, *parts):
+    h = hashlib.sha256(stage.encode("utf-8"))
+    for path in model_paths:
+        h.update(b"\0" + model_tag(path).encode("utf-8"))
+    h.update(b"\0" + prompt_version.encode("utf-8"))
+    for part in parts:
+        h.update(b"\0" + str(part).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        # Dipakai dari banyak thread server; akses dijaga _lock
+        _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, stage TEXT, value TEXT, size INTEGER,"
+            " created REAL, last_used REAL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON results(last_used)")
+    return _conn
+
+
+def _count(stage, name):
+    _stats[name] += 1
+    per_stage = _stage_stats.setdefault(stage, {"hits": 0, "misses": 0})
+    if name in per_stage:
+        per_stage[name] += 1
+
+
+def get(stage, key, bypass=False):
+    """Return hasil (dict) atau None jika miss / expired / bypass"""
+    if not ENABLED or bypass:
+        _stats["bypassed"] += 1
+        return None
+    try:
+        with _lock:
+            db = _db()
+            row = db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                _count(stage, "misses")
+                return None
+            now = time.time()
+            if TTL_HOURS > 0 and now - row[1] > TTL_HOURS * 3600:
+                db.execute("DELETE FROM results WHERE key = ?", (key,))
+                db.commit()
+                _stats["expired"] += 1
+                _count(stage, "misses")
+                return None
+            db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+            db.commit()
+            _count(stage, "hits")
+        return json.loads(row[0])
+    except Exception:
+        _stats["errors"] += 1
+        return None
+
+
+def put(stage, key, value, bypass=False):
+    """Simpan hasil sukses; entri paling lama tidak dipakai dibuang jika melebihi MAX_MB"""
+    if not ENABLED or bypass:
+        return
+    try:
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with _lock:
+            db = _db()
+            db.execute(
+                "INSERT OR REPLACE INTO results (key, stage, value, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stage, data, len(data), now, now),
+            )
+            _stats["writes"] += 1
+            _evict(db)
+            db.commit()
+    except Exception:
+        _stats["errors"] += 1
+
+
+def _evict(db):
+    if TTL_HOURS > 0:
+        cur = db.execute("DELETE FROM results WHERE created < ?", (time.time() - TTL_HOURS * 3600,))
+        _stats["expired"] += cur.rowcount
+    if MAX_MB <= 0:
+        return
+    total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    budget = MAX_MB * 1024 * 1024
+    if total <= budget:
+        return
+    # LRU: buang dari last_used tertua sampai di bawah budget
+    for key, size in db.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+        if total <= budget:
+            break
+        db.execute("DELETE FROM results WHERE key = ?", (key,))
+        total -= size
+        _stats["evictions"] += 1
+
+
+def clear():
+    with _lock:
+        db = _db()
+        db.execute("DELETE FROM results")
+        db.commit()
+
+
+def stats():
+    info = dict(_stats, enabled=ENABLED, path=DB_PATH, ttl_hours=TTL_HOURS, max_mb=MAX_MB, stages=_stage_stats)
+    lookups = _stats["hits"] + _stats["misses"]
+    info["hit_rate"] = round(_stats["hits"] / lookups, 3) if lookups else 0.0
+    try:
+        with _lock:
+            entries, size = _db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        info["entries"] = entries
+        info["size_mb"] = round(size / (1024 * 1024), 3)
+    except Exception:
+        pass
+    return info
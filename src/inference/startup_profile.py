@@ -0,0 +1,107 @@
+"""
+MedConnect Edge - Startup Profile
+Waktu import per dependency + load model + waktu sampai hasil pertama, untuk flag
+--profile-startup di CLI (atau MEDCONNECT_PROFILE_STARTUP=1). Modul ini harus di-import
+paling awal supaya hook import sempat terpasang sebelum dependency lain dimuat.
+
+Dependency berat (llama_cpp, numpy, PIL, langchain) di-import lewat `load()` di jalur kode
+yang memakainya, sehingga triase via server / rule engine tidak membayar biaya import-nya.
+
+    ./run.sh python src/inference/triage_cli.py --symptoms "sesak napas" --profile-startup
+"""
+
+import builtins
+import importlib
+import os
+import sys
+import threading
+import time
+
+T0 = time.perf_counter()  # ~saat CLI mulai (modul ini di-import paling awal)
+ENABLED = "--profile-startup" in sys.argv or os.environ.get("MEDCONNECT_PROFILE_STARTUP", "0") == "1"
+TARGET_MS = 1000  # target triase: CLI mulai -> hasil pertama < 1 detik
+
+_events = []  # (jenis, nama, ms sejak T0 saat mulai, durasi ms)
+_local = threading.local()
+_original_import = builtins.__import__
+
+
+def record(kind, name, ms, start_ms=None):
+    if ENABLED:
+        if start_ms is None:
+            start_ms = (time.perf_counter() - T0) * 1000 - ms
+        _events.append((kind, name, round(start_ms, 1), round(ms, 1)))
+
+
+def _profiled_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """Hanya import top-level (bukan import di dalam import) yang belum ada di sys.modules"""
+    depth = getattr(_local, "depth", 0)
+    root = name.partition(".")[0]
+    if depth or level or root in sys.modules:
+        _local.depth = depth + 1
+        try:
+            return _original_import(name, globals, locals, fromlist, level)
+        finally:
+            _local.depth = depth
+    t0 = time.perf_counter()
+    _local.depth = 1
+    try:
+        module = _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = 0
+    # Import opsional yang gagal (ImportError) tidak dicatat
+    record("import", root, (time.perf_counter() - t0) * 1000, (t0 - T0) * 1000)
+    return module
+
+
+def load(name, attr=None):
+    """
+    Import lazy: modul (atau atributnya) di-import saat pertama dipakai, None jika tidak terinstall
+    atau gagal dimuat (mis. libllama.so tidak cocok -> OSError / RuntimeError dari ctypes).
+    Dipakai untuk dependency opsional yang berat, pengganti try/import di level modul.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        depth = getattr(_local, "depth", 0)
+        t0 = time.perf_counter()
+        _local.depth = depth + 1  # import di dalamnya masuk ke durasi modul ini
+        try:
+            module = importlib.import_module(name)
+        except (ImportError, OSError, RuntimeError):
+            return None
+        finally:
+            _local.depth = depth
+        if depth == 0:
+            record("import", name, (time.perf_counter() - t0) * 1000, (t0 - T0) * 1000)
+    return getattr(module, attr, None) if attr else module
+
+
+def mark(label):
+    """Tandai titik penting (mis. 'first_result') dengan waktu sejak T0; hanya yang pertama"""
+    if ENABLED and not any(e[0] == "mark" and e[1] == label for e in _events):
+        record("mark", label, 0.0, (time.perf_counter() - T0) * 1000)
+
+
+def report(stream=None):
+    """Tabel waktu ke stderr (stdout tetap JSON bersih untuk app.py)"""
+    if not ENABLED:
+        return None
+    stream = stream or sys.stderr
+    rows = sorted(_events, key=lambda e: e[2])
+    stream.write("\n⏱️  Startup profile (ms sejak CLI mulai)\n")
+    stream.write(f"{'jenis':8s} {'nama':32s} {'mulai':>9s} {'durasi':>9s}\n")
+    for kind, name, start_ms, ms in rows:
+        stream.write(f"{kind:8s} {name[:32]:32s} {start_ms:9.1f} {ms:9.1f}\n")
+    imports_ms = sum(e[3] for e in rows if e[0] == "import")
+    first = next((e[2] for e in rows if e[0] == "mark" and e[1] == "first_result"), None)
+    stream.write(f"Total import: {imports_ms:.1f} ms")
+    if first is not None:
+        status = "✅" if first <= TARGET_MS else "⚠️ "
+        stream.write(f" | hasil pertama: {first:.1f} ms {status} (target {TARGET_MS} ms)")
+    stream.write("\n")
+    return {"events": [dict(zip(("kind", "name", "start_ms", "ms"), e)) for e in rows],
+            "imports_ms": round(imports_ms, 1), "first_result_ms": first}
+
+
+if ENABLED:
+    builtins.__import__ = _profiled_import
@@ -1,31 +1,42 @@
 import argparse
 import json
 import os
+import re
 import sys
+import time
 from datetime import datetime
 
-# Coba import library AI
-try:
-    from llama_cpp import Llama
-except ImportError:
-    sys.exit(1)
+import startup_profile  # paling awal: hook --profile-startup sebelum dependency lain
+
+import batch_io
+import inference_client
+import metrics
+import model_registry
+import model_scheduler
+import prefix_cache
+import result_cache
+import triage_rules
 
 MODEL_PATH = "models/gguf/gemma-2-2b-it-Q4_K_M.gguf"
+N_CTX = 1024
+VALID_LEVELS = ["EMERGENCY", "URGENT", "NON-URGENT"]
+MAX_TOKENS = 100
+REASON_MAX_CHARS = 120
+# Sampling dibatasi grammar GBNF: JSON selalu valid, level hanya 3 enum, dan generasi
+# berhenti begitu "}" ditutup (tidak ada teks/code fence tambahan sampai max_tokens)
+USE_GRAMMAR = os.environ.get("MEDCONNECT_TRIAGE_GRAMMAR", "1") != "0"
+# generate: decode JSON lengkap | logits: skor 3 label dari satu forward pass, reason dibuat saat diminta
+TRIAGE_MODE = os.environ.get("MEDCONNECT_TRIAGE_MODE", "generate")
+CALIBRATION_PATH = os.environ.get("MEDCONNECT_TRIAGE_CALIBRATION", "data/cache/triage_calibration.json")
+PROMPT_VERSION = "triage-v2"  # Naikkan jika prompt / parsing berubah (hasil lama di result cache tidak dipakai)
 
-def get_ai_triage(symptoms):
-    if not os.path.exists(MODEL_PATH):
-        return "NON-URGENT", "Model AI tidak ditemukan."
+# Gemma dipakai bersama dengan medgemma_explain lewat registry
+model_scheduler.register_stage("triage", MODEL_PATH, N_CTX)
 
-    try:
-        llm = Llama(
-            model_path=MODEL_PATH,
-            n_ctx=1024,
-            n_threads=4,
-            verbose=False
-        )
-
-        # PROMPT UPDATED: Anti-Panik Mode
-        prompt = f"""<start_of_turn>user
+# PROMPT UPDATED: Anti-Panik Mode
+# Bagian statis ditaruh di depan agar KV state-nya bisa di-cache (prefix_cache),
+# data pasien selalu di akhir prompt.
+TRIAGE_PREFIX = """<start_of_turn>user
 Anda adalah sistem triase medis. 
 Tugas: Klasifikasikan input pasien ke dalam 3 kategori:
 
@@ -33,58 +44,450 @@ Tugas: Klasifikasikan input pasien ke dalam 3 kategori:
 2. URGENT (Serius: demam tinggi >3 hari, muntah terus, luka dalam)
 3. NON-URGENT (Ringan/Pertanyaan Umum: gatal, batuk ringan, atau HANYA BERTANYA "bahaya gak?" tanpa menyebut gejala)
 
-Input Pasien: "{symptoms}"
-
 Aturan Penting: 
 - Jika input hanya berupa pertanyaan abstrak (contoh: "ini bahaya gak?", "obatnya apa?") TANPA deskripsi gejala fisik, WAJIB pilih NON-URGENT.
 - Jangan asumsikan kondisi terburuk jika informasi tidak lengkap.
 
 Format JSON:
-{{
+{
   "level": "KATEGORI",
   "reason": "Alasan singkat"
-}}
+}
+"""
+
+TRIAGE_GRAMMAR = r'''
+root   ::= "{" ws "\"level\":" ws level "," ws "\"reason\":" ws reason ws "}"
+level  ::= "\"EMERGENCY\"" | "\"URGENT\"" | "\"NON-URGENT\""
+reason ::= "\"" char{1,%d} "\""
+char   ::= [^"\\\n]
+ws     ::= [ \n]?
+''' % REASON_MAX_CHARS
+
+_grammar = None
+
+def get_grammar():
+    """Grammar di-parse sekali per proses; None jika llama_cpp tidak mendukung"""
+    global _grammar
+    if _grammar is None:
+        LlamaGrammar = startup_profile.load("llama_cpp", "LlamaGrammar")
+        if LlamaGrammar is not None:
+            _grammar = LlamaGrammar.from_string(TRIAGE_GRAMMAR, verbose=False)
+    return _grammar
+
+def parse_triage_json(text):
+    """Return (level, reason) atau None. Level tetap diambil walau JSON terpotong."""
+    text = text.replace("```json", "").replace("```", "").strip()
+    try:
+        data = json.loads(text)
+        return data.get("level", "NON-URGENT"), data.get("reason", "Analisis AI")
+    except ValueError:
+        pass
+    # Mode tanpa grammar: jangan turunkan EMERGENCY jadi NON-URGENT hanya karena JSON rusak
+    match = re.search(r'"level"\s*:\s*"(EMERGENCY|URGENT|NON-URGENT)"', text)
+    if match:
+        return match.group(1), "Analisis AI"
+    return None
+
+def build_prompt(symptoms):
+    return TRIAGE_PREFIX + f"""
+Input Pasien: "{symptoms}"
+
 Hanya JSON.<end_of_turn>
 <start_of_turn>model
 """
 
-        output = llm(
-            prompt,
-            max_tokens=100,
-            temperature=0.0,
-            stop=["<end_of_turn>"]
-        )
+def get_ai_triage(symptoms, timings=None, use_grammar=USE_GRAMMAR):
+    """
+    Return (level, reason). Jika `timings` (dict) diberikan, diisi info
+    prefix cache, time-to-first-token, dan jumlah token yang dihasilkan.
+    """
+    if not os.path.exists(MODEL_PATH):
+        return "NON-URGENT", "Model AI tidak ditemukan."
+
+    try:
+        prompt = build_prompt(symptoms)
+        grammar = get_grammar() if use_grammar else None
 
-        response_text = output['choices'][0]['text'].strip()
-        response_text = response_text.replace("```json", "").replace("```", "").strip()
-        
-        try:
-            data = json.loads(response_text)
-            return data.get("level", "NON-URGENT"), data.get("reason", "Analisis AI")
-        except:
+        model_scheduler.preload_next("triage")
+        with model_registry.use_model(MODEL_PATH, n_ctx=N_CTX) as llm:
+            t0 = time.time()
+            rss_start = metrics.rss_bytes()
+            prefix_info = prefix_cache.restore_prefix(llm, MODEL_PATH, TRIAGE_PREFIX)
+
+            chunks = []
+            ttft = None
+            rss_first = rss_start
+            for chunk in llm(
+                prompt,
+                max_tokens=MAX_TOKENS,
+                temperature=0.0,
+                stop=["<end_of_turn>"],
+                grammar=grammar,
+                stream=True
+            ):
+                if ttft is None:
+                    ttft = time.time() - t0
+                    rss_first = metrics.rss_bytes()
+                chunks.append(chunk['choices'][0]['text'])
+
+        total = time.time() - t0
+        # Delta RSS per fase: prompt eval = sampai token pertama, generate = sisanya
+        metrics.record("triage.prompt_eval", (ttft or 0) * 1000, rss_first - rss_start, prefix=prefix_info["source"])
+        metrics.record("triage.generate", (total - (ttft or 0)) * 1000, metrics.rss_bytes() - rss_first,
+                       tokens=len(chunks))
+
+        # Satu chunk stream = satu token
+        if timings is not None:
+            timings.update({
+                "prefix": prefix_info,
+                "ttft_ms": round((ttft or 0) * 1000, 1),
+                "total_ms": round(total * 1000, 1),
+                "grammar": grammar is not None,
+                "completion_tokens": len(chunks),
+                "tokens_saved_vs_max": MAX_TOKENS - len(chunks)
+            })
+
+        parsed = parse_triage_json("".join(chunks))
+        if parsed is None:
+            if timings is not None:
+                timings["parse_error"] = True
             return "NON-URGENT", "Pertanyaan umum/tidak spesifik"
+        return parsed
 
     except Exception as e:
         return "NON-URGENT", f"Error: {str(e)}"
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--symptoms", required=True)
-    args = parser.parse_args()
+# ==========================================
+# MODE LOGITS: satu evaluasi prompt, tanpa decode
+# ==========================================
+# Prompt diakhiri pembuka JSON, jadi token berikutnya adalah awal nama label
+LABEL_PREFIX = '{"level": "'
+
+_calibration_temp = None
+
+def get_calibration_temp():
+    """Temperature scaling hasil --calibrate (1.0 = softmax mentah)"""
+    global _calibration_temp
+    if _calibration_temp is None:
+        _calibration_temp = 1.0
+        if os.path.exists(CALIBRATION_PATH):
+            with open(CALIBRATION_PATH) as f:
+                _calibration_temp = float(json.load(f).get("temperature", 1.0))
+    return _calibration_temp
+
+def label_token_ids(llm):
+    """Token pertama tiap label, ditokenisasi dalam konteks LABEL_PREFIX (batas token sama dengan prompt)"""
+    base = llm.tokenize(LABEL_PREFIX.encode("utf-8"), add_bos=False, special=False)
+    ids = []
+    for label in VALID_LEVELS:
+        full = llm.tokenize((LABEL_PREFIX + label).encode("utf-8"), add_bos=False, special=False)
+        if full[:len(base)] != base or len(full) == len(base):
+            raise ValueError(f"Tokenisasi label tidak sejajar dengan prefix: {label}")
+        ids.append(full[len(base)])
+    if len(set(ids)) != len(ids):
+        raise ValueError("Token pertama label tidak unik, mode logits tidak bisa dipakai")
+    return ids
+
+def _eval_prompt(llm, prompt):
+    """
+    Evaluasi prompt di atas KV prefix yang sudah di-restore; hanya token setelah prefix bersama
+    terpanjang yang diproses. Token terakhir prefix statis bisa bergabung dengan awal data pasien
+    ("}\n" + "\n" -> satu token "\n\n"), jadi cocok sebagian tetap dipakai, seperti Llama.generate.
+    Return (token dievaluasi, token KV yang dipakai ulang).
+    """
+    tokens = llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+    n_past = 0
+    # Minimal satu token dievaluasi supaya logit posisi terakhir tersedia
+    for cached, token in zip(llm.input_ids[:llm.n_tokens], tokens[:-1]):
+        if cached != token:
+            break
+        n_past += 1
+    if n_past == 0:
+        llm.reset()
+    else:
+        # eval() membuang KV setelah n_tokens sebelum memproses token baru
+        llm.n_tokens = n_past
+    llm.eval(tokens[n_past:])
+    return len(tokens) - n_past, n_past
+
+def _last_logits(llm, ids):
+    """
+    Logit posisi terakhir setelah eval, langsung dari context llama.cpp. Instance Gemma
+    dimuat tanpa logits_all, jadi llm.scores tidak berisi skor per posisi (basi / nol).
+    """
+    llama_cpp = startup_profile.load("llama_cpp")
+    get_ith = getattr(llama_cpp, "llama_get_logits_ith", None)
+    if get_ith is not None:
+        row = get_ith(llm.ctx, -1)
+    else:
+        # llama-cpp-python lama: llama_get_logits = logit batch terakhir (satu baris tanpa logits_all)
+        row = llm._ctx.get_logits()
+    if not row:
+        raise RuntimeError("Logit tidak tersedia setelah eval")
+    return [float(row[i]) for i in ids]
+
+def softmax(logits, temperature=1.0):
+    import numpy as np
+
+    z = np.asarray(logits, dtype=np.float64) / temperature
+    z = np.exp(z - z.max())
+    return z / z.sum()
 
-    level, note = get_ai_triage(args.symptoms)
+def classify_logits(symptoms, timings=None):
+    """
+    Return (level, probabilities, raw_logits) dari logit token pertama ketiga label.
+    Probabilitas sudah dikalibrasi (temperature scaling) dan bisa di-threshold.
+    """
+    import numpy as np
+
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError("Model AI tidak ditemukan.")
+
+    model_scheduler.preload_next("triage")
+    with model_registry.use_model(MODEL_PATH, n_ctx=N_CTX) as llm:
+        t0 = time.time()
+        rss_start = metrics.rss_bytes()
+        prefix_info = prefix_cache.restore_prefix(llm, MODEL_PATH, TRIAGE_PREFIX)
+        n_eval, n_reused = _eval_prompt(llm, build_prompt(symptoms) + LABEL_PREFIX)
+        ids = label_token_ids(llm)
+        raw = np.array(_last_logits(llm, ids), dtype=np.float64)
+
+    probs = softmax(raw, get_calibration_temp())
+    metrics.record("triage.prompt_eval", (time.time() - t0) * 1000, metrics.rss_bytes() - rss_start, tokens=n_eval,
+                   prefix=prefix_info["source"], mode="logits")
+    if timings is not None:
+        timings.update({
+            "prefix": dict(prefix_info, reused_tokens=n_reused),
+            "eval_tokens": n_eval,
+            "completion_tokens": 0,
+            "total_ms": round((time.time() - t0) * 1000, 1)
+        })
+    level = VALID_LEVELS[int(np.argmax(probs))]
+    return level, {lvl: round(float(p), 4) for lvl, p in zip(VALID_LEVELS, probs)}, raw.tolist()
+
+def get_triage_reason(symptoms, level, max_tokens=40):
+    """Alasan singkat untuk level yang sudah diputuskan (mode logits, dibuat hanya jika UI meminta)"""
+    if not os.path.exists(MODEL_PATH):
+        return "Model AI tidak ditemukan."
+    if level not in VALID_LEVELS:
+        level = "NON-URGENT"
+
+    prompt = build_prompt(symptoms) + f'{{"level": "{level}", "reason": "'
+    with model_registry.use_model(MODEL_PATH, n_ctx=N_CTX) as llm:
+        prefix_cache.restore_prefix(llm, MODEL_PATH, TRIAGE_PREFIX)
+        output = llm(prompt, max_tokens=max_tokens, temperature=0.0, stop=['"', "<end_of_turn>"])
+    return output['choices'][0]['text'].strip() or "Analisis AI"
+
+def calibrate(path):
+    """
+    Cari temperature T yang meminimalkan NLL pada kasus berlabel (JSONL: {"symptoms", "level"}),
+    lalu simpan ke CALIBRATION_PATH.
+    """
+    import numpy as np
+
+    global _calibration_temp
+    logits, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if case.get("level") not in VALID_LEVELS:
+                continue
+            _, _, raw = classify_logits(case["symptoms"])
+            logits.append(raw)
+            labels.append(VALID_LEVELS.index(case["level"]))
+    if not logits:
+        print("❌ Tidak ada kasus berlabel yang valid")
+        return None
+
+    logits = np.array(logits)
+    labels = np.array(labels)
+
+    def nll(temperature):
+        return float(np.mean([-np.log(softmax(row, temperature)[y] + 1e-12) for row, y in zip(logits, labels)]))
+
+    grid = np.linspace(0.25, 5.0, 96)
+    best = float(min(grid, key=nll))
+    accuracy = float(np.mean(np.argmax(logits, axis=1) == labels))
+
+    os.makedirs(os.path.dirname(CALIBRATION_PATH) or ".", exist_ok=True)
+    report = {"temperature": round(best, 3), "cases": len(labels), "accuracy": round(accuracy, 3),
+              "nll_raw": round(nll(1.0), 4), "nll_calibrated": round(nll(best), 4)}
+    with open(CALIBRATION_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    _calibration_temp = best
+    return report
+
+def triage_case(symptoms, use_cache=True, mode=None):
+    """
+    Triase satu kasus dan kembalikan output JSON lengkap.
+    `source`: rules (red flag jelas, tanpa LLM) | llm | fallback (model hilang / error).
+    `mode`: generate | logits (default TRIAGE_MODE).
+    """
+    mode = mode or TRIAGE_MODE
+    t0 = time.time()
+
+    # Red flag yang jelas langsung diputuskan rule engine (mikrodetik), sisanya ke Gemma
+    rule = triage_rules.classify(symptoms)
+    if rule is not None:
+        triage_rules.record("rules", rule["matched"])
+        metrics.record("triage.rules", rule["elapsed_us"] / 1000)
+        return {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "input": symptoms,
+            "triage_level": rule["level"],
+            "note": rule["reason"],
+            "disclaimer": "AI Triase",
+            "source": "rules",
+            "matched_rules": rule["matched"],
+            "timings": {"rules_us": rule["elapsed_us"]}
+        }
+
+    cache_key = result_cache.make_key(
+        "triage", [MODEL_PATH], PROMPT_VERSION, TRIAGE_PREFIX, mode, get_calibration_temp(),
+        result_cache.normalize_text(symptoms)
+    )
+    cached = result_cache.get("triage", cache_key, bypass=not use_cache)
+    if cached is not None:
+        cached.update({
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "input": symptoms,
+            "cached": True,
+            "timings": {"cache_ms": round((time.time() - t0) * 1000, 2)}
+        })
+        return cached
+
+    timings = {}
+    extra = {}
+    if mode == "logits":
+        try:
+            level, probs, _ = classify_logits(symptoms, timings)
+            note = ""
+            extra = {"probabilities": probs, "confidence": max(probs.values()), "reason_pending": True}
+        except Exception as e:
+            timings.clear()
+            level, note = "NON-URGENT", f"Error: {str(e)}"
+    else:
+        level, note = get_ai_triage(symptoms, timings)
 
     # Validasi
-    valid_levels = ["EMERGENCY", "URGENT", "NON-URGENT"]
-    if level not in valid_levels:
-        level = "NON-URGENT" 
+    if level not in VALID_LEVELS:
+        level = "NON-URGENT"
+
+    # timings hanya terisi jika LLM benar-benar jalan (bukan fallback error / model hilang)
+    source = "llm" if "total_ms" in timings else "fallback"
+    triage_rules.record(source)
 
-    out = {
+    result = {
         "timestamp": datetime.utcnow().isoformat() + "Z",
-        "input": args.symptoms,
+        "input": symptoms,
         "triage_level": level,
         "note": note,
-        "disclaimer": "AI Triase"
+        "disclaimer": "AI Triase",
+        "source": source,
+        "mode": mode,
+        "timings": timings
     }
-    
+    result.update(extra)
+    if source == "llm":
+        result_cache.put("triage", cache_key, result, bypass=not use_cache)
+    return result
+
+def run_batch(input_path, output_path, local=False, use_cache=True, mode=None, report_every=25):
+    """
+    Triase banyak kasus dari JSONL ({"id": ..., "symptoms": ...} per baris) ke JSONL output.
+    Model dimuat sekali (server yang sudah jalan, atau satu Llama di proses ini); hasil
+    ditulis per kasus sehingga run yang terputus bisa dilanjutkan: id yang sudah ada di
+    output dilewati. Return ringkasan dict.
+    """
+    done = batch_io.load_done(output_path)
+    if done:
+        print(f"↩️  Melanjutkan: {len(done)} kasus sudah ada di {output_path}")
+
+    use_server = not local and inference_client.is_alive()
+    print(f"⚙️  Backend: {'inference server' if use_server else 'lokal (model dimuat sekali)'} | mode: {mode or TRIAGE_MODE}")
+
+    counts = {"rules": 0, "llm": 0, "fallback": 0, "cached": 0, "skipped": 0, "invalid": 0}
+    meter = batch_io.Throughput()
+    with batch_io.JsonlWriter(output_path) as writer:
+        for line_no, record in batch_io.iter_jsonl(input_path):
+            case_id = record.get("id", f"line-{line_no}")
+            if case_id in done:
+                counts["skipped"] += 1
+                continue
+            symptoms = str(record.get("symptoms", "")).strip()
+            if not symptoms:
+                counts["invalid"] += 1
+                print(f"⚠️  {case_id}: symptoms kosong, dilewati")
+                continue
+
+            out = None
+            if use_server:
+                out = inference_client.request("/triage", {"symptoms": symptoms, "no_cache": not use_cache, "mode": mode})
+            if out is None:
+                out = triage_case(symptoms, use_cache=use_cache, mode=mode)
+
+            writer.write(dict(out, id=case_id))
+            done.add(case_id)
+            counts["cached" if out.get("cached") else out.get("source", "fallback")] += 1
+            meter.add()
+            if meter.count == 1:
+                startup_profile.mark("first_result")
+            if meter.count % report_every == 0:
+                print(f"⏱️  {meter.count} kasus | {meter.per_minute():.1f} kasus/menit")
+
+    summary = dict(counts, processed=meter.count, elapsed_s=round(meter.elapsed(), 1),
+                   cases_per_min=round(meter.per_minute(), 1), output=output_path)
+    print(f"✅ Batch selesai: {meter.count} kasus dalam {summary['elapsed_s']}s "
+          f"({summary['cases_per_min']} kasus/menit)")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symptoms")
+    parser.add_argument("--local", action="store_true", help="Load model di proses ini, tanpa inference server")
+    parser.add_argument("--no-cache", action="store_true", help="Abaikan result cache (selalu jalankan model)")
+    parser.add_argument("--mode", choices=["generate", "logits"], default=TRIAGE_MODE,
+                        help="logits = satu forward pass + probabilitas, tanpa reason")
+    parser.add_argument("--reason", action="store_true", help="Mode logits: buat juga alasan singkat")
+    parser.add_argument("--calibrate", metavar="JSONL", help="Fit temperature probabilitas dari kasus berlabel")
+    parser.add_argument("--input", metavar="JSONL", help="Mode batch: satu kasus {\"id\", \"symptoms\"} per baris")
+    parser.add_argument("--output", metavar="JSONL", help="Mode batch: file hasil (di-append, bisa dilanjutkan)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Cetak waktu import per dependency + load model ke stderr")
+    args = parser.parse_args()
+
+    if args.calibrate:
+        report = calibrate(args.calibrate)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report else 1)
+    if args.input:
+        if not args.output:
+            parser.error("--output wajib diisi untuk mode batch")
+        summary = run_batch(args.input, args.output, local=args.local, use_cache=not args.no_cache, mode=args.mode)
+        print(json.dumps(summary, ensure_ascii=False))
+        startup_profile.report()
+        sys.exit(0)
+    if not args.symptoms:
+        parser.error("--symptoms wajib diisi (atau --input untuk mode batch)")
+
+    out = None
+    if not args.local:
+        # Pakai server yang sudah memuat model jika tersedia
+        out = inference_client.request("/triage", {
+            "symptoms": args.symptoms, "no_cache": args.no_cache, "mode": args.mode
+        })
+    if out is None:
+        out = triage_case(args.symptoms, use_cache=not args.no_cache, mode=args.mode)
+    startup_profile.mark("first_result")
+
+    if args.reason and out.get("reason_pending"):
+        res = None
+        if not args.local:
+            res = inference_client.request("/triage/reason", {"symptoms": args.symptoms, "level": out["triage_level"]})
+        out["note"] = res["reason"] if res and res.get("status") == "success" else get_triage_reason(args.symptoms, out["triage_level"])
+        out["reason_pending"] = False
+
     print(json.dumps(out, ensure_ascii=False))
+    startup_profile.report()
@@ -0,0 +1,143 @@
+"""
+MedConnect Edge - Rule Engine Pra-Triase
+Red flag yang jelas ("nyeri dada menjalar ke lengan", "sesak napas") tidak perlu menunggu
+Gemma: satu regex terkompilasi (sinonim Bahasa Indonesia + istilah Inggris dari BakLLaVA)
+mengklasifikasikannya dalam hitungan mikrodetik. Input yang ambigu tetap ke LLM.
+Kriteria mengikuti daftar di TRIAGE_PREFIX (triage_cli.py).
+"""
+
+import os
+import re
+import threading
+import time
+
+ENABLED = os.environ.get("MEDCONNECT_TRIAGE_RULES", "1") != "0"
+
+DAYS_OVER_3 = r"(?:(lebih\s+dari\s+|>\s*)?([4-9]|[1-9]\d)\s+hari|(lebih\s+dari\s+|>\s*)3\s+hari)"
+
+# (level, label, alasan, pola regex). Urutan level menentukan prioritas.
+RULES = [
+    ("EMERGENCY", "sesak_napas", "Sesak napas (red flag)", [
+        # "sesak" saja tidak cukup ("hidung sesak" = pilek); harus ada konteks napas
+        r"sesak\s+na[fp]as", r"na[fp]as\s+(terasa\s+|jadi\s+)?sesak", r"sesak\s+(saat|ketika|waktu)\s+(ber)?na[fp]as",
+        r"(susah|sulit|sukar)\s+(ber)?na[fp]as", r"na[fp]as\s+(berat|tersengal|megap)",
+        r"megap[- ]megap", r"tidak\s+bisa\s+(ber)?na[fp]as", r"shortness\s+of\s+breath", r"difficulty\s+breathing",
+    ]),
+    ("EMERGENCY", "nyeri_dada", "Nyeri dada (red flag jantung)", [
+        r"(nyeri|sakit)\s+(di\s+)?dada", r"dada\s+(terasa\s+)?(berat|tertekan|tertindih|sesak)",
+        r"nyeri\s+menjalar\s+ke\s+(lengan|rahang|punggung)", r"chest\s+pain",
+    ]),
+    ("EMERGENCY", "penurunan_kesadaran", "Pingsan / penurunan kesadaran", [
+        r"pingsan", r"(tidak|tak|gak|nggak)\s+sadar(kan\s+diri)?", r"hilang\s+kesadaran", r"unconscious",
+    ]),
+    ("EMERGENCY", "pendarahan_hebat", "Pendarahan hebat", [
+        r"(pen|per)darahan\s+(hebat|banyak|deras)", r"darah\s+(mengucur|terus\s+keluar|tidak\s+berhenti)",
+        r"muntah\s+darah", r"(severe|heavy)\s+bleeding",
+    ]),
+    ("EMERGENCY", "kejang", "Kejang", [r"kejang", r"seizure"]),
+    ("EMERGENCY", "stroke", "Tanda stroke", [
+        r"(wajah|mulut)\s+(mencong|miring|perot)", r"bicara\s+pelo", r"lumpuh\s+sebelah",
+    ]),
+    # Lebih dari 3 hari: 4+ hari, atau eksplisit "lebih dari 3 hari" / "> 3 hari".
+    # Varian "tinggi" di depan supaya alasan hanya menyebut demam tinggi jika memang tertulis
+    ("URGENT", "demam_tinggi_lama", "Demam tinggi lebih dari 3 hari", [
+        r"demam\s+tinggi\s+(sudah\s+|selama\s+)?" + DAYS_OVER_3,
+    ]),
+    ("URGENT", "demam_lama", "Demam lebih dari 3 hari", [
+        r"demam\s+(sudah\s+|selama\s+)?" + DAYS_OVER_3,
+    ]),
+    ("URGENT", "muntah_terus", "Muntah terus-menerus", [
+        r"muntah\s+(terus|berkali[- ]kali|tidak\s+berhenti)", r"(tidak|gak|nggak)\s+bisa\s+(makan|minum)\s+(dan|atau)\s+(makan|minum)",
+    ]),
+    ("URGENT", "luka_dalam", "Luka dalam / robek", [
+        r"luka\s+(dalam|robek|sobek|menganga|terbuka\s+lebar)", r"deep\s+(wound|laceration)",
+    ]),
+    ("URGENT", "dengue", "Demam disertai bintik merah (curiga DBD)", [
+        # Lookahead: hanya kata kuncinya yang dikonsumsi, red flag di antaranya tetap terbaca
+        r"demam(?=[^.;]*\bbintik\s+merah)", r"bintik\s+merah(?=[^.;]*\bdemam)",
+    ]),
+]
+
+# Negasi dalam 3 kata sebelum frasa, di klausa yang sama: "tidak sesak", "tanpa nyeri dada"
+NEGATIONS = {"tidak", "tak", "tanpa", "bukan", "belum", "gak", "ga", "nggak", "engga", "enggak", "no", "not", "without"}
+NEGATION_WINDOW = 3
+_CLAUSE_BREAK = re.compile(r"[.,;!?]|\b(tapi|tetapi|namun|but)\b")
+
+_PATTERN = re.compile(
+    "|".join(f"(?P<r{i}>\\b(?:{'|'.join(patterns)})\\b)" for i, (_, _, _, patterns) in enumerate(RULES)),
+    re.IGNORECASE,
+)
+
+_lock = threading.Lock()
+_stats = {"rule_decisions": 0, "llm_calls": 0, "fallbacks": 0, "by_rule": {}}
+
+
+def _negated(text, start):
+    """True jika ada kata negasi di NEGATION_WINDOW kata sebelum posisi `start` (klausa yang sama)"""
+    before = text[:start]
+    breaks = list(_CLAUSE_BREAK.finditer(before))
+    if breaks:
+        before = before[breaks[-1].end():]
+    words = before.lower().split()[-NEGATION_WINDOW:]
+    return any(w in NEGATIONS for w in words)
+
+
+def match(text):
+    """Semua rule yang cocok (tanpa yang dinegasikan): list (level, label, alasan)"""
+    found = []
+    for m in _PATTERN.finditer(text):
+        level, label, reason, _ = RULES[int(m.lastgroup[1:])]
+        # "tidak sadar" sendiri diawali negasi, jadi cek sebelum awal frasa
+        if _negated(text, m.start()):
+            continue
+        if label not in [f[1] for f in found]:
+            found.append((level, label, reason))
+    return found
+
+
+def classify(text):
+    """
+    Return dict {level, reason, matched, source="rules", elapsed_us} untuk kasus yang jelas,
+    atau None jika input ambigu dan harus ke LLM.
+    """
+    if not ENABLED:
+        return None
+    t0 = time.perf_counter()
+    found = match(text)
+    if not found:
+        return None
+    for level in ("EMERGENCY", "URGENT"):
+        hits = [f for f in found if f[0] == level]
+        if hits:
+            return {
+                "level": level,
+                "reason": "; ".join(h[2] for h in hits),
+                "matched": [h[1] for h in hits],
+                "source": "rules",
+                "elapsed_us": round((time.perf_counter() - t0) * 1e6, 1),
+            }
+    return None
+
+
+def record(source, matched=None):
+    """Catat asal keputusan triase: rules | llm | fallback"""
+    with _lock:
+        if source == "rules":
+            _stats["rule_decisions"] += 1
+            for label in matched or []:
+                _stats["by_rule"][label] = _stats["by_rule"].get(label, 0) + 1
+        elif source == "llm":
+            _stats["llm_calls"] += 1
+        else:
+            _stats["fallbacks"] += 1
+
+
+def stats():
+    with _lock:
+        decided = _stats["rule_decisions"] + _stats["llm_calls"]
+        return dict(
+            _stats,
+            by_rule=dict(_stats["by_rule"]),
+            enabled=ENABLED,
+            llm_avoided_fraction=round(_stats["rule_decisions"] / decided, 3) if decided else 0.0,
+        )
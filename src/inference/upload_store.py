@@ -0,0 +1,157 @@
+"""
+MedConnect Edge - Upload Store (content-addressed)
+Foto yang di-upload di app.py disimpan sekali per isi file (SHA-256), bukan per nama:
+rerun Streamlit tidak menulis ulang file, dan dua pasien dengan nama file sama
+("IMG_0001.jpg") tidak saling menimpa. Turunan 336px untuk BakLLaVA dibuat saat upload
+(vision_cache.prepare_image, disimpan per hash), jadi stage vision cukup menerima hash.
+
+GC berdasarkan umur (waktu terakhir dipakai) dan total ukuran:
+    ./run.sh python src/inference/upload_store.py gc
+    ./run.sh python src/inference/upload_store.py stats
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import vision_cache
+
+# KONFIGURASI
+STORE_DIR = os.environ.get("MEDCONNECT_UPLOAD_DIR", "data/uploads")
+MAX_AGE_DAYS = float(os.environ.get("MEDCONNECT_UPLOAD_MAX_AGE_DAYS", "7"))
+MAX_MB = float(os.environ.get("MEDCONNECT_UPLOAD_MAX_MB", "512"))
+GC_INTERVAL_S = 3600  # GC otomatis paling sering sekali per jam (dipicu oleh put)
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_lock = threading.Lock()
+_last_gc = 0.0
+_stats = {"stored": 0, "deduplicated": 0, "gc_removed": 0, "gc_freed_mb": 0.0}
+
+
+def is_valid_hash(content_hash):
+    """Hash dari client dipakai sebagai nama file, jadi wajib hex SHA-256 (tanpa path traversal)"""
+    return isinstance(content_hash, str) and bool(_HASH_RE.match(content_hash))
+
+
+def _ext(name):
+    ext = os.path.splitext(name or "")[1].lower()
+    return ext if ext in (".jpg", ".jpeg", ".png", ".webp", ".bmp") else ".img"
+
+
+def path_for(content_hash):
+    """Path file asli untuk hash, atau None jika tidak ada (belum di-upload / sudah di-GC)"""
+    if not is_valid_hash(content_hash):
+        return None
+    matches = glob.glob(os.path.join(STORE_DIR, content_hash[:2], content_hash + ".*"))
+    return next((p for p in matches if not p.endswith(".tmp")), None)
+
+
+def put_bytes(data, name=None, derive=True):
+    """
+    Simpan isi file sekali per hash; upload ulang isi yang sama hanya memperbarui mtime
+    (dipakai GC sebagai waktu terakhir dipakai). Return hash hex.
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = path_for(content_hash)
+    if path is not None:
+        os.utime(path)
+        _stats["deduplicated"] += 1
+    else:
+        path = os.path.join(STORE_DIR, content_hash[:2], content_hash + _ext(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        _stats["stored"] += 1
+
+    if derive:
+        try:
+            # Turunan resolusi CLIP per hash; sudah ada -> tidak di-decode ulang
+            vision_cache.prepare_image(path, content_hash=content_hash)
+        except Exception:
+            # Gambar rusak: biarkan stage vision yang melaporkan error-nya
+            pass
+
+    maybe_gc()
+    return content_hash
+
+
+def _entries():
+    """(mtime, size, path, hash) semua file asli di store"""
+    out = []
+    for path in glob.glob(os.path.join(STORE_DIR, "??", "*")):
+        if path.endswith(".tmp"):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        out.append((st.st_mtime, st.st_size, path, os.path.basename(path).split(".")[0]))
+    return out
+
+
+def _remove(path, content_hash):
+    """Hapus file asli + turunan 336px di cache vision. Return byte yang dibebaskan."""
+    freed = 0
+    for p in [path] + glob.glob(os.path.join(vision_cache.CACHE_DIR, f"{content_hash}_*.png")):
+        try:
+            freed += os.path.getsize(p)
+            os.remove(p)
+        except OSError:
+            pass
+    return freed
+
+
+def gc(max_age_days=None, max_mb=None):
+    """Hapus upload yang lebih tua dari max_age_days, lalu yang tertua sampai total <= max_mb"""
+    global _last_gc
+    max_age_days = MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_mb = MAX_MB if max_mb is None else max_mb
+    with _lock:
+        _last_gc = time.time()
+        entries = sorted(_entries())  # tertua dulu
+        cutoff = time.time() - max_age_days * 86400
+        removed, freed = 0, 0
+        total = sum(e[1] for e in entries)
+        for mtime, size, path, content_hash in entries:
+            if mtime >= cutoff and total <= max_mb * 1024 * 1024:
+                break
+            freed += _remove(path, content_hash)
+            total -= size
+            removed += 1
+        _stats["gc_removed"] += removed
+        _stats["gc_freed_mb"] += freed / 1024 ** 2
+    return {"removed": removed, "freed_mb": round(freed / 1024 ** 2, 2), "remaining": len(entries) - removed,
+            "remaining_mb": round(total / 1024 ** 2, 2)}
+
+
+def maybe_gc():
+    if time.time() - _last_gc >= GC_INTERVAL_S:
+        gc()
+
+
+def stats():
+    entries = _entries()
+    return dict(_stats, gc_freed_mb=round(_stats["gc_freed_mb"], 2), store_dir=STORE_DIR, files=len(entries),
+                size_mb=round(sum(e[1] for e in entries) / 1024 ** 2, 2), max_mb=MAX_MB, max_age_days=MAX_AGE_DAYS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_gc = sub.add_parser("gc", help="Hapus upload lama / melebihi batas ukuran")
+    p_gc.add_argument("--max-age-days", type=float, default=None)
+    p_gc.add_argument("--max-mb", type=float, default=None)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        print(json.dumps(gc(args.max_age_days, args.max_mb)))
+    else:
+        print(json.dumps(stats()))
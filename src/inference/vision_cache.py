@@ -0,0 +1,307 @@
+"""
+MedConnect Edge - Image Preprocessing + CLIP Embedding Cache
+Foto HP (4000px, beberapa MB) dikecilkan ke resolusi input CLIP dan orientasi EXIF-nya
+dinormalkan sebelum masuk BakLLaVA. Hasil proyeksi mmproj (image embedding) di-cache
+per hash gambar di RAM + disk, jadi analisis ulang gambar yang sama (atau dengan --query
+berbeda) tidak perlu encode CLIP lagi.
+"""
+
+import base64
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import startup_profile
+
+# KONFIGURASI
+CACHE_DIR = os.environ.get("MEDCONNECT_CLIP_CACHE_DIR", "data/cache/clip_embed")
+ENABLED = os.environ.get("MEDCONNECT_CLIP_CACHE", "1") != "0"
+CLIP_IMAGE_SIZE = int(os.environ.get("MEDCONNECT_CLIP_IMAGE_SIZE", "336"))  # LLaVA 1.5 = 336px
+MEMORY_ITEMS = int(os.environ.get("MEDCONNECT_CLIP_CACHE_ITEMS", "8"))  # ~9 MB per gambar (576 x 4096 float32)
+DISK_BUDGET_MB = int(os.environ.get("MEDCONNECT_CLIP_CACHE_DISK_MB", "512"))
+
+# install() menambal atribut privat Llava15ChatHandler (_embed_image_bytes, _last_image_embed,
+# _last_image_hash, _llava_cpp) dan membuat struct llava_image_embed sendiri. Hanya dipasang
+# untuk rentang llama-cpp-python yang API-nya dicocokkan: [min, max)
+LLAMA_CPP_TESTED = ((0, 2, 77), (0, 4, 0))
+_HANDLER_ATTRS = ("_embed_image_bytes", "_last_image_embed", "_last_image_hash", "_llava_cpp")
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # key -> (n_image_pos, float32 array)
+
+_stats = {"memory_hits": 0, "disk_hits": 0, "encoded": 0, "preprocessed": 0, "preprocess_hits": 0, "errors": 0,
+          "unsupported": None}
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def prepare_image(image_path, content_hash=None):
+    """
+    Hash isi file, lalu kecilkan ke CLIP_IMAGE_SIZE (sisi terpanjang) + koreksi EXIF.
+    Hasil PNG disimpan per hash, jadi foto yang sama tidak di-decode ulang.
+    Return dict: hash, url (data: URL untuk chat handler), size, orig_size, ms.
+    """
+    t0 = time.time()
+    if content_hash is None:
+        content_hash = file_sha256(image_path)
+    # Pillow di-import saat gambar pertama, bukan saat modul (triase / explain tidak butuh)
+    Image = startup_profile.load("PIL.Image")
+    ImageOps = startup_profile.load("PIL.ImageOps")
+    if Image is None:
+        # Tanpa Pillow: kirim file asli, cache embedding tetap jalan
+        return {"hash": content_hash, "url": f"file://{os.path.abspath(image_path)}",
+                "size": None, "orig_size": None, "ms": round((time.time() - t0) * 1000, 1)}
+
+    cached_path = os.path.join(CACHE_DIR, f"{content_hash}_{CLIP_IMAGE_SIZE}.png")
+    orig_size = None
+    if os.path.exists(cached_path):
+        with open(cached_path, "rb") as f:
+            data = f.read()
+        os.utime(cached_path)  # mtime = terakhir dipakai, untuk urutan evict _prune_disk
+        _stats["preprocess_hits"] += 1
+    else:
+        with Image.open(image_path) as img:
+            orig_size = img.size
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            # LLaVA mem-pad gambar jadi persegi lalu resize ke 336px: detail di atas itu terbuang
+            img.thumbnail((CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, format="PNG")
+            data = buf.getvalue()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Nama tmp per thread: worker prefetch batch bisa memproses gambar identik bersamaan
+        tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cached_path)
+        _prune_disk()
+        _stats["preprocessed"] += 1
+        metrics.record("vision.preprocess", (time.time() - t0) * 1000, orig_size=list(orig_size))
+
+    with Image.open(io.BytesIO(data)) as small:
+        size = small.size
+    return {
+        "hash": content_hash,
+        "url": "data:image/png;base64," + base64.b64encode(data).decode("ascii"),
+        "size": size,
+        "orig_size": orig_size,
+        "ms": round((time.time() - t0) * 1000, 1),
+    }
+
+
+def _model_tag(clip_model_path):
+    st = os.stat(clip_model_path)
+    return f"{os.path.abspath(clip_model_path)}:{st.st_size}:{int(st.st_mtime)}"
+
+
+def _embed_key(model_tag, image_bytes):
+    h = hashlib.sha256(model_tag.encode("utf-8"))
+    h.update(image_bytes)
+    return h.hexdigest()[:32]
+
+
+def _memory_put(key, value):
+    with _lock:
+        _memory[key] = value
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ITEMS:
+            _memory.popitem(last=False)
+
+
+def _memory_get(key):
+    with _lock:
+        value = _memory.get(key)
+        if value is not None:
+            _memory.move_to_end(key)
+        return value
+
+
+def _load_from_disk(key):
+    path = os.path.join(CACHE_DIR, key + ".npy")
+    if not os.path.exists(path):
+        return None
+    # numpy baru di-import saat embedding pertama (upload_store / triase tidak butuh)
+    import numpy as np
+    try:
+        array = np.load(path)
+        os.utime(path)
+        return int(array.shape[0]), array.reshape(-1)
+    except Exception:
+        os.remove(path)
+        return None
+
+
+def _save_to_disk(key, n_image_pos, array):
+    import numpy as np
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, key + ".npy")
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array.reshape(n_image_pos, -1))
+    os.replace(path + ".tmp", path)
+    _prune_disk()
+
+
+def _prune_disk():
+    """
+    Hapus file tertua (embedding .npy dan turunan {hash}_336.png) jika folder cache melebihi
+    DISK_BUDGET_MB. Turunan yang terhapus dibuat ulang dari file asli saat gambar dipakai lagi.
+    """
+    files = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith((".npy", ".png")):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # dihapus thread lain
+        files.append((st.st_mtime, st.st_size, path))
+    total = 0
+    for _, size, path in sorted(files, reverse=True):
+        total += size
+        if total > DISK_BUDGET_MB * 1024 * 1024:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_libc = None
+
+
+def _to_embed(llava_cpp, n_image_pos, array):
+    """
+    Bangun llava_image_embed dari array cache. Memori dialokasikan dengan malloc
+    karena chat handler nanti membebaskannya lewat llava_image_embed_free (free()).
+    """
+    import numpy as np
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        _libc.malloc.restype = ctypes.c_void_p
+        _libc.malloc.argtypes = [ctypes.c_size_t]
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    data = _libc.malloc(array.nbytes)
+    ctypes.memmove(data, array.ctypes.data, array.nbytes)
+    embed = ctypes.cast(_libc.malloc(ctypes.sizeof(llava_cpp.llava_image_embed)),
+                        ctypes.POINTER(llava_cpp.llava_image_embed))
+    embed.contents.embed = ctypes.cast(data, ctypes.POINTER(ctypes.c_float))
+    embed.contents.n_image_pos = n_image_pos
+    return embed
+
+
+def _version_tuple(version):
+    parts = []
+    for part in str(version).split(".")[:3]:
+        digits = "".join(c for c in part if c.isdigit()) or "0"
+        parts.append(int(digits))
+    return tuple(parts + [0] * (3 - len(parts)))
+
+
+def _unsupported_reason(handler):
+    """None jika handler cocok dengan API privat yang ditambal install(), selain itu alasannya"""
+    llama_cpp = startup_profile.load("llama_cpp")
+    version = getattr(llama_cpp, "__version__", None)
+    low, high = LLAMA_CPP_TESTED
+    if version is None or not low <= _version_tuple(version) < high:
+        return f"llama_cpp {version} di luar rentang teruji {low}..{high}"
+    missing = [a for a in _HANDLER_ATTRS if not hasattr(handler, a)]
+    if missing or not callable(handler._embed_image_bytes):
+        return f"atribut chat handler berubah: {missing or ['_embed_image_bytes']}"
+    llava_cpp = handler._llava_cpp
+    struct = getattr(llava_cpp, "llava_image_embed", None)
+    expected = [("embed", ctypes.POINTER(ctypes.c_float)), ("n_image_pos", ctypes.c_int)]
+    if struct is None or [tuple(f[:2]) for f in getattr(struct, "_fields_", [])] != expected:
+        return "layout struct llava_image_embed berubah"
+    if not hasattr(llava_cpp, "llava_image_embed_free"):
+        return "llava_image_embed_free tidak ada"
+    # Struct dari cache dialokasikan dengan malloc libc proses ini lalu dibebaskan libllava
+    # dengan free(): hanya aman jika keduanya memakai allocator yang sama (satu libc)
+    if not sys.platform.startswith(("linux", "darwin")) or ctypes.util.find_library("c") is None:
+        return f"allocator libllava tidak dijamin sama dengan libc di {sys.platform}"
+    return None
+
+
+def install(llm, clip_model_path):
+    """
+    Bungkus `_embed_image_bytes` chat handler LLaVA milik `llm` dengan cache RAM + disk.
+    Aman dipanggil berulang; return False (jalur asli tanpa cache, alasan di stats()["unsupported"])
+    jika versi llama_cpp / atribut privat / layout struct tidak sesuai yang sudah diuji.
+    """
+    handler = getattr(llm, "chat_handler", None)
+    if not ENABLED or handler is None:
+        return False
+    if getattr(handler, "_medconnect_cached", False):
+        return True
+    reason = _unsupported_reason(handler)
+    if reason is not None:
+        if _stats["unsupported"] != reason:
+            sys.stderr.write(f"⚠️  Cache CLIP embedding dimatikan: {reason}\n")
+        _stats["unsupported"] = reason
+        return False
+
+    original = handler._embed_image_bytes
+    model_tag = _model_tag(clip_model_path)
+    n_embd = llm.n_embd()
+
+    def cached_embed_image_bytes(image_bytes, n_threads_batch=1):
+        key = _embed_key(model_tag, image_bytes)
+        if handler._last_image_embed is not None and handler._last_image_hash == key:
+            _stats["memory_hits"] += 1
+            return handler._last_image_embed
+
+        try:
+            entry = _memory_get(key)
+            if entry is not None:
+                _stats["memory_hits"] += 1
+            else:
+                entry = _load_from_disk(key)
+                if entry is not None:
+                    _stats["disk_hits"] += 1
+                    _memory_put(key, entry)
+            if entry is not None:
+                if handler._last_image_embed is not None:
+                    handler._llava_cpp.llava_image_embed_free(handler._last_image_embed)
+                embed = _to_embed(handler._llava_cpp, *entry)
+                handler._last_image_embed = embed
+                handler._last_image_hash = key
+                return embed
+        except Exception:
+            _stats["errors"] += 1
+
+        # Miss: encode CLIP seperti biasa, lalu salin hasilnya ke cache
+        import numpy as np
+        with metrics.span("vision.image_encode"):
+            embed = original(image_bytes, n_threads_batch)
+        _stats["encoded"] += 1
+        try:
+            n_image_pos = int(embed.contents.n_image_pos)
+            array = np.ctypeslib.as_array(embed.contents.embed, shape=(n_image_pos * n_embd,)).copy()
+            _memory_put(key, (n_image_pos, array))
+            _save_to_disk(key, n_image_pos, array)
+            handler._last_image_hash = key
+        except Exception:
+            _stats["errors"] += 1
+        return embed
+
+    handler._embed_image_bytes = cached_embed_image_bytes
+    handler._medconnect_cached = True
+    return True
+
+
+def stats():
+    return dict(_stats, enabled=ENABLED, cache_dir=CACHE_DIR, image_size=CLIP_IMAGE_SIZE,
+                memory_items=len(_memory), pillow=startup_profile.load("PIL.Image") is not None)
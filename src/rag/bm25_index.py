@@ -0,0 +1,243 @@
+"""
+MedConnect Edge - BM25 Inverted Index
+Pencarian kata kunci untuk istilah sehari-hari ("demam", "bintik merah", "nyeri sendi")
+yang sering terlewat oleh embedding MiniLM. Bobot BM25 setiap posting dihitung saat
+ingestion (build_knowledge.py), jadi query cukup menjumlahkan bobot posting term-nya.
+
+Struktur folder:
+    meta.json           # jumlah chunk, avgdl, k1, b
+    vocab.json          # term -> [offset, df] ke array posting
+    post_docs.npy       # (P,) int32 index chunk, dikelompokkan per term
+    post_weights.npy    # (P,) float32 bobot BM25 (idf * saturasi tf)
+    chunks.jsonl        # {"id", "text", "source", "page"} per chunk
+    chunk_offsets.npy   # (N,) int64 posisi byte tiap baris chunks.jsonl
+"""
+
+import json
+import os
+import re
+import shutil
+from array import array
+
+import numpy as np
+
+BM25_PATH = os.environ.get("MEDCONNECT_BM25_PATH", "data/bm25_index")
+K1 = 1.5
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Kata fungsi Bahasa Indonesia + Inggris yang tidak membantu pencarian
+STOPWORDS = {
+    "yang", "dan", "di", "ke", "dari", "untuk", "pada", "dengan", "ini", "itu", "atau",
+    "adalah", "dalam", "akan", "juga", "oleh", "sebagai", "karena", "ada", "saya", "kami",
+    "the", "of", "and", "to", "in", "is", "a", "an", "for", "on", "with", "be", "are",
+}
+
+
+def tokenize(text):
+    """Huruf kecil, kata >= 2 huruf, tanpa stopword, sufiks '-nya' dibuang (nyerinya -> nyeri)"""
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if len(tok) > 5 and tok.endswith("nya"):
+            tok = tok[:-3]
+        if len(tok) < 2 or tok in STOPWORDS or tok.isdigit():
+            continue
+        tokens.append(tok)
+    return tokens
+
+
+class Bm25Writer:
+    """
+    Bangun index secara streaming. Posting dikumpulkan per run (RUN_POSTINGS) lalu
+    di-spill ke disk terurut per term; close() menggabungkan semua run blok demi blok
+    ke array posting final, jadi memori tetap datar berapa pun jumlah chunk (yang tetap
+    di RAM hanya vocab, df, dan panjang tiap chunk). Bobot BM25 dihitung saat close()
+    karena butuh df + avgdl global.
+    """
+
+    RUN_POSTINGS = 1 << 20  # ~12 MB posting (term, doc, tf) per run
+    BLOCK_POSTINGS = 1 << 18
+
+    def __init__(self, path=BM25_PATH):
+        self.path = path
+        self._build_dir = path.rstrip("/") + ".building"
+        if os.path.exists(self._build_dir):
+            shutil.rmtree(self._build_dir)
+        os.makedirs(self._build_dir)
+        self._chunks = open(os.path.join(self._build_dir, "chunks.jsonl"), "wb")
+        self._offsets = array("q")
+        self._doc_len = array("i")
+        # Posting run yang sedang dibangun (array int ringkas)
+        self._term_ids = array("i")
+        self._docs = array("i")
+        self._tfs = array("i")
+        self._vocab = {}
+        self._df = np.zeros(0, np.int64)
+        self._runs = []
+
+    def append(self, chunks):
+        for chunk in chunks:
+            doc = len(self._offsets)
+            self._offsets.append(self._chunks.tell())
+            self._chunks.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+
+            tokens = tokenize(chunk["text"])
+            self._doc_len.append(len(tokens))
+            counts = {}
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                term_id = self._vocab.setdefault(tok, len(self._vocab))
+                self._term_ids.append(term_id)
+                self._docs.append(doc)
+                self._tfs.append(tf)
+            if len(self._term_ids) >= self.RUN_POSTINGS:
+                self._spill()
+
+    def _spill(self):
+        """Tulis run saat ini ke disk, terurut per term (doc tetap naik di dalam term)"""
+        if not len(self._term_ids):
+            return
+        run = np.stack([
+            np.frombuffer(self._term_ids, dtype=np.int32),
+            np.frombuffer(self._docs, dtype=np.int32),
+            np.frombuffer(self._tfs, dtype=np.int32),
+        ], axis=1)
+        run = run[np.argsort(run[:, 0], kind="stable")]
+        run_path = os.path.join(self._build_dir, f"run_{len(self._runs):04d}.npy")
+        np.save(run_path, run)
+        self._runs.append(run_path)
+
+        counts = np.bincount(run[:, 0], minlength=len(self._vocab))
+        counts[:len(self._df)] += self._df
+        self._df = counts
+        del self._term_ids[:], self._docs[:], self._tfs[:]
+
+    def close(self):
+        self._chunks.close()
+        self._spill()
+        n_docs = len(self._offsets)
+        doc_len = np.frombuffer(self._doc_len, dtype=np.int32).astype(np.float32) if n_docs else np.zeros(0, np.float32)
+        avgdl = float(doc_len.mean()) if n_docs else 0.0
+
+        df = np.zeros(len(self._vocab), np.int64)
+        df[:len(self._df)] = self._df
+        starts = np.concatenate([[0], np.cumsum(df)[:-1]]).astype(np.int64) if len(df) else np.zeros(0, np.int64)
+        total = int(df.sum())
+
+        # Okapi BM25 (idf selalu positif)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        docs_path = os.path.join(self._build_dir, "post_docs.npy")
+        weights_path = os.path.join(self._build_dir, "post_weights.npy")
+        if total:
+            out_docs = np.lib.format.open_memmap(docs_path, mode="w+", dtype=np.int32, shape=(total,))
+            out_weights = np.lib.format.open_memmap(weights_path, mode="w+", dtype=np.float32, shape=(total,))
+            # Merge: offset tiap term di array final sudah diketahui dari df, jadi run (urut doc)
+            # cukup dituang berurutan ke slot term-nya; posting per term tetap urut doc
+            cursor = starts.copy()
+            for run_path in self._runs:
+                run = np.load(run_path, mmap_mode="r")
+                for start in range(0, len(run), self.BLOCK_POSTINGS):
+                    block = np.asarray(run[start:start + self.BLOCK_POSTINGS])
+                    term_ids, docs = block[:, 0], block[:, 1]
+                    tfs = block[:, 2].astype(np.float32)
+                    rank = np.arange(len(term_ids)) - np.searchsorted(term_ids, term_ids, side="left")
+                    pos = cursor[term_ids] + rank
+                    norm = K1 * (1.0 - B + B * doc_len[docs] / max(avgdl, 1e-6))
+                    out_docs[pos] = docs
+                    out_weights[pos] = idf[term_ids] * tfs * (K1 + 1.0) / (tfs + norm)
+                    cursor += np.bincount(term_ids, minlength=len(cursor))
+                del run
+                os.remove(run_path)
+            out_docs.flush()
+            out_weights.flush()
+            del out_docs, out_weights
+        else:
+            np.save(docs_path, np.zeros(0, np.int32))
+            np.save(weights_path, np.zeros(0, np.float32))
+
+        np.save(os.path.join(self._build_dir, "chunk_offsets.npy"), np.frombuffer(self._offsets, dtype=np.int64) if n_docs else np.zeros(0, np.int64))
+        with open(os.path.join(self._build_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({t: [int(starts[i]), int(df[i])] for t, i in self._vocab.items()}, f, ensure_ascii=False)
+        with open(os.path.join(self._build_dir, "meta.json"), "w") as f:
+            json.dump({"count": n_docs, "avgdl": avgdl, "k1": K1, "b": B, "terms": len(self._vocab)}, f, indent=2)
+
+        old_dir = self.path.rstrip("/") + ".old"
+        if os.path.exists(self.path):
+            if os.path.exists(old_dir):
+                shutil.rmtree(old_dir)
+            os.rename(self.path, old_dir)
+        os.rename(self._build_dir, self.path)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+
+
+def iter_chunks(path=BM25_PATH):
+    """Semua chunk di index (dipakai build incremental untuk menyalin chunk lama)"""
+    with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class Bm25Index:
+    """Reader lazy: vocab + array posting baru dibuka saat query pertama (array di-mmap)"""
+
+    def __init__(self, path=BM25_PATH):
+        self.path = path
+        self._loaded = False
+
+    @staticmethod
+    def exists(path=BM25_PATH):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def _load(self):
+        if self._loaded:
+            return
+        with open(os.path.join(self.path, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(self.path, "vocab.json"), encoding="utf-8") as f:
+            self._vocab = json.load(f)
+        self._docs = np.load(os.path.join(self.path, "post_docs.npy"), mmap_mode="r")
+        self._weights = np.load(os.path.join(self.path, "post_weights.npy"), mmap_mode="r")
+        self._offsets = np.load(os.path.join(self.path, "chunk_offsets.npy"), mmap_mode="r")
+        self._loaded = True
+
+    def chunk(self, doc):
+        """Baca satu chunk langsung dari posisinya di chunks.jsonl"""
+        with open(os.path.join(self.path, "chunks.jsonl"), "rb") as f:
+            f.seek(int(self._offsets[doc]))
+            return json.loads(f.readline().decode("utf-8"))
+
+    def search(self, query_text, k=3):
+        """Return list (score, chunk dict) urut dari skor BM25 tertinggi"""
+        self._load()
+        n_docs = self.meta["count"]
+        postings = [self._vocab[t] for t in set(tokenize(query_text)) if t in self._vocab]
+        if not postings or n_docs == 0:
+            return []
+
+        docs = np.concatenate([self._docs[start:start + df] for start, df in postings])
+        weights = np.concatenate([self._weights[start:start + df] for start, df in postings])
+        scores = np.bincount(docs, weights=weights, minlength=n_docs)
+
+        hits = np.count_nonzero(scores)
+        k = min(k, hits)
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunk(int(i))) for i in top]
+
+
+def reciprocal_rank_fusion(rankings, k=3, c=60):
+    """
+    Gabungkan beberapa ranking (list teks, urut relevansi) dengan RRF:
+    skor = sum 1 / (c + rank). Tidak perlu menyamakan skala skor BM25 dan cosine.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, text in enumerate(ranking):
+            fused[text] = fused.get(text, 0.0) + 1.0 / (c + rank + 1)
+    return [text for text, _ in sorted(fused.items(), key=lambda x: -x[1])[:k]]
@@ -1,55 +1,443 @@
+import argparse
+import hashlib
+import json
 import os
 import glob
-from langchain_community.document_loaders import PyPDFLoader
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 
+import bm25_index
+import vector_index
+
 # --- KONFIGURASI ---
 DATA_PATH = "data/guidelines"
 DB_PATH = "data/vectorstore"
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2" # Model kecil & cepat
+RAG_BACKEND = os.environ.get("MEDCONNECT_RAG_BACKEND", "chroma") # chroma | numpy | both
+BUILD_BM25 = os.environ.get("MEDCONNECT_BM25_INDEX", "1") == "1" # index kata kunci untuk retrieval hybrid
+
+# Pipeline ingestion: parser PDF paralel -> splitter -> embedding per batch
+WORKERS = int(os.environ.get("MEDCONNECT_INGEST_WORKERS", os.cpu_count() or 2))
+EMBED_BATCH = int(os.environ.get("MEDCONNECT_INGEST_BATCH", "64"))
+QUEUE_BATCHES = 4
+PAGES_PER_TASK = 8
+
+# Hash tiap PDF + id chunk per store, supaya build ulang hanya memproses yang berubah
+MANIFEST_NAME = "ingest_manifest.json"
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_id(doc_name, page, text):
+    """Id chunk = hash isi, jadi chunk yang tidak berubah tidak perlu di-embed ulang"""
+    return hashlib.sha256(f"{doc_name}\0{page}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+def load_manifest(store_path):
+    path = os.path.join(store_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"embed_model": EMBED_MODEL, "files": {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("embed_model") != EMBED_MODEL:
+        # Model embedding ganti -> semua vektor lama tidak kompatibel
+        return {"embed_model": EMBED_MODEL, "files": {}}
+    return manifest
+
+def save_manifest(store_path, manifest):
+    os.makedirs(store_path, exist_ok=True)
+    path = os.path.join(store_path, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+class PrecomputedEmbeddings:
+    """Embedding function untuk Chroma yang memakai vektor yang sudah dihitung"""
+
+    def __init__(self, base, vectors_by_text):
+        self.base = base
+        self.vectors_by_text = vectors_by_text
+
+    def embed_documents(self, texts):
+        missing = [t for t in texts if t not in self.vectors_by_text]
+        if missing:
+            for text, vec in zip(missing, self.base.embed_documents(missing)):
+                self.vectors_by_text[text] = vec
+        return [list(self.vectors_by_text[t]) for t in texts]
+
+    def embed_query(self, text):
+        return self.base.embed_query(text)
+
+def parse_pages(pdf_file, start, end):
+    """Worker process pool: ekstrak teks halaman [start, end) dari satu PDF"""
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_file)
+    return [(i, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+def count_pages(pdf_file):
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_file).pages)
+
+def iter_pages(pdf_files, workers, pages_per_task=PAGES_PER_TASK):
+    """
+    Stage 1: parse halaman PDF paralel di process pool.
+    Task yang sedang jalan dibatasi (2x jumlah worker) supaya hasil tidak menumpuk di RAM.
+    Yield (nama dokumen, nomor halaman, teks).
+    """
+    tasks = []
+    for pdf_file in pdf_files:
+        n_pages = count_pages(pdf_file)
+        for start in range(0, n_pages, pages_per_task):
+            tasks.append((pdf_file, start, min(start + pages_per_task, n_pages)))
+
+    task_iter = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        def submit_next():
+            task = next(task_iter, None)
+            if task is not None:
+                pending[executor.submit(parse_pages, *task)] = task
+
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_file = pending.pop(future)[0]
+                for page, text in future.result():
+                    yield os.path.basename(pdf_file), page, text
+                submit_next()
+
+class ChromaSink:
+    """Tulis batch chunk ke Chroma memakai vektor yang sudah dihitung stage embedding"""
+
+    name = "chroma"
+    needs_vectors = True
+
+    def __init__(self, manifest, changed, removed):
+        self.embedder = PrecomputedEmbeddings(None, {})
+        self.db = Chroma(persist_directory=DB_PATH, embedding_function=self.embedder)
+        self.existing = set(self.db.get(include=[])["ids"])
+        self.old_ids = set()
+        for name in list(changed) + list(removed):
+            self.old_ids.update(manifest["files"].get(name, {}).get("chunk_ids", []))
+        self.added = 0
+
+    def needs(self, cid):
+        return cid not in self.existing
+
+    def write(self, docs, vectors):
+        pairs = [(d, v) for d, v in zip(docs, vectors) if self.needs(d.metadata["chunk_id"])]
+        if not pairs:
+            return
+        self.embedder.vectors_by_text = {d.page_content: v for d, v in pairs}
+        ids = [d.metadata["chunk_id"] for d, _ in pairs]
+        self.db.add_documents([d for d, _ in pairs], ids=ids)
+        self.existing.update(ids)
+        self.added += len(pairs)
+
+    def finish(self, seen_ids):
+        # Chunk lama dari dokumen yang berubah / dihapus dan tidak muncul lagi
+        stale = (self.old_ids - seen_ids) & self.existing
+        if stale:
+            self.db.delete(ids=sorted(stale))
+        print(f"   ChromaDB: +{self.added} chunk, -{len(stale)} chunk")
+
+class NumpySink:
+    """Tulis batch chunk ke NumPy index baru secara streaming, lalu salin baris lama yang masih berlaku"""
+
+    name = "numpy"
+    needs_vectors = True
+
+    def __init__(self, manifest, changed, removed, dtype):
+        self.path = vector_index.INDEX_PATH
+        self.has_old = vector_index.NumpyVectorIndex.exists(self.path) and bool(manifest["files"])
+        self.old_ids = set()
+        self.keep_ids = set()
+        if self.has_old:
+            for name, info in manifest["files"].items():
+                self.old_ids.update(info.get("chunk_ids", []))
+                if name not in changed and name not in removed:
+                    self.keep_ids.update(info.get("chunk_ids", []))
+        self.writer = vector_index.IndexWriter(self.path, EMBED_MODEL, dtype=dtype)
+        self.added = 0
+
+    def needs(self, cid):
+        # Chunk yang sudah ada di index lama disalin saja, tidak di-embed ulang
+        return cid not in self.old_ids
+
+    def write(self, docs, vectors):
+        rows = [(d, v) for d, v in zip(docs, vectors) if self.needs(d.metadata["chunk_id"])]
+        if not rows:
+            return
+        self.writer.append([v for _, v in rows], [
+            {
+                "id": d.metadata["chunk_id"],
+                "text": d.page_content,
+                "source": d.metadata["source"],
+                "page": d.metadata.get("page"),
+            }
+            for d, _ in rows
+        ])
+        self.added += len(rows)
+        # Id baru dianggap lama supaya duplikat di batch berikutnya tidak ditulis lagi
+        self.old_ids.update(d.metadata["chunk_id"] for d, _ in rows)
 
-def ingest_documents():
+    def finish(self, seen_ids):
+        keep = self.keep_ids | seen_ids
+        copied = 0
+        if self.has_old:
+            for block, chunks in vector_index.iter_rows(self.path):
+                mask = [c["id"] in keep for c in chunks]
+                if any(mask):
+                    self.writer.append(block[mask], [c for c, m in zip(chunks, mask) if m])
+                    copied += sum(mask)
+        self.writer.close()
+        print(f"   NumPy index: +{self.added} chunk baru, {copied} chunk lama dipertahankan")
+
+class Bm25Sink:
+    """Index kata kunci BM25: tidak butuh vektor, bobot dihitung ulang untuk seluruh korpus saat finish"""
+
+    name = "bm25"
+    needs_vectors = False
+
+    def __init__(self, manifest, changed, removed):
+        self.path = bm25_index.BM25_PATH
+        self.has_old = bm25_index.Bm25Index.exists(self.path) and bool(manifest["files"])
+        self.old_ids = set()
+        self.keep_ids = set()
+        if self.has_old:
+            for name, info in manifest["files"].items():
+                self.old_ids.update(info.get("chunk_ids", []))
+                if name not in changed and name not in removed:
+                    self.keep_ids.update(info.get("chunk_ids", []))
+        self.writer = bm25_index.Bm25Writer(self.path)
+        self.added = 0
+
+    def needs(self, cid):
+        return cid not in self.old_ids
+
+    def write(self, docs, vectors):
+        rows = [d for d in docs if self.needs(d.metadata["chunk_id"])]
+        if not rows:
+            return
+        self.writer.append([
+            {
+                "id": d.metadata["chunk_id"],
+                "text": d.page_content,
+                "source": d.metadata["source"],
+                "page": d.metadata.get("page"),
+            }
+            for d in rows
+        ])
+        self.added += len(rows)
+        self.old_ids.update(d.metadata["chunk_id"] for d in rows)
+
+    def finish(self, seen_ids):
+        keep = self.keep_ids | seen_ids
+        copied = 0
+        if self.has_old:
+            kept = [c for c in bm25_index.iter_chunks(self.path) if c["id"] in keep]
+            self.writer.append(kept)
+            copied = len(kept)
+        self.writer.close()
+        print(f"   BM25 index: +{self.added} chunk baru, {copied} chunk lama dipertahankan")
+
+def run_pipeline(pdf_files, sinks, embeddings, workers, batch_size, queue_size):
+    """
+    Stage 1 (process pool) parse halaman -> stage 2 (main thread) split jadi chunk ->
+    stage 3 (thread embedding) embed per batch lalu tulis ke semua store.
+    Queue antar stage 2 dan 3 dibatasi `queue_size` batch, jadi RAM tidak tumbuh dengan ukuran korpus.
+    Return dict chunk id per dokumen (untuk manifest).
+    """
+    # Chunk size 500 kata cukup untuk konteks medis
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    batches = queue.Queue(maxsize=queue_size)
+    errors = []
+    stats = {"pages": 0, "chunks": 0, "embedded": 0}
+
+    def embed_worker():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if errors:
+                continue
+            try:
+                # Batch yang hanya dibutuhkan BM25 tidak perlu di-embed
+                if any(s.needs_vectors and any(s.needs(d.metadata["chunk_id"]) for d in batch) for s in sinks):
+                    vectors = embeddings.embed_documents([d.page_content for d in batch])
+                    stats["embedded"] += len(batch)
+                else:
+                    vectors = [None] * len(batch)
+                for sink in sinks:
+                    sink.write(batch, vectors)
+            except Exception as e:
+                errors.append(e)
+
+    def put(item):
+        while True:
+            if errors:
+                raise errors[0]
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    worker = threading.Thread(target=embed_worker, daemon=True)
+    worker.start()
+
+    chunk_ids = {}
+    queued = set()
+    batch = []
+    t0 = time.time()
+    try:
+        for name, page, text in iter_pages(pdf_files, workers):
+            stats["pages"] += 1
+            page_doc = Document(page_content=text, metadata={"source": name, "page": page})
+            for chunk in text_splitter.split_documents([page_doc]):
+                cid = chunk_id(name, page, chunk.page_content)
+                chunk.metadata["chunk_id"] = cid
+                chunk_ids.setdefault(name, []).append(cid)
+                stats["chunks"] += 1
+                if cid in queued or not any(sink.needs(cid) for sink in sinks):
+                    continue
+                queued.add(cid)
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    put(batch)
+                    batch = []
+
+            if stats["pages"] % 50 == 0:
+                elapsed = max(time.time() - t0, 1e-6)
+                print(f"   ... {stats['pages']} halaman ({stats['pages'] / elapsed:.1f} hal/s), "
+                      f"{stats['chunks']} chunk ({stats['chunks'] / elapsed:.1f} chunk/s)")
+        if batch:
+            put(batch)
+    finally:
+        batches.put(None)
+        worker.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = max(time.time() - t0, 1e-6)
+    print(f"⚡ {stats['pages']} halaman, {stats['chunks']} chunk, {stats['embedded']} di-embed "
+          f"dalam {elapsed:.1f}s -> {stats['pages'] / elapsed:.1f} hal/s, "
+          f"{stats['chunks'] / elapsed:.1f} chunk/s")
+    return chunk_ids
+
+def ingest_documents(backend=RAG_BACKEND, dtype=vector_index.INDEX_DTYPE, rebuild=False,
+                     workers=WORKERS, batch_size=EMBED_BATCH, queue_size=QUEUE_BATCHES, bm25=BUILD_BM25):
     # 1. Cari semua PDF
-    pdf_files = glob.glob(os.path.join(DATA_PATH, "*.pdf"))
+    pdf_files = sorted(glob.glob(os.path.join(DATA_PATH, "*.pdf")))
     if not pdf_files:
         print(f"❌ Tidak ada PDF di folder {DATA_PATH}. Masukkan file dulu!")
         return
 
     print(f"📚 Menemukan {len(pdf_files)} dokumen medis...")
-    
-    documents = []
-    for pdf_file in pdf_files:
-        print(f"   - Membaca: {os.path.basename(pdf_file)}...")
-        loader = PyPDFLoader(pdf_file)
-        documents.extend(loader.load())
+    current = {os.path.basename(p): file_sha256(p) for p in pdf_files}
+    paths = {os.path.basename(p): p for p in pdf_files}
+
+    stores = []
+    if backend in ("chroma", "both"):
+        stores.append(("chroma", DB_PATH))
+    if backend in ("numpy", "both"):
+        stores.append(("numpy", vector_index.INDEX_PATH))
+    if bm25:
+        stores.append(("bm25", bm25_index.BM25_PATH))
+
+    # 2. Bandingkan hash dengan manifest tiap store
+    plans = {}
+    for store, store_path in stores:
+        if rebuild and os.path.exists(store_path):
+            shutil.rmtree(store_path)
+        manifest = load_manifest(store_path)
+        if store == "chroma" and not manifest["files"] and os.path.exists(store_path):
+            # DB lama (full rebuild, tanpa id chunk) tidak bisa di-update incremental
+            shutil.rmtree(store_path)
+        if store == "numpy" and manifest["files"] and not vector_index.NumpyVectorIndex.exists(store_path):
+            manifest = {"embed_model": EMBED_MODEL, "files": {}}
+        if store == "bm25" and manifest["files"] and not bm25_index.Bm25Index.exists(store_path):
+            manifest = {"embed_model": EMBED_MODEL, "files": {}}
+        dtype_changed = (
+            store == "numpy" and bool(manifest["files"])
+            and vector_index.NumpyVectorIndex(store_path).meta["dtype"] != dtype
+        )
+        old = manifest["files"]
+        changed = [n for n in current if old.get(n, {}).get("sha256") != current[n]]
+        removed = [n for n in old if n not in current]
+        # dtype ganti -> index ditulis ulang dari vektor lama, tanpa parse/embed ulang
+        if changed or removed or dtype_changed:
+            plans[store] = (store_path, manifest, changed, removed)
+
+    if not plans:
+        print("✅ Tidak ada perubahan. Knowledge base sudah up-to-date.")
+        return
+
+    # 3. Siapkan store yang perlu di-update
+    sinks = []
+    for store, (store_path, manifest, changed, removed) in plans.items():
+        print(f"💾 Update {store} ({len(changed)} dokumen berubah, {len(removed)} dihapus)...")
+        if store == "chroma":
+            sinks.append(ChromaSink(manifest, changed, removed))
+        elif store == "bm25":
+            sinks.append(Bm25Sink(manifest, changed, removed))
+        else:
+            sinks.append(NumpySink(manifest, changed, removed, dtype))
+
+    # 4. Parse + pecah + embed hanya dokumen baru / berubah (streaming)
+    to_parse = sorted({n for _, _, changed, _ in plans.values() for n in changed})
+    chunk_ids = {}
+    if to_parse:
+        embeddings = None
+        if any(sink.needs_vectors for sink in sinks):
+            print("🧠 Memuat model embedding (MiniLM)...")
+            embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+        print(f"✂️  Memproses {len(to_parse)} dokumen ({workers} worker, batch {batch_size})...")
+        chunk_ids = run_pipeline([paths[n] for n in to_parse], sinks, embeddings, workers, batch_size, queue_size)
+
+    seen_ids = set()
+    for ids in chunk_ids.values():
+        seen_ids.update(ids)
+
+    # 5. Finalisasi tiap store + manifest
+    for sink in sinks:
+        sink.finish(seen_ids)
+        store_path, manifest, changed, removed = plans[sink.name]
+        for name in removed:
+            manifest["files"].pop(name, None)
+        for name in changed:
+            manifest["files"][name] = {
+                "sha256": current[name],
+                "chunk_ids": chunk_ids.get(name, []),
+            }
+        save_manifest(store_path, manifest)
 
-    # 2. Pecah jadi potongan kecil (Chunks)
-    # Chunk size 500 kata cukup untuk konteks medis
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    texts = text_splitter.split_documents(documents)
-    print(f"✂️  Dipecah menjadi {len(texts)} potongan informasi.")
-
-    # 3. Download Model Embedding (Hanya sekali di awal)
-    print("🧠 Memuat model embedding (MiniLM)...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
-
-    # 4. Simpan ke Vector DB (Chroma)
-    print("💾 Menyimpan ke 'Otak' lokal (ChromaDB)...")
-    # Hapus DB lama jika ada biar fresh
-    if os.path.exists(DB_PATH):
-        import shutil
-        shutil.rmtree(DB_PATH)
-        
-    db = Chroma.from_documents(
-        documents=texts, 
-        embedding=embeddings, 
-        persist_directory=DB_PATH
-    )
-    
     print("✅ SELESAI! Pengetahuan medis sudah tertanam di sistem.")
-    print(f"📂 Database tersimpan di: {DB_PATH}")
 
 if __name__ == "__main__":
-    ingest_documents()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["chroma", "numpy", "both"], default=RAG_BACKEND)
+    parser.add_argument("--dtype", choices=["float32", "int8"], default=vector_index.INDEX_DTYPE,
+                        help="Tipe matrix untuk NumPy index (int8 = 4x lebih kecil)")
+    parser.add_argument("--rebuild", action="store_true", help="Hapus store lama dan bangun ulang dari nol")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Jumlah proses parser PDF")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH, help="Jumlah chunk per batch embedding")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_BATCHES, help="Maksimal batch yang antre menunggu embedding")
+    parser.add_argument("--no-bm25", action="store_true", help="Jangan bangun index kata kunci BM25")
+    args = parser.parse_args()
+
+    ingest_documents(backend=args.backend, dtype=args.dtype, rebuild=args.rebuild,
+                     workers=args.workers, batch_size=args.batch_size, queue_size=args.queue_size,
+                     bm25=BUILD_BM25 and not args.no_bm25)
@@ -0,0 +1,188 @@
+"""
+MedConnect Edge - NumPy Vector Index
+Alternatif ringan untuk ChromaDB: embedding chunk disimpan sebagai matrix .npy
+(float32 atau int8 + skala per baris) yang di-memory-map, metadata di chunks.jsonl.
+Query top-k = satu perkalian matrix-vektor, tanpa import langchain/chromadb.
+
+Struktur folder:
+    meta.json        # model embedding, dimensi, dtype, jumlah chunk
+    embeddings.npy   # (N, dim) float32 ternormalisasi, atau int8
+    scales.npy       # (N,) float32, hanya untuk int8
+    chunks.jsonl     # satu baris per chunk: {"id", "text", "source", "page"}
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+INDEX_PATH = os.environ.get("MEDCONNECT_NUMPY_INDEX_PATH", "data/vectorstore_np")
+INDEX_DTYPE = os.environ.get("MEDCONNECT_NUMPY_INDEX_DTYPE", "float32")
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IndexWriter:
+    """
+    Tulis index secara streaming: baris ditambahkan per batch ke file sementara,
+    matrix .npy dibentuk blok demi blok saat close(), jadi memori tetap datar
+    berapa pun jumlah chunk. Index lama baru diganti setelah index baru lengkap.
+    """
+
+    BLOCK_ROWS = 4096
+
+    def __init__(self, path, embed_model, dtype=INDEX_DTYPE):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"dtype tidak didukung: {dtype}")
+        self.path = path
+        self.embed_model = embed_model
+        self.dtype = dtype
+        self.count = 0
+        self.dim = 0
+        self._build_dir = path.rstrip("/") + ".building"
+        if os.path.exists(self._build_dir):
+            shutil.rmtree(self._build_dir)
+        os.makedirs(self._build_dir)
+        self._raw_path = os.path.join(self._build_dir, "embeddings.f32")
+        self._raw = open(self._raw_path, "wb")
+        self._chunks = open(os.path.join(self._build_dir, "chunks.jsonl"), "w", encoding="utf-8")
+
+    def append(self, vectors, chunks):
+        if len(chunks) == 0:
+            return
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+        self.dim = matrix.shape[1]
+        matrix.tofile(self._raw)
+        for chunk in chunks:
+            self._chunks.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        self.count += len(chunks)
+
+    def close(self):
+        self._raw.close()
+        self._chunks.close()
+
+        shape = (self.count, self.dim)
+        out = np.lib.format.open_memmap(
+            os.path.join(self._build_dir, "embeddings.npy"), mode="w+",
+            dtype=np.int8 if self.dtype == "int8" else np.float32, shape=shape
+        )
+        scales = np.ones(self.count, dtype=np.float32)
+        if self.count:
+            raw = np.memmap(self._raw_path, dtype=np.float32, mode="r", shape=shape)
+            for start in range(0, self.count, self.BLOCK_ROWS):
+                block = raw[start:start + self.BLOCK_ROWS]
+                if self.dtype == "int8":
+                    # Kuantisasi simetris per baris: v ~= q * scale
+                    block_scales = np.abs(block).max(axis=1) / 127.0
+                    block_scales[block_scales == 0] = 1.0
+                    out[start:start + len(block)] = np.round(block / block_scales[:, None]).astype(np.int8)
+                    scales[start:start + len(block)] = block_scales
+                else:
+                    out[start:start + len(block)] = block
+            del raw
+        out.flush()
+        del out
+        os.remove(self._raw_path)
+        if self.dtype == "int8":
+            np.save(os.path.join(self._build_dir, "scales.npy"), scales)
+
+        with open(os.path.join(self._build_dir, "meta.json"), "w") as f:
+            json.dump({
+                "embed_model": self.embed_model,
+                "dim": int(self.dim),
+                "count": int(self.count),
+                "dtype": self.dtype,
+            }, f, indent=2)
+
+        # Ganti index lama sekaligus (proses lain yang sudah mmap file lama tetap aman)
+        old_dir = self.path.rstrip("/") + ".old"
+        if os.path.exists(self.path):
+            if os.path.exists(old_dir):
+                shutil.rmtree(old_dir)
+            os.rename(self.path, old_dir)
+        os.rename(self._build_dir, self.path)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+
+
+def save_index(path, embeddings, chunks, embed_model, dtype=INDEX_DTYPE):
+    """Tulis index baru (menimpa yang lama). `chunks` = list dict dengan key 'text'"""
+    writer = IndexWriter(path, embed_model, dtype=dtype)
+    writer.append(embeddings, chunks)
+    writer.close()
+
+
+def iter_rows(path, block_rows=IndexWriter.BLOCK_ROWS):
+    """Baca index per blok sebagai (matrix float32, list chunk) untuk update incremental"""
+    index = NumpyVectorIndex(path)
+    with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as f:
+        for start in range(0, len(index), block_rows):
+            block = np.asarray(index._matrix[start:start + block_rows], dtype=np.float32)
+            if index._scales is not None:
+                block = block * index._scales[start:start + block_rows, None]
+            chunks = [json.loads(f.readline()) for _ in range(len(block))]
+            yield block, chunks
+
+
+class NumpyVectorIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        # mmap: halaman matrix baru dibaca dari disk saat dipakai
+        self._matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self._scales = None
+        if self.meta["dtype"] == "int8":
+            self._scales = np.load(os.path.join(path, "scales.npy"))
+        self._chunks = None
+
+    @staticmethod
+    def exists(path=INDEX_PATH):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def _load_chunks(self):
+        if self._chunks is None:
+            with open(os.path.join(self.path, "chunks.jsonl"), encoding="utf-8") as f:
+                self._chunks = [json.loads(line) for line in f]
+        return self._chunks
+
+    def scores(self, query_vector):
+        """Cosine similarity query terhadap semua chunk"""
+        q = _normalize(np.asarray(query_vector, dtype=np.float32))
+        scores = self._matrix @ q
+        if self._scales is not None:
+            scores = scores * self._scales
+        return scores
+
+    def search(self, query_vector, k=3):
+        """Return list (score, chunk dict) urut dari paling mirip"""
+        if len(self) == 0:
+            return []
+        scores = self.scores(query_vector)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        chunks = self._load_chunks()
+        return [(float(scores[i]), chunks[i]) for i in top]
+
+
+class SentenceEmbedder:
+    """Embedding query langsung via sentence-transformers (tanpa langchain)"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def embed_query(self, text):
+        return self.model.encode(text, normalize_embeddings=True)
+
+    def embed_documents(self, texts, batch_size=64):
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True)